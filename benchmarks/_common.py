@@ -0,0 +1,113 @@
+"""Общие утилиты бенчмарков"""
+
+
+import json
+import logging
+
+from multidict import CIMultiDict
+
+from extbot.api_v2 import ApiV2Sample
+
+V2_HEADERS = {
+    "X-Bot-API-Dialect": "Webim Standard",
+    "X-Bot-API-Version": "2.0",
+    "X-Webim-Version": "10.5.62",
+}
+
+
+def get_quiet_logger():
+    logger = logging.getLogger("extbot.benchmarks")
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+class FakeRequest:
+    """
+    Минимальная замена aiohttp.web.Request, чтобы вызывать обработчики бота
+    напрямую, без сетевого стека
+    """
+
+    def __init__(self, update, headers=None, path="/"):
+        self._body = json.dumps(update).encode()
+        self.headers = CIMultiDict(headers or {})
+        self.path = path
+
+    async def read(self):
+        return self._body
+
+    async def json(self):
+        return json.loads(self._body)
+
+
+class OfflineApiV2Sample(ApiV2Sample):
+    """
+    Бот API 2.0, который вместо запросов к Webim только считает их. Позволяет
+    измерять работу самого бота без влияния сети
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests_made = 0
+
+    async def make_request(self, method, data=None):
+        self.requests_made += 1
+
+
+def make_v2_bot(logger, **kwargs):
+    return OfflineApiV2Sample(
+        logger, "demo.webim.ru", "token", 1, "dep", None, None, **kwargs
+    )
+
+
+def v1_updates(chat_id):
+    """
+    Типичная последовательность обновлений одного чата в API 1.0
+    """
+
+    chat = dict(id=chat_id)
+    return [
+        dict(event="new_chat", chat=chat, visitor=dict(id=chat_id), messages=[]),
+        dict(
+            event="new_message",
+            chat=chat,
+            kind="keyboard_response",
+            response=dict(button=dict(id="say_hi", text="Say hi")),
+        ),
+        dict(event="new_message", chat=chat, kind="visitor", text="Hello"),
+    ]
+
+
+def v2_updates(chat_id):
+    """
+    Типичная последовательность обновлений одного чата в API 2.0
+    """
+
+    return [
+        dict(
+            event="new_chat",
+            chat=dict(id=chat_id),
+            visitor=dict(id=chat_id),
+            messages=[],
+        ),
+        dict(
+            event="new_message",
+            chat_id=chat_id,
+            message=dict(
+                kind="keyboard_response",
+                data=dict(button=dict(id="say_hi", text="Say hi")),
+            ),
+        ),
+        dict(
+            event="new_message",
+            chat_id=chat_id,
+            message=dict(kind="visitor", text="Hello"),
+        ),
+        dict(
+            event="new_message",
+            chat_id=chat_id,
+            message=dict(
+                kind="file_visitor",
+                data=dict(url="https://example.com/f.png", name="f.png"),
+            ),
+        ),
+    ]
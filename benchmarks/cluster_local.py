@@ -0,0 +1,147 @@
+"""
+Локальный кластер из нескольких процессов бота: проверка того, что все обновления
+одного чата обрабатывает один узел, и пропускная способность с пересылкой.
+
+Обновления API 1.0 каждого чата отправляются на случайные узлы. По статистике
+использования каждого узла проверяется, что каждый чат обработан ровно одним узлом.
+
+Запуск из корня репозитория:
+    python benchmarks/cluster_local.py --nodes 3 --chats 1000
+"""
+
+
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+
+from _common import v1_updates
+from aiohttp import ClientError, ClientSession
+from aiohttp.test_utils import unused_port
+
+ADMIN_TOKEN = "cluster-benchmark"
+ADMIN_HEADERS = {"Authorization": f"Token {ADMIN_TOKEN}"}
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Run local extbot cluster, check chat affinity and throughput",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def start_nodes(count):
+    urls = [f"http://127.0.0.1:{unused_port()}" for _ in range(count)]
+    processes = []
+    for url in urls:
+        port = url.rsplit(":", 1)[1]
+        peers = ",".join(peer for peer in urls if peer != url)
+        command = [
+            sys.executable,
+            "-c",
+            "from extbot.server import main; main()",
+            "--host=127.0.0.1",
+            f"--port={port}",
+            f"--cluster-url={url}",
+            f"--cluster-peers={peers}",
+            f"--admin-token={ADMIN_TOKEN}",
+        ]
+        processes.append(
+            subprocess.Popen(
+                command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        )
+    return urls, processes
+
+
+async def wait_ready(session, urls):
+    deadline = time.monotonic() + 30
+    for url in urls:
+        while True:
+            try:
+                async with session.get(url + "/readyz") as response:
+                    if response.status == 200:
+                        break
+            except ClientError:
+                pass
+            if time.monotonic() > deadline:
+                sys.exit(f"Node {url} did not start")
+            await asyncio.sleep(0.1)
+
+
+async def send_chats(session, urls, args):
+    rng = random.Random(args.seed)
+    chats = iter(range(args.chats))
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+        for number in chats:
+            for update in v1_updates(f"chat-{number}"):
+                url = rng.choice(urls) + "/v1"
+                async with session.post(url, json=update) as response:
+                    response.raise_for_status()
+                sent += 1
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return sent
+
+
+async def node_stats(session, url):
+    async with session.get(url + "/admin/analytics", headers=ADMIN_HEADERS) as resp:
+        analytics = await resp.json()
+    async with session.get(url + "/admin/metrics", headers=ADMIN_HEADERS) as resp:
+        metrics = await resp.json()
+
+    new_chats = sum(h["counters"].get("new_chats", 0) for h in analytics["hours"])
+    unique_chats = analytics["unique_total"].get("chats", 0)
+    return new_chats, unique_chats, metrics.get("cluster.forwarded", 0)
+
+
+async def main_async(args, urls):
+    async with ClientSession() as session:
+        await wait_ready(session, urls)
+
+        started = time.perf_counter()
+        sent = await send_chats(session, urls, args)
+        elapsed = time.perf_counter() - started
+        print(f"{sent} updates in {elapsed:.1f} s ({sent / elapsed:.0f}/s)")
+
+        total_new, total_unique = 0, 0
+        for url in urls:
+            new_chats, unique_chats, forwarded = await node_stats(session, url)
+            total_new += new_chats
+            total_unique += unique_chats
+            print(
+                f"  {url}: {new_chats} new chats, ~{unique_chats} chats handled,"
+                f" {forwarded} updates forwarded"
+            )
+
+    # Уникальные чаты считаются приблизительно, поэтому допускается погрешность
+    ok = total_new == args.chats and abs(total_unique - args.chats) <= args.chats * 0.05
+    print(f"  {'OK' if ok else 'FAILED'}: each chat handled by one node")
+    return ok
+
+
+def main():
+    args = get_argument_parser().parse_args()
+    urls, processes = start_nodes(args.nodes)
+    try:
+        ok = asyncio.run(main_async(args, urls))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Время построения индекса FAQ и время поиска ответа на сообщение посетителя.
+
+Запуск из корня репозитория:
+    python benchmarks/faq.py --entries 10000
+"""
+
+
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from extbot.faq import FaqIndex
+
+RU_STEMS = "заказ оплат доставк возврат товар карт адрес курьер скидк аккаунт".split()
+RU_ENDINGS = ["", "а", "ы", "ой", "ами", "ов", "е"]
+EN_WORDS = "order payment delivery refund item card address courier discount".split()
+
+
+def make_vocabulary(size, rng):
+    """
+    Словарь из реальных частых слов и случайных редких, чтобы распределение частот
+    было похоже на настоящую базу FAQ
+    """
+
+    words = [stem + ending for stem in RU_STEMS for ending in RU_ENDINGS] + EN_WORDS
+    letters = "абвгдежзиклмнопрстуфхцчшщэюя"
+    while len(words) < size:
+        words.append("".join(rng.choice(letters) for _ in range(rng.randint(4, 9))))
+    return words
+
+
+def make_question(vocabulary, cum_weights, rng):
+    # Слова выбираются по закону Ципфа: частые в начале словаря, редкие в конце
+    count = rng.randint(3, 10)
+    return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=count))
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure FAQ index build time and query latency",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--questions-per-entry", type=int, default=3)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_argument_parser().parse_args()
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    cum_weights = list(
+        itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1))
+    )
+
+    entries = [
+        dict(
+            questions=[
+                make_question(vocabulary, cum_weights, rng)
+                for _ in range(args.questions_per_entry)
+            ],
+            answer=f"Answer {number}",
+        )
+        for number in range(args.entries)
+    ]
+
+    started = time.perf_counter()
+    faq = FaqIndex(entries)
+    build_time = time.perf_counter() - started
+    print(f"Built index of {len(faq)} questions in {build_time:.2f} s")
+
+    queries = [make_question(vocabulary, cum_weights, rng) for _ in range(args.queries)]
+    latencies = []
+    matched = 0
+    for query in queries:
+        started = time.perf_counter()
+        matched += faq.match(query) is not None
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print(
+        f"{len(queries)} queries: p50 {p50:.0f} us, p99 {p99:.0f} us,"
+        f" max {latencies[-1] * 1e6:.0f} us, matched {matched}"
+    )
+
+
+if __name__ == "__main__":
+    main()
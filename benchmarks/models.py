@@ -0,0 +1,91 @@
+"""
+Стоимость разбора и проверки обновления моделями из extbot.models по сравнению с
+json.loads и обращением к полям словаря, как обработчики делали раньше.
+
+Запуск из корня репозитория:
+    python benchmarks/models.py --rounds 100000
+"""
+
+
+import argparse
+import json
+import time
+
+from _common import v1_updates, v2_updates
+
+from extbot.models import decode_v1_update, decode_v2_update
+
+
+def dict_v1(body):
+    update = json.loads(body)
+    chat_id = update.get("chat", {}).get("id")
+    event = update["event"]
+    if event == "new_message" and update["kind"] == "keyboard_response":
+        return chat_id, update["response"]["button"]["id"]
+    return chat_id, event
+
+
+def model_v1(body):
+    update = decode_v1_update(body)
+    message = update.message
+    if message is not None and message.button_id is not None:
+        return update.chat_id, message.button_id
+    return update.chat_id, update.event
+
+
+def dict_v2(body):
+    update = json.loads(body)
+    event = update["event"]
+    if event == "new_message":
+        message = update["message"]
+        if message["kind"] == "keyboard_response":
+            return update["chat_id"], message["data"]["button"]["id"]
+        return update["chat_id"], message.get("data")
+    return update["chat"]["id"], event
+
+
+def model_v2(body):
+    update = decode_v2_update(body)
+    message = update.message
+    if message is not None:
+        return update.chat_id, message.button_id or message.file_data
+    return update.chat_id, update.event
+
+
+def measure(function, bodies, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for body in bodies:
+            function(body)
+    return (time.perf_counter() - started) / (rounds * len(bodies))
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare update decoding with models to plain json.loads",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--rounds", type=int, default=100_000)
+    return parser
+
+
+def main():
+    args = get_argument_parser().parse_args()
+
+    cases = [
+        ("API v1", v1_updates, dict_v1, model_v1),
+        ("API v2", v2_updates, dict_v2, model_v2),
+    ]
+    for name, make_updates, plain, model in cases:
+        bodies = [json.dumps(update).encode() for update in make_updates("chat-1")]
+        plain_time = measure(plain, bodies, args.rounds)
+        model_time = measure(model, bodies, args.rounds)
+        print(
+            f"{name}: json.loads + dict {plain_time * 1e6:.2f} us,"
+            f" models {model_time * 1e6:.2f} us per update"
+            f" ({model_time / plain_time - 1:+.0%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Воспроизведение записанного трафика (extbot --record-dir) на бота, запущенного в
+этом же процессе, с поддельным Webim на локальном порту. Показывает задержки
+ответов и ошибки; с --report и --baseline — разницу между двумя сборками бота.
+
+Запуск из корня репозитория:
+    python benchmarks/replay.py traffic/ --speed 10 --report before.json
+    python benchmarks/replay.py traffic/ --speed 10 --baseline before.json
+
+Без записи трафика можно воспроизвести синтетические чаты:
+    python benchmarks/replay.py --chats 1000 --speed 0
+"""
+
+
+import argparse
+import asyncio
+import json
+import time
+
+from _common import V2_HEADERS, get_quiet_logger, v2_updates
+from aiohttp import ClientSession, ClientTimeout, web
+from aiohttp.test_utils import unused_port
+
+from extbot.api_v1 import ApiV1Sample
+from extbot.api_v2 import ApiV2Sample
+from extbot.recorder import (
+    add_replay_arguments,
+    read_capture,
+    replay,
+    report,
+    summarize,
+)
+from extbot.router import ApiVersionRouter
+
+HOST = "127.0.0.1"
+
+
+def synthetic_capture(chats, interval):
+    """
+    Запись трафика из типичных последовательностей обновлений API 2.0, по
+    обновлению каждые interval секунд
+    """
+
+    started = time.time()
+    number = 0
+    for chat in range(chats):
+        for update in v2_updates(f"chat-{chat}"):
+            yield dict(
+                time=started + number * interval,
+                path="/",
+                headers=V2_HEADERS,
+                body=json.dumps(update),
+            )
+            number += 1
+
+
+async def start_site(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, port).start()
+    return runner
+
+
+def make_fake_webim(latency):
+    async def handler(request):
+        await request.read()
+        if latency:
+            await asyncio.sleep(latency)
+        return web.json_response(dict(result="ok"))
+
+    app = web.Application()
+    app.add_routes([web.post("/api/bot/v2/{method}", handler)])
+    return app
+
+
+def make_bot_app(webim_url):
+    logger = get_quiet_logger()
+    v1_bot = ApiV1Sample(logger, None, None)
+    v2_bot = ApiV2Sample(logger, "demo.webim.ru", "token", 1, "dep", None, None)
+    # Запросы к Webim уходят на поддельный Webim вместо https://demo.webim.ru
+    v2_bot._api_url = webim_url
+
+    app = web.Application()
+    app.add_routes(ApiVersionRouter(logger, v1_bot, v2_bot).get_routes())
+    app.on_startup.append(v2_bot.startup)
+    app.on_cleanup.append(v2_bot.cleanup)
+    return app, v2_bot
+
+
+async def run(args):
+    webim_port, bot_port = unused_port(), unused_port()
+    webim = await start_site(make_fake_webim(args.webim_latency / 1000), webim_port)
+    app, v2_bot = make_bot_app(f"http://{HOST}:{webim_port}/api/bot/v2/")
+    bot = await start_site(app, bot_port)
+
+    if args.capture:
+        records = read_capture(args.capture)
+    else:
+        records = synthetic_capture(args.chats, args.interval)
+
+    try:
+        timeout = ClientTimeout(total=args.timeout)
+        async with ClientSession(timeout=timeout) as session:
+            started = time.monotonic()
+            results = await replay(
+                session,
+                f"http://{HOST}:{bot_port}",
+                records,
+                args.speed,
+                args.concurrency,
+            )
+            # Ответ webhook не ждёт запросов к Webim, поэтому дожидаемся обработки
+            while len(v2_bot._work_queue) or v2_bot._work_queue.pending_count:
+                await asyncio.sleep(0.01)
+            return summarize(results, time.monotonic() - started)
+    finally:
+        await bot.cleanup()
+        await webim.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded traffic on local bot with fake Webim",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("capture", nargs="?", help="record file or directory")
+    add_replay_arguments(parser)
+    parser.add_argument("--chats", type=int, default=100, help="synthetic chats")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.01,
+        help="seconds between synthetic updates",
+    )
+    parser.add_argument(
+        "--webim-latency", type=float, default=0, help="fake Webim latency, ms"
+    )
+    args = parser.parse_args()
+    report(asyncio.run(run(args)), args)
+
+
+if __name__ == "__main__":
+    main()
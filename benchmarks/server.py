@@ -0,0 +1,120 @@
+"""
+Пропускная способность HTTP-сервера бота с разными наборами настроек (--preset)
+
+Для каждого набора запускается отдельный процесс бота, на его webhook API 1.0
+отправляются обновления типичных чатов, и выводятся число запросов в секунду и
+задержки ответов. Бот API 1.0 отвечает прямо в ответе на webhook, поэтому
+измеряется сам сервер и обработка обновлений, без запросов к Webim.
+
+Запуск из корня репозитория:
+    python benchmarks/server.py --chats 5000 --concurrency 100
+    python benchmarks/server.py --presets throughput --extra=--access-log
+"""
+
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+from _common import v1_updates
+from aiohttp import ClientError, ClientSession, TCPConnector
+from aiohttp.test_utils import unused_port
+
+from extbot.recorder import summarize
+from extbot.tuning import PRESETS
+
+HOST = "127.0.0.1"
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure extbot HTTP server throughput with tuning presets",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--presets", default=",".join(sorted(PRESETS)), help="comma separated presets"
+    )
+    parser.add_argument("--chats", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument(
+        "--extra", action="append", default=[], help="extra option for extbot"
+    )
+    return parser
+
+
+def start_bot(port, preset, extra):
+    command = [
+        sys.executable,
+        "-c",
+        "from extbot.server import main; main()",
+        f"--host={HOST}",
+        f"--port={port}",
+        f"--preset={preset}",
+        *extra,
+    ]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+
+async def wait_ready(session, url):
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            async with session.get(url + "/healthz") as response:
+                if response.status == 200:
+                    return
+        except ClientError:
+            pass
+        if time.monotonic() > deadline:
+            sys.exit(f"Bot {url} did not start")
+        await asyncio.sleep(0.1)
+
+
+async def send_chats(session, url, args):
+    chats = iter(range(args.chats))
+    loop = asyncio.get_running_loop()
+    results = []
+
+    async def worker():
+        for number in chats:
+            for update in v1_updates(f"chat-{number}"):
+                started = loop.time()
+                async with session.post(url + "/v1", json=update) as response:
+                    await response.read()
+                    results.append((loop.time() - started, response.status))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results
+
+
+async def measure(preset, args):
+    port = unused_port()
+    url = f"http://{HOST}:{port}"
+    process = start_bot(port, preset, args.extra)
+    try:
+        connector = TCPConnector(limit=args.concurrency)
+        async with ClientSession(connector=connector) as session:
+            await wait_ready(session, url)
+            started = time.perf_counter()
+            results = await send_chats(session, url, args)
+            return summarize(results, time.perf_counter() - started)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    args = get_argument_parser().parse_args()
+    for preset in args.presets.split(","):
+        summary = asyncio.run(measure(preset, args))
+        rate = summary["requests"] / summary["duration"]
+        print(
+            f"{preset}: {summary['requests']} requests in {summary['duration']:.1f} s"
+            f" ({rate:.0f}/s), p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms,"
+            f" {summary['errors']} errors"
+        )
+
+
+if __name__ == "__main__":
+    main()
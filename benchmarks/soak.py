@@ -0,0 +1,148 @@
+"""
+Длительный прогон обновлений через webhook ботов API 1.0 и API 2.0 с проверкой
+того, что потребление памяти не растёт.
+
+Запуск из корня репозитория (бот должен быть установлен, см. CONTRIBUTING.md):
+    python benchmarks/soak.py --updates 1000000
+"""
+
+
+import argparse
+import asyncio
+import gc
+import sys
+import time
+import tracemalloc
+
+from _common import (
+    V2_HEADERS,
+    FakeRequest,
+    get_quiet_logger,
+    make_v2_bot,
+    v1_updates,
+    v2_updates,
+)
+
+from extbot.api_v1 import ApiV1Sample
+from extbot.memory import get_rss
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Soak test: drive updates through webhooks, check memory is flat",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--api", choices=["v1", "v2", "both"], default="both")
+    parser.add_argument("--updates", type=int, default=1_000_000)
+    parser.add_argument(
+        "--checkpoints", type=int, default=10, help="memory samples per run"
+    )
+    parser.add_argument(
+        "--warmup-checkpoints",
+        type=int,
+        default=2,
+        help="samples to skip before memory is expected to be flat",
+    )
+    parser.add_argument(
+        "--max-traced-growth-kb",
+        type=int,
+        default=512,
+        help="allowed growth of memory traced by tracemalloc after warm-up",
+    )
+    parser.add_argument(
+        "--max-rss-growth-mb",
+        type=int,
+        default=16,
+        help="allowed growth of RSS after warm-up",
+    )
+    parser.add_argument(
+        "--no-tracemalloc",
+        action="store_true",
+        help="run faster, check RSS only",
+    )
+    return parser
+
+
+async def drain(bot):
+    queue = getattr(bot, "_work_queue", None)
+    while queue is not None and (len(queue) or queue.pending_count):
+        await asyncio.sleep(0)
+
+
+def sample_memory():
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    return traced, get_rss() or 0
+
+
+async def soak(name, bot, make_updates, headers, args):
+    updates_per_checkpoint = args.updates // args.checkpoints
+    samples = []
+    sent = 0
+    chat_number = 0
+    started = time.perf_counter()
+
+    for _ in range(args.checkpoints):
+        limit = sent + updates_per_checkpoint
+        while sent < limit:
+            chat_number += 1
+            for update in make_updates(f"chat-{chat_number}"):
+                await bot.webhook(FakeRequest(update, headers))
+                sent += 1
+        await drain(bot)
+        samples.append(sample_memory())
+
+    elapsed = time.perf_counter() - started
+    print(f"{name}: {sent} updates in {elapsed:.1f} s ({sent / elapsed:.0f}/s)")
+    for number, (traced, rss) in enumerate(samples, 1):
+        print(
+            f"  checkpoint {number}: traced={traced / 1024:.0f} KiB rss={rss >> 20} MiB"
+        )
+
+    base_traced, base_rss = samples[args.warmup_checkpoints - 1]
+    traced_growth = max(t for t, _ in samples[args.warmup_checkpoints :]) - base_traced
+    rss_growth = max(r for _, r in samples[args.warmup_checkpoints :]) - base_rss
+
+    ok = rss_growth <= args.max_rss_growth_mb << 20
+    if tracemalloc.is_tracing():
+        ok = ok and traced_growth <= args.max_traced_growth_kb * 1024
+    verdict = "flat" if ok else "GROWING"
+    print(
+        f"  {verdict}: traced growth {traced_growth / 1024:.0f} KiB,"
+        f" rss growth {rss_growth >> 20} MiB after warm-up"
+    )
+    return ok
+
+
+async def main_async(args):
+    logger = get_quiet_logger()
+    ok = True
+
+    if args.api in ("v1", "both"):
+        bot = ApiV1Sample(logger, None, None)
+        ok &= await soak("API v1", bot, v1_updates, {}, args)
+
+    if args.api in ("v2", "both"):
+        bot = make_v2_bot(logger)
+        try:
+            ok &= await soak("API v2", bot, v2_updates, V2_HEADERS, args)
+        finally:
+            await bot.cleanup()
+
+    return ok
+
+
+def main():
+    args = get_argument_parser().parse_args()
+    if args.checkpoints <= args.warmup_checkpoints:
+        sys.exit("--checkpoints must be greater than --warmup-checkpoints")
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+
+    ok = asyncio.run(main_async(args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
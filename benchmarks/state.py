@@ -0,0 +1,117 @@
+"""
+Число операций в секунду для хранилищ состояния из extbot.state, в том числе при
+одновременной работе нескольких процессов с одним файлом SQLite.
+
+Запуск из корня репозитория:
+    python benchmarks/state.py --operations 20000 --processes 4
+"""
+
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from extbot.state import MemoryStateBackend, SqliteStateBackend
+
+BATCH_SIZE = 100
+
+
+async def measure(backend, operations):
+    results = {}
+    keys = [f"chat-{number % 1000}" for number in range(operations)]
+
+    started = time.perf_counter()
+    for key in keys:
+        await backend.set(key, {"state": "main"}, ttl=3600)
+    results["set"] = operations / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for key in keys:
+        await backend.incr(f"rate:{key}", ttl=60)
+    results["incr"] = operations / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for key in keys:
+        await backend.compare_and_set(f"lock:{key}", None, "owner", ttl=60)
+    results["compare_and_set"] = operations / (time.perf_counter() - started)
+
+    batches = [keys[i : i + BATCH_SIZE] for i in range(0, operations, BATCH_SIZE)]
+    started = time.perf_counter()
+    for batch in batches:
+        await backend.get_many(batch)
+    results[f"get_many ({BATCH_SIZE} keys)"] = operations / (
+        time.perf_counter() - started
+    )
+    return results
+
+
+def print_results(name, results):
+    print(name)
+    for operation, ops in results.items():
+        print(f"  {operation}: {ops:,.0f} keys/s")
+
+
+def _incr_worker(path, operations, queue):
+    async def run():
+        backend = SqliteStateBackend(path)
+        started = time.perf_counter()
+        for number in range(operations):
+            await backend.incr(f"rate:chat-{number % 100}")
+        queue.put(operations / (time.perf_counter() - started))
+
+    asyncio.run(run())
+
+
+def measure_processes(path, processes, operations):
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_incr_worker, args=(path, operations, queue))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    rates = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    total = asyncio.run(
+        SqliteStateBackend(path).get_many(f"rate:chat-{n}" for n in range(100))
+    )
+    return sum(rates), sum(total.values())
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure state backend operations per second",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--operations", type=int, default=20_000)
+    parser.add_argument("--processes", type=int, default=4)
+    return parser
+
+
+def main():
+    args = get_argument_parser().parse_args()
+
+    print_results("memory", asyncio.run(measure(MemoryStateBackend(), args.operations)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.db")
+        backend = SqliteStateBackend(path)
+        print_results("sqlite", asyncio.run(measure(backend, args.operations)))
+
+        path = os.path.join(directory, "shared.db")
+        SqliteStateBackend(path)
+        rate, total = measure_processes(path, args.processes, args.operations)
+        expected = args.processes * args.operations
+        print(
+            f"sqlite, {args.processes} processes: incr {rate:,.0f} keys/s in total,"
+            f" counters sum {total} of {expected}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,9 @@ setuptools.setup(
     entry_points={
         "console_scripts": [
             "extbot=extbot.server:main",
+            "extbot-transcript=extbot.transcript:main",
+            "extbot-bulk=extbot.bulk:main",
+            "extbot-replay=extbot.recorder:main",
         ],
     },
     install_requires=[
@@ -0,0 +1,50 @@
+"""Служебный API для администратора бота"""
+
+
+import hmac
+
+from aiohttp import web
+
+ADMIN_PREFIX = "/admin"
+
+
+class AdminApi:
+    """
+    Набор служебных маршрутов с префиксом /admin. Каждый запрос к ним должен
+    содержать заголовок "Authorization: Token <токен администратора>", по аналогии с
+    запросами бота к API Webim
+    """
+
+    def __init__(self, logger, token, metrics):
+        self._log = logger
+        self._token = token
+        self._metrics = metrics
+        self._routes = [web.get(f"{ADMIN_PREFIX}/metrics", self._get_metrics)]
+
+    def add_route(self, method, path, handler):
+        """
+        Зарегистрировать служебный обработчик. Путь указывается без префикса /admin
+        """
+
+        route = web.route(method, ADMIN_PREFIX + path, handler)
+        self._routes.append(route)
+
+    def get_routes(self):
+        return [
+            web.route(route.method, route.path, self._authorized(route.handler))
+            for route in self._routes
+        ]
+
+    def _authorized(self, handler):
+        async def authorized_handler(request):
+            expected = f"Token {self._token}".encode()
+            received = request.headers.get("Authorization", "").encode()
+            if not hmac.compare_digest(expected, received):
+                self._log.warning(f"Rejecting unauthorized request to {request.path}")
+                raise web.HTTPUnauthorized
+            return await handler(request)
+
+        return authorized_handler
+
+    async def _get_metrics(self, request):
+        return web.json_response(self._metrics.snapshot())
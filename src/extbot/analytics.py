@@ -0,0 +1,305 @@
+"""
+Статистика использования бота по часам
+
+Для каждого часа считаются новые чаты, нажатия кнопок, переводы диалогов, полученные
+файлы и число уникальных чатов и посетителей. Уникальные значения не хранятся, а
+оцениваются HyperLogLog: на каждый час и каждый вид уникальных значений уходит
+несколько килобайт памяти независимо от числа чатов. В памяти хранится не больше
+заданного числа последних часов, а статистика периодически сохраняется на диск.
+"""
+
+
+import asyncio
+import base64
+import calendar
+import hashlib
+import json
+import math
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+DEFAULT_RETENTION_HOURS = 48
+DEFAULT_FLUSH_INTERVAL = 60
+HLL_PRECISION = 12
+
+NEW_CHATS = "new_chats"
+BUTTON_CLICKS = "button_clicks"
+FORWARDS = "forwards"
+FILES_RECEIVED = "files_received"
+UNIQUE_CHATS = "chats"
+UNIQUE_VISITORS = "visitors"
+
+
+class HyperLogLog:
+    """
+    Оценка числа уникальных строк с погрешностью около 1.04 / sqrt(2 ** precision)
+    """
+
+    __slots__ = ("_precision", "registers")
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self._precision = precision
+        self.registers = registers or bytearray(1 << precision)
+
+    def add(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        index = hashed & ((1 << self._precision) - 1)
+        rest_bits = 64 - self._precision
+        # Номер первого единичного бита в оставшихся битах хеша
+        rank = rest_bits - (hashed >> self._precision).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        for index, rank in enumerate(other.registers):
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-rank for rank in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_json(self):
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def from_json(cls, value):
+        registers = bytearray(base64.b64decode(value))
+        return cls(len(registers).bit_length() - 1, registers)
+
+
+class HourStats:
+    """
+    Статистика за один час
+    """
+
+    __slots__ = ("hour", "counters", "unique")
+
+    def __init__(self, hour, counters=None, unique=None):
+        self.hour = hour
+        self.counters = counters or {}
+        self.unique = unique or {}
+
+    @property
+    def name(self):
+        return time.strftime("%Y-%m-%dT%H:00Z", time.gmtime(self.hour * 3600))
+
+    def to_json(self):
+        return dict(
+            hour=self.name,
+            counters=self.counters,
+            unique={name: hll.to_json() for name, hll in self.unique.items()},
+        )
+
+    @classmethod
+    def from_json(cls, hour, data):
+        unique = {
+            name: HyperLogLog.from_json(value)
+            for name, value in data.get("unique", {}).items()
+        }
+        return cls(hour, data.get("counters", {}), unique)
+
+    def rollup(self):
+        return dict(
+            hour=self.name,
+            counters=self.counters,
+            unique={name: hll.count() for name, hll in self.unique.items()},
+        )
+
+
+def forward_target(forward_info):
+    """
+    Название цели перевода диалога для статистики
+    """
+
+    if "operator_id" in forward_info:
+        return f"agent:{forward_info['operator_id']}"
+    if "dep_key" in forward_info:
+        return f"department:{forward_info['dep_key']}"
+    return "queue"
+
+
+class Analytics:
+    """
+    Сбор статистики по часам. Если задана директория, статистика каждого часа раз в
+    flush_interval секунд сохраняется в файл и загружается обратно при запуске.
+    Файлы часов старше retention_hours удаляются при сохранении
+    """
+
+    def __init__(
+        self,
+        logger,
+        directory=None,
+        retention_hours=DEFAULT_RETENTION_HOURS,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+    ):
+        self._log = logger
+        self._directory = Path(directory) if directory else None
+        self._retention_hours = retention_hours
+        self._flush_interval = flush_interval
+        self._hours = {}
+        self._current = None
+        self._task = None
+
+    async def startup(self, *_):
+        if self._task is not None or self._directory is None:
+            return
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def cleanup(self, *_):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+
+    def _stats(self):
+        hour = int(time.time() // 3600)
+        current = self._current
+        if current is not None and current.hour == hour:
+            return current
+
+        current = self._hours.get(hour)
+        if current is None:
+            current = self._hours[hour] = HourStats(hour)
+            for old_hour in sorted(self._hours)[: -self._retention_hours]:
+                del self._hours[old_hour]
+        self._current = current
+        return current
+
+    def count(self, name, label=None):
+        counters = self._stats().counters
+        if label is None:
+            counters[name] = counters.get(name, 0) + 1
+        else:
+            labeled = counters.setdefault(name, {})
+            labeled[label] = labeled.get(label, 0) + 1
+
+    def add_unique(self, name, value):
+        if value is None:
+            return
+        unique = self._stats().unique
+        hll = unique.get(name)
+        if hll is None:
+            hll = unique[name] = HyperLogLog()
+        hll.add(str(value))
+
+    def new_chat(self, chat_id, visitor_id):
+        self.count(NEW_CHATS)
+        self.add_unique(UNIQUE_CHATS, chat_id)
+        self.add_unique(UNIQUE_VISITORS, visitor_id)
+
+    def new_message(self, chat_id):
+        self.add_unique(UNIQUE_CHATS, chat_id)
+
+    def button_click(self, button_id):
+        self.count(BUTTON_CLICKS, button_id)
+
+    def forward(self, forward_info):
+        self.count(FORWARDS, forward_target(forward_info))
+
+    def file_received(self):
+        self.count(FILES_RECEIVED)
+
+    def rollups(self):
+        """
+        Статистика по часам и оценка уникальных значений за все хранимые часы
+        """
+
+        totals = {}
+        for stats in self._hours.values():
+            for name, hll in stats.unique.items():
+                total = totals.setdefault(name, HyperLogLog())
+                total.merge(hll)
+
+        return dict(
+            hours=[self._hours[hour].rollup() for hour in sorted(self._hours)],
+            unique_total={name: hll.count() for name, hll in totals.items()},
+        )
+
+    def register_admin_routes(self, admin):
+        admin.add_route("GET", "/analytics", self._get_analytics)
+
+    async def _get_analytics(self, request):
+        return web.json_response(self.rollups())
+
+    async def flush(self):
+        """
+        Сохранить статистику текущего и предыдущего часов на диск и удалить файлы
+        устаревших часов
+        """
+
+        if self._directory is None or not self._hours:
+            return
+
+        recent = sorted(self._hours)[-2:]
+        files = {
+            self._directory / f"{self._hours[hour].name}.json": json.dumps(
+                self._hours[hour].to_json()
+            )
+            for hour in recent
+        }
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, _write_files, files)
+        except OSError as e:
+            self._log.error(f"Error saving analytics: {e}")
+        await loop.run_in_executor(None, self._remove_expired)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    def _first_hour(self):
+        return int(time.time() // 3600) - self._retention_hours + 1
+
+    def _load(self):
+        first_hour = self._first_hour()
+        for path in sorted(self._directory.glob("*.json")):
+            try:
+                hour = _file_hour(path)
+                if hour < first_hour:
+                    continue
+                with open(path, encoding="utf-8") as stats_file:
+                    self._hours[hour] = HourStats.from_json(hour, json.load(stats_file))
+            except (OSError, ValueError) as e:
+                self._log.warning(f"Skipping analytics file {path}: {e}")
+
+    def _remove_expired(self):
+        first_hour = self._first_hour()
+        for path in self._directory.glob("*.json"):
+            try:
+                if _file_hour(path) < first_hour:
+                    path.unlink()
+                    self._log.info(f"Removed expired analytics file {path}")
+            except ValueError:
+                continue  # чужой файл в директории статистики
+            except OSError as e:
+                self._log.error(f"Error removing analytics file {path}: {e}")
+
+
+def _file_hour(path):
+    return calendar.timegm(time.strptime(path.stem, "%Y-%m-%dT%H:00Z")) // 3600
+
+
+def _write_files(files):
+    for path, content in files.items():
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(content, encoding="utf-8")
+        temp_path.replace(path)
@@ -6,10 +6,19 @@ Bot API 1.0 считается устаревшим и поддерживает
 """
 
 
+import logging
 from enum import Enum
 
 from aiohttp import web
-
+from packaging.version import InvalidVersion
+from packaging.version import parse as parse_version
+
+from .flood import DROP, WARN
+from .flow import ActionKind, compile_flow
+from .metrics import Metrics
+from .models import parse_v1_update
+from .pipeline import Pipeline, UpdateContext, decoder, validator
+from .resolver import MessageResolver
 from .utils import pretty_json
 
 
@@ -41,90 +50,205 @@ DO_NOT_UNDERSTAND_TEXT = (
 )
 
 
-class ApiV1Sample:
+MAIN_STATE = "main"
+
+
+def build_default_flow(custom_button_text, custom_button_response):
     """
-    Пример работы с Webim External Bot API 1.0
+    Описание диалога бота по умолчанию в формате extbot.flow
     """
 
-    def __init__(self, logger, custom_button_text, custom_button_response):
-        self._log = logger
-        self._custom_button_text = custom_button_text
-        self._custom_button_response = custom_button_response
-        self._keyboard = self._build_keyboard()
+    def text_and_keyboard(text):
+        return [dict(text=text), dict(keyboard=MAIN_STATE)]
+
+    keyboard = [[button["id"].value for button in row] for row in DEFAULT_KEYBOARD]
+    buttons = {
+        ButtonIds.SAY_HI.value: dict(
+            text=SAY_HI_BUTTON["text"], actions=text_and_keyboard(GREETING_TEXT)
+        ),
+        ButtonIds.SAY_BYE.value: dict(
+            text=SAY_BYE_BUTTON["text"], actions=text_and_keyboard(FAREWELL_TEXT)
+        ),
+        ButtonIds.FORWARD_TO_QUEUE.value: dict(
+            text=FORWARD_TO_QUEUE_BUTTON["text"], actions=[dict(queue=True)]
+        ),
+    }
+
+    if custom_button_text or custom_button_response:
+        buttons[ButtonIds.CUSTOM.value] = dict(
+            text=custom_button_text or DEFAULT_CUSTOM_BUTTON_TEXT,
+            actions=text_and_keyboard(
+                custom_button_response or DEFAULT_CUSTOM_BUTTON_RESPONSE_TEXT
+            ),
+        )
+        keyboard.append([ButtonIds.CUSTOM.value])
 
-    def _build_keyboard(self):
-        keyboard = DEFAULT_KEYBOARD[:]
+    return dict(
+        start=MAIN_STATE,
+        states={MAIN_STATE: dict(keyboard=keyboard)},
+        buttons=buttons,
+        events=dict(new_chat=text_and_keyboard(GREETING_TEXT)),
+        messages=dict(visitor=text_and_keyboard(DO_NOT_UNDERSTAND_TEXT)),
+        unexpected=text_and_keyboard(UNEXPECTED_UPDATE_TEXT),
+    )
 
-        if self._custom_button_text or self._custom_button_response:
-            custom_button = dict(
-                id=ButtonIds.CUSTOM,
-                text=self._custom_button_text or DEFAULT_CUSTOM_BUTTON_TEXT,
-            )
-            keyboard.append([custom_button])
 
-        return keyboard
+class ApiV1Sample:
+    """
+    Пример работы с Webim External Bot API 1.0
+    """
+
+    def __init__(
+        self,
+        logger,
+        custom_button_text,
+        custom_button_response,
+        *,
+        flow=None,
+        faq=None,
+        analytics=None,
+        offload=None,
+        flood=None,
+        metrics=None,
+        middlewares=(),
+    ):
+        self._log = logger
+        self._flow = flow or compile_flow(
+            build_default_flow(custom_button_text, custom_button_response)
+        )
+        self._analytics = analytics
+        self._resolver = MessageResolver(
+            logger, self._flow, faq=faq, analytics=analytics, offload=offload
+        )
+        self._flood = flood
+        self._flood_reply = self._flow.reply(flood.text) if flood else None
+        self._pipeline = Pipeline(
+            metrics or Metrics(),
+            "v1",
+            [
+                ("decode", decoder(logger)),
+                ("validate", validator(parse_v1_update, logger)),
+                ("flood", self._limit_flood if flood else None),
+                *middlewares,
+                ("route", self._route),
+                ("handle", self._handle),
+                ("send", self._send),
+            ],
+        )
 
     async def webhook(self, request):
         """
         Обработчик HTTP-запросов со стороны Webim. В теле запроса получает обновления
-        о событиях в чате, в ответе на запрос отправляет сообщения для посетителя
+        о событиях в чате, в ответе на запрос отправляет сообщения для посетителя.
+        Обновление проходит этапы обработки из extbot.pipeline
         """
 
-        update = await request.json()
-        self._log.debug("Received update:\n" + pretty_json(update))
-        chat_id = update.get("chat", {}).get("id")
-        event = update["event"]
+        return await self._pipeline.run(UpdateContext(request))
 
-        response = self._text_and_keyboard_response(UNEXPECTED_UPDATE_TEXT)
+    async def _limit_flood(self, context, call_next):
+        """
+        Этап flood: не обрабатывать сообщения чата, который присылает их слишком
+        часто. Посетитель один раз получает просьбу не торопиться, а на следующие
+        сообщения бот отвечает пустым ответом, не переводя чат в очередь
+        """
 
-        if event == "new_chat":
-            self._log.info(f"New chat {chat_id!r}")
-            response = self._text_and_keyboard_response(GREETING_TEXT)
+        update = context.update
+        if update.event == "new_message":
+            verdict = await self._flood.check(update.chat_id)
+            if verdict == WARN:
+                response = self._build_response(
+                    self._flood_reply, self._extract_webim_version(context.request)
+                )
+                return web.json_response(response)
+            if verdict == DROP:
+                return web.json_response(dict(has_answer=True, messages=[]))
+        return await call_next(context)
+
+    async def _route(self, context, call_next):
+        """
+        Этап route: выбрать переход из описания диалога в ответ на обновление
+        """
 
-        elif event == "new_message":
+        update = context.update
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Received update:\n" + pretty_json(update.raw))
+        chat_id = update.chat_id
+        event = update.event
+
+        if event == "new_message":
             self._log.info(f"New message in chat {chat_id!r}")
-            message_kind = update["kind"]
-
-            if message_kind == "keyboard_response":
-                button_id = update["response"]["button"]["id"]
-
-                if button_id == ButtonIds.SAY_HI:
-                    response = self._text_and_keyboard_response(GREETING_TEXT)
-                elif button_id == ButtonIds.SAY_BYE:
-                    response = self._text_and_keyboard_response(FAREWELL_TEXT)
-                elif button_id == ButtonIds.FORWARD_TO_QUEUE:
-                    response = dict(has_answer=False)
-                elif button_id == ButtonIds.CUSTOM:
-                    response = self._text_and_keyboard_response(
-                        self._custom_button_response
-                        or DEFAULT_CUSTOM_BUTTON_RESPONSE_TEXT
-                    )
-                else:
-                    self._log.warning(f"Unexpected button id {button_id!r}")
-
-            elif message_kind == "visitor":
-                response = self._text_and_keyboard_response(DO_NOT_UNDERSTAND_TEXT)
+            transition = await self._resolver.resolve(chat_id, update.message)
+        else:
+            transition = self._flow.event(event)
+            if transition is None:
+                self._log.warning(f"Unsupported event {event!r}")
+            elif event == "new_chat":
+                self._log.info(f"New chat {chat_id!r}")
+                if self._analytics is not None:
+                    self._analytics.new_chat(chat_id, update.visitor_id)
+
+        context.transition = transition or self._flow.unexpected
+        context.webim_version = self._extract_webim_version(context.request)
+        return await call_next(context)
+
+    async def _handle(self, context, call_next):
+        """
+        Этап handle: собрать сообщения ответа из действий перехода
+        """
+
+        context.response = self._build_response(
+            context.transition, context.webim_version
+        )
+        return await call_next(context)
+
+    async def _send(self, context, call_next):
+        """
+        Этап send: отправить ответ Webim
+        """
+
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Sending response:\n" + pretty_json(context.response))
+        return web.json_response(context.response)
 
+    def _extract_webim_version(self, request):
+        """
+        Версия Webim из заголовка X-Webim-Version или None, если заголовка нет
+        или версию не удалось разобрать
+        """
+
+        value = request.headers.get("X-Webim-Version")
+        if not value:
+            return None
+        try:
+            return parse_version(value)
+        except InvalidVersion:
+            self._log.warning(f"Invalid X-Webim-Version header {value!r}")
+            return None
+
+    def _build_response(self, transition, webim_version):
+        """
+        Собрать ответ на запрос Webim из действий перехода. В API 1.0 бот может только
+        отправлять сообщения и переводить диалог в очередь
+        """
+
+        messages = []
+
+        for action in transition.actions:
+            if action.kind is ActionKind.SEND:
+                messages.append(action.message)
+            elif action.kind is ActionKind.KEYBOARD:
+                keyboard = self._flow.keyboard_message(
+                    action.state, webim_version, action.page
+                )
+                messages.append(keyboard)
+            elif action.kind is ActionKind.FORWARD and not action.forward_info:
+                if self._analytics is not None:
+                    self._analytics.forward(action.forward_info)
+                return dict(has_answer=False)
             else:
-                self._log.warning(f"Unsupported message kind {message_kind!r}")
+                self._log.warning(
+                    f"Action {action.kind.value!r} of {transition.name!r}"
+                    " is not supported by Bot API v1"
+                )
 
-        else:
-            self._log.warning(f"Unsupported event {event!r}")
-
-        self._log.debug("Sending response:\n" + pretty_json(response))
-        return web.json_response(response)
-
-    def _text_and_keyboard_response(self, text):
-        return dict(
-            has_answer=True,
-            messages=[
-                dict(
-                    kind="operator",
-                    text=text,
-                ),
-                dict(
-                    kind="keyboard",
-                    buttons=self._keyboard,
-                ),
-            ],
-        )
+        return dict(has_answer=True, messages=messages)
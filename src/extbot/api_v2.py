@@ -1,14 +1,42 @@
 """Реализация бота на External Bot API 2.0"""
 
 
+import asyncio
+import contextvars
+import logging
+import time
 from enum import Enum
 from json import JSONDecodeError
 
-from aiohttp import ClientError, ClientSession, ContentTypeError, web
-from aiojobs import Scheduler
+from aiohttp import ClientError, ClientSession, ContentTypeError, TCPConnector, web
+from packaging.version import InvalidVersion
 from packaging.version import parse as parse_version
 
+from .flood import ALLOW, WARN
+from .flow import ActionKind, compile_flow
+from .limiter import DEFAULT_MAX_LIMIT, AdaptiveLimiter
+from .metrics import Metrics
+from .models import FILE_VISITOR, KEYBOARD_RESPONSE, parse_v2_update
+from .outbox import Outbox
+from .pipeline import Pipeline, UpdateContext, decoder, validator
+from .priority import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_HIGH_WATER,
+    DEFAULT_MAX_PENDING,
+    DEFAULT_MAX_WAIT,
+    DEFAULT_ORDER,
+    GREETING,
+    REPLY,
+    URGENT,
+    PriorityWorkQueue,
+    QueueFullError,
+    job_stage,
+)
+from .resolver import MessageResolver
+from .timers import TimingWheel
+from .transcript import INBOUND, OUTBOUND
 from .utils import pretty_json, to_nested
+from .warmup import DEFAULT_KEEPALIVE_INTERVAL, ConnectionWarmer
 
 
 class ButtonIds(str, Enum):
@@ -39,6 +67,10 @@ FWD_DEPARTMENT_BUTTON = dict(
 )
 FWD_QUEUE_BUTTON = dict(id=ButtonIds.FORWARD_TO_QUEUE, text="Forward to queue")
 
+# Момент (по time.monotonic), после которого выполняемое действие перехода
+# бесполезно и запросы к Webim для него не отправляются
+_deadline = contextvars.ContextVar("deadline", default=None)
+
 PREFERRED_BUTTONS_PER_ROW = 2
 
 GREETING_TEXT = "Hi! I am External API 2.0 sample bot. What should I do?"
@@ -56,6 +88,12 @@ DEFAULT_CUSTOM_BUTTON_RESPONSE_TEXT = (
     "Wow, you clicked my custom button. What should I do next?"
 )
 FAREWELL_TEXT = "Bye!"
+INACTIVITY_REMINDER_TEXT = "Are you still there?"
+
+MAIN_STATE = "main"
+# События, после которых бот больше не отвечает в чате
+CHAT_END_EVENTS = ("chat_closed",)
+FWD_QUEUE_MIN_WEBIM_VERSION = "10.4"
 
 SAMPLE_IMAGE = {
     "url": (
@@ -71,6 +109,88 @@ SAMPLE_DOCUMENT = {
 }
 
 
+def build_default_flow(
+    fwd_agent_id, fwd_department_key, custom_button_text, custom_button_response
+):
+    """
+    Описание диалога бота по умолчанию в формате extbot.flow
+    """
+
+    def text_and_keyboard(text):
+        return [dict(text=text), dict(keyboard=MAIN_STATE)]
+
+    def forward(text, forward_action):
+        return [dict(text=text), forward_action]
+
+    keyboard = [[button["id"].value for button in row] for row in DEFAULT_KEYBOARD]
+    buttons = {
+        ButtonIds.SAY_HI.value: dict(
+            text="Say hi", actions=text_and_keyboard(GREETING_TEXT)
+        ),
+        ButtonIds.CLOSE_CHAT.value: dict(
+            text="Close chat", actions=[dict(text=FAREWELL_TEXT), dict(close=True)]
+        ),
+        ButtonIds.SEND_IMAGE.value: dict(
+            text="Send image",
+            actions=[dict(file=SAMPLE_IMAGE)] + text_and_keyboard(WHAT_NEXT_TEXT),
+        ),
+        ButtonIds.SEND_DOCUMENT.value: dict(
+            text="Send document",
+            actions=[dict(file=SAMPLE_DOCUMENT)] + text_and_keyboard(WHAT_NEXT_TEXT),
+        ),
+        ButtonIds.FORWARD_TO_QUEUE.value: dict(
+            text=FWD_QUEUE_BUTTON["text"],
+            min_webim_version=FWD_QUEUE_MIN_WEBIM_VERSION,
+            actions=forward(FORWARD_TO_QUEUE_TEXT, dict(queue=True)),
+        ),
+    }
+    forward_buttons = []
+
+    if fwd_agent_id is not None:
+        buttons[ButtonIds.FORWARD_TO_AGENT.value] = dict(
+            text=FWD_AGENT_BUTTON["text"],
+            actions=forward(
+                FORWARD_TO_AGENT_TEXT.format(agent_id=fwd_agent_id),
+                dict(forward=dict(operator_id=fwd_agent_id)),
+            ),
+        )
+        forward_buttons.append(ButtonIds.FORWARD_TO_AGENT.value)
+    if fwd_department_key is not None:
+        buttons[ButtonIds.FORWARD_TO_DEPARTMENT.value] = dict(
+            text=FWD_DEPARTMENT_BUTTON["text"],
+            actions=forward(
+                FORWARD_TO_DEPARTMENT_TEXT.format(dep_key=fwd_department_key),
+                dict(forward=dict(dep_key=fwd_department_key)),
+            ),
+        )
+        forward_buttons.append(ButtonIds.FORWARD_TO_DEPARTMENT.value)
+    # Кнопка перевода в очередь скрывается в старых версиях Webim, а опустевший
+    # ряд убирается, поэтому раскладка совпадает с раскладкой без этой кнопки
+    forward_buttons.append(ButtonIds.FORWARD_TO_QUEUE.value)
+    keyboard.extend(to_nested(forward_buttons, PREFERRED_BUTTONS_PER_ROW))
+
+    if custom_button_text or custom_button_response:
+        buttons[ButtonIds.CUSTOM.value] = dict(
+            text=custom_button_text or DEFAULT_CUSTOM_BUTTON_TEXT,
+            actions=text_and_keyboard(
+                custom_button_response or DEFAULT_CUSTOM_BUTTON_RESPONSE_TEXT
+            ),
+        )
+        keyboard.append([ButtonIds.CUSTOM.value])
+
+    return dict(
+        start=MAIN_STATE,
+        states={MAIN_STATE: dict(keyboard=keyboard)},
+        buttons=buttons,
+        events=dict(new_chat=text_and_keyboard(GREETING_TEXT)),
+        messages=dict(
+            visitor=text_and_keyboard(DO_NOT_UNDERSTAND_TEXT),
+            file_visitor=text_and_keyboard(FILE_RECEIVED_TEXT),
+        ),
+        unexpected=text_and_keyboard(UNEXPECTED_UPDATE_TEXT),
+    )
+
+
 class ApiV2Sample:
     """
     Пример работы с Webim External Bot API 2.0
@@ -85,18 +205,121 @@ class ApiV2Sample:
         fwd_department_key,
         custom_button_text,
         custom_button_response,
+        *,
+        flow=None,
+        faq=None,
+        downloader=None,
+        files=None,
+        transcript=None,
+        analytics=None,
+        metrics=None,
+        warm_connections=None,
+        keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL,
+        inactivity_reminder=None,
+        inactivity_close=None,
+        inactivity_reminder_text=INACTIVITY_REMINDER_TEXT,
+        max_concurrent_requests=DEFAULT_MAX_LIMIT,
+        max_concurrent_updates=DEFAULT_CONCURRENCY,
+        priority_order=DEFAULT_ORDER,
+        priority_max_wait=DEFAULT_MAX_WAIT,
+        job_timeout=None,
+        cancel_stuck_jobs=False,
+        queue_high_water=DEFAULT_HIGH_WATER,
+        max_queued_updates=DEFAULT_MAX_PENDING,
+        reply_deadline=None,
+        outbox_linger=None,
+        offload=None,
+        flood=None,
+        middlewares=(),
     ):
         self._log = logger
         self._api_domain = api_domain
+        self._api_url = f"https://{api_domain}/api/bot/v2/"
         self._api_token = api_token
-        self._fwd_agent_id = fwd_agent_id
-        self._fwd_department_key = fwd_department_key
-        self._custom_button_text = custom_button_text
-        self._custom_button_response = custom_button_response
+        self._flow = flow or compile_flow(
+            build_default_flow(
+                fwd_agent_id,
+                fwd_department_key,
+                custom_button_text,
+                custom_button_response,
+            )
+        )
+        self._downloader = downloader
+        self._files = files
+        self._transcript = transcript
+        self._analytics = analytics
+        self._resolver = MessageResolver(
+            logger, self._flow, faq=faq, analytics=analytics, offload=offload
+        )
+        self._flood = flood
+        self._flood_reply = self._flow.reply(flood.text) if flood else None
+        self._metrics = metrics or Metrics()
+        self._limiter = AdaptiveLimiter(
+            self._metrics, api_domain, max_limit=max_concurrent_requests
+        )
+        self._work_queue = PriorityWorkQueue(
+            logger,
+            self._metrics,
+            priority_order,
+            max_concurrent_updates,
+            priority_max_wait,
+            job_timeout=job_timeout,
+            cancel_stuck=cancel_stuck_jobs,
+            max_pending=max_queued_updates,
+        )
+        self._queue_high_water = queue_high_water
+        self._reply_deadline = reply_deadline
+        if outbox_linger:
+            self._outbox = Outbox(
+                logger, self._metrics, self._send_buffered, outbox_linger
+            )
+        else:
+            self._outbox = None
+
+        if warm_connections:
+            self._warmer = ConnectionWarmer(
+                logger,
+                self._metrics,
+                f"https://{api_domain}/",
+                warm_connections,
+                keepalive_interval,
+            )
+        else:
+            self._warmer = None
+
+        self._inactivity_reminder = inactivity_reminder
+        self._inactivity_close = inactivity_close
+        self._inactivity_reminder_text = inactivity_reminder_text
+        if inactivity_reminder or inactivity_close:
+            self._inactivity_timers = TimingWheel(logger, self._metrics)
+        else:
+            self._inactivity_timers = None
+
+        self._pipeline = Pipeline(
+            self._metrics,
+            "v2",
+            [
+                ("decode", decoder(logger)),
+                ("validate", validator(parse_v2_update, logger)),
+                ("flood", self._limit_flood if flood else None),
+                *middlewares,
+                ("enqueue", self._enqueue),
+                ("route", self._route),
+                ("handle", self._handle),
+            ],
+        )
 
         self._webim_version = None
         self._init_async_done = False
 
+    @property
+    def flow(self):
+        """
+        Скомпилированный диалог бота
+        """
+
+        return self._flow
+
     def _init_async(self):
         """
         Проинициализировать атрибуты, которые необходимо инициализировать внутри event
@@ -106,139 +329,332 @@ class ApiV2Sample:
         if self._init_async_done:
             return
 
-        self._api_session = ClientSession()
-        self._background = Scheduler()
+        if self._warmer is not None:
+            connector = TCPConnector(keepalive_timeout=self._warmer.keepalive_timeout)
+        else:
+            connector = None
+
+        self._api_session = ClientSession(connector=connector)
+        self._work_queue.start()
+        if self._downloader is not None:
+            self._downloader.start(self._api_session)
+        if self._inactivity_timers is not None:
+            self._inactivity_timers.start()
         self._init_async_done = True
 
+    async def startup(self, *_):
+        """
+        Подготовить бота к работе при запуске сервера: создать сессию и, если
+        настроено, начать прогрев соединений с API Webim
+        """
+
+        self._init_async()
+        if self._warmer is not None:
+            self._warmer.start(self._api_session)
+        if self._transcript is not None:
+            self._transcript.start()
+
+    def register_admin_routes(self, admin):
+        self._work_queue.register_admin_routes(admin)
+
+    def readiness(self):
+        """
+        Проверки готовности бота быстро отвечать посетителям: соединения с Webim
+        прогреты, если настроен прогрев, Webim не отвечает ошибками перегрузки и в
+        очереди ждёт меньше queue_high_water обновлений
+        """
+
+        return dict(
+            warm_connections=self._warmer is None or self._warmer.ready,
+            webim_available=not self._limiter.overloaded,
+            queue_below_high_water=(
+                self._work_queue.pending_count < self._queue_high_water
+            ),
+        )
+
+    def is_ready(self):
+        return all(self.readiness().values())
+
     async def cleanup(self, *_):
+        if self._warmer is not None:
+            await self._warmer.close()
         if self._init_async_done:
+            if self._inactivity_timers is not None:
+                await self._inactivity_timers.close()
+            await self._work_queue.close()
+            if self._outbox is not None:
+                await self._outbox.close()
+            if self._downloader is not None:
+                await self._downloader.close()
             await self._api_session.close()
-            await self._background.close()
-
-    def _build_keyboard(self):
-        keyboard = DEFAULT_KEYBOARD[:]
-        forward_buttons = []
-
-        if self._fwd_agent_id is not None:
-            forward_buttons.append(FWD_AGENT_BUTTON)
-        if self._fwd_department_key is not None:
-            forward_buttons.append(FWD_DEPARTMENT_BUTTON)
-        if self._webim_version and self._webim_version >= parse_version("10.4"):
-            forward_buttons.append(FWD_QUEUE_BUTTON)
-
-        forward_rows = to_nested(forward_buttons, PREFERRED_BUTTONS_PER_ROW)
-        keyboard.extend(forward_rows)
-
-        if self._custom_button_text or self._custom_button_response:
-            custom_button = dict(
-                id=ButtonIds.CUSTOM,
-                text=self._custom_button_text or DEFAULT_CUSTOM_BUTTON_TEXT,
-            )
-            keyboard.append([custom_button])
-
-        return keyboard
+        if self._transcript is not None:
+            await self._transcript.close()
 
     async def webhook(self, request):
         """
         Обработчик HTTP-запросов со стороны Webim. В теле запроса получает обновления
-        о событиях в чате, для ответа на сообщения отправляет ответные запросы к Webim
+        о событиях в чате, для ответа на сообщения отправляет ответные запросы к Webim.
+        Обновление проходит этапы обработки из extbot.pipeline
         """
 
-        self._init_async()
-        self._webim_version = self._extract_webim_version(request)
+        return await self._pipeline.run(UpdateContext(request))
+
+    async def _limit_flood(self, context, call_next):
+        """
+        Этап flood: не ставить в очередь сообщения чата, который присылает их
+        слишком часто, чтобы один чат не занимал очередь и лимит запросов к Webim.
+        Посетитель один раз получает просьбу не торопиться
+        """
 
-        update = await request.json()
-        await self._background.spawn(self._handle_update(update))
+        update = context.update
+        if update.event == "new_message":
+            verdict = await self._flood.check(update.chat_id)
+            if verdict == WARN:
+                self._init_async()
+                self._try_submit(
+                    REPLY,
+                    self._run_transition(update.chat_id, self._flood_reply),
+                    chat_id=update.chat_id,
+                    event="flood",
+                )
+            if verdict != ALLOW:
+                return web.json_response(dict(result="ok"))
+        return await call_next(context)
+
+    async def _enqueue(self, context, call_next):
+        """
+        Этап enqueue: поставить остальные этапы обработки в очередь и сразу ответить
+        Webim. Если очередь переполнена, бот отвечает 503, и Webim повторит
+        обновление позже
+        """
+
+        update = context.update
+        self._init_async()
+        self._webim_version = self._extract_webim_version(context.request)
+        try:
+            self._work_queue.submit(
+                self._priority(update),
+                call_next(context),
+                chat_id=update.chat_id,
+                event=update.event,
+            )
+        except QueueFullError as e:
+            self._log.warning(f"Rejecting update for chat {update.chat_id!r}: {e}")
+            raise web.HTTPServiceUnavailable(text="update queue is full") from e
 
         response = dict(result="ok")
         return web.json_response(response)
 
-    @staticmethod
-    def _extract_webim_version(request):
+    def _try_submit(self, priority, coro, chat_id, event):
+        """
+        Поставить в очередь действие, которое бот выполняет сам, без обновления от
+        Webim. При переполненной очереди действие пропускается
+        """
+
+        try:
+            self._work_queue.submit(priority, coro, chat_id=chat_id, event=event)
+        except QueueFullError as e:
+            self._log.warning(f"Skipping {event!r} in chat {chat_id!r}: {e}")
+
+    def _priority(self, update):
+        """
+        Класс приоритета обновления: новые чаты ждут дольше всех, а нажатия кнопок,
+        которые переводят или закрывают чат, обрабатываются в первую очередь
+        """
+
+        if update.event == "new_chat":
+            return GREETING
+
+        message = update.message
+        if message is not None and message.kind == KEYBOARD_RESPONSE:
+            transition = self._flow.button(message.button_id)
+            if transition is not None and any(
+                action.kind in (ActionKind.FORWARD, ActionKind.CLOSE)
+                for action in transition.actions
+            ):
+                return URGENT
+        return REPLY
+
+    def _extract_webim_version(self, request):
+        """
+        Версия Webim из заголовка X-Webim-Version или None, если заголовка нет
+        или версию не удалось разобрать
+        """
+
         value = request.headers.get("X-Webim-Version")
-        return parse_version(value) if value else None
+        if not value:
+            return None
+        try:
+            return parse_version(value)
+        except InvalidVersion:
+            self._log.warning(f"Invalid X-Webim-Version header {value!r}")
+            return None
 
-    async def _handle_update(self, update):
-        self._log.debug("Received update:\n" + pretty_json(update))
-        event = update["event"]
+    async def _route(self, context, call_next):
+        """
+        Этап route: учесть обновление и выбрать переход из описания диалога
+        """
+
+        update = context.update
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Received update:\n" + pretty_json(update.raw))
+        chat_id = update.chat_id
+        if self._transcript is not None:
+            self._transcript.append(chat_id, INBOUND, update.raw)
+        event = update.event
 
         if event == "new_chat":
-            await self._handle_new_chat(update)
+            self._log.info(f"New chat {chat_id!r}")
+            if self._analytics is not None:
+                self._analytics.new_chat(chat_id, update.visitor_id)
+            transition = self._flow.event(event)
         elif event == "new_message":
-            await self._handle_new_message(update)
+            self._log.info(f"New message in chat {chat_id!r}")
+            message = update.message
+            if message.kind == FILE_VISITOR:
+                if self._analytics is not None:
+                    self._analytics.file_received()
+                if self._downloader is not None:
+                    with job_stage("download"):
+                        await self._downloader.submit(chat_id, message.file_data)
+            transition = await self._resolver.resolve(chat_id, message)
+        elif event in CHAT_END_EVENTS:
+            # Чат закрыл посетитель или оператор: напоминать и закрывать его
+            # больше не нужно
+            self._log.info(f"Chat {chat_id!r} ended with {event!r}")
+            if self._inactivity_timers is not None and chat_id is not None:
+                self._inactivity_timers.cancel(chat_id)
+            return None
         else:
             self._log.warning(f"Unsupported event {event!r}")
+            return None
 
-    async def _handle_new_chat(self, update):
-        chat_id = update["chat"]["id"]
-        self._log.info(f"New chat {chat_id!r}")
-        await self._send_text_and_keyboard(chat_id, GREETING_TEXT)
-
-    async def _handle_new_message(self, update):
-        chat_id = update["chat_id"]
-        self._log.info(f"New message in chat {chat_id!r}")
-        message = update["message"]
-        message_kind = message["kind"]
-
-        if message_kind == "keyboard_response":
-            button_id = message["data"]["button"]["id"]
-
-            if button_id == ButtonIds.SAY_HI:
-                await self._send_text_and_keyboard(chat_id, GREETING_TEXT)
-
-            elif button_id == ButtonIds.SEND_IMAGE:
-                await self.send_file(chat_id, SAMPLE_IMAGE)
-                await self._send_text_and_keyboard(chat_id, WHAT_NEXT_TEXT)
-
-            elif button_id == ButtonIds.SEND_DOCUMENT:
-                await self.send_file(chat_id, SAMPLE_DOCUMENT)
-                await self._send_text_and_keyboard(chat_id, WHAT_NEXT_TEXT)
-
-            elif button_id == ButtonIds.CLOSE_CHAT:
-                await self.send_text_message(chat_id, FAREWELL_TEXT)
-                await self.close_chat(chat_id)
-
-            elif button_id == ButtonIds.FORWARD_TO_AGENT:
-                forward_info = dict(operator_id=self._fwd_agent_id)
-                forward_text = FORWARD_TO_AGENT_TEXT.format(agent_id=self._fwd_agent_id)
-                await self.send_text_message(chat_id, forward_text)
-                await self.forward_chat(chat_id, forward_info)
-
-            elif button_id == ButtonIds.FORWARD_TO_DEPARTMENT:
-                forward_info = dict(dep_key=self._fwd_department_key)
-                forward_text = FORWARD_TO_DEPARTMENT_TEXT.format(
-                    dep_key=self._fwd_department_key
-                )
-                await self.send_text_message(chat_id, forward_text)
-                await self.forward_chat(chat_id, forward_info)
+        context.transition = transition or self._flow.unexpected
+        return await call_next(context)
 
-            elif button_id == ButtonIds.FORWARD_TO_QUEUE:
-                await self.send_text_message(chat_id, FORWARD_TO_QUEUE_TEXT)
-                await self.forward_chat(chat_id, dict())
+    async def _handle(self, context, call_next):
+        """
+        Этап handle: выполнить действия перехода, отправив сообщения в Webim
+        """
 
-            elif button_id == ButtonIds.CUSTOM:
-                await self._send_text_and_keyboard(
-                    chat_id,
-                    self._custom_button_response or DEFAULT_CUSTOM_BUTTON_RESPONSE_TEXT,
-                )
+        chat_id = context.update.chat_id
+        if self._inactivity_timers is not None:
+            self._arm_inactivity_timer(chat_id)
+        await self._run_transition(chat_id, context.transition, context.received)
+        return await call_next(context)
 
-            else:
-                self._log.warning(f"Unexpected button id {button_id!r}")
-                await self._send_text_and_keyboard(chat_id, UNEXPECTED_UPDATE_TEXT)
+    def _arm_inactivity_timer(self, chat_id):
+        """
+        Запустить заново отсчёт времени молчания посетителя в чате. Если посетитель
+        молчит, бот сначала напоминает о себе, а потом закрывает чат
+        """
 
-        elif message_kind == "file_visitor":
-            await self._send_text_and_keyboard(chat_id, FILE_RECEIVED_TEXT)
+        if self._inactivity_reminder:
+            self._inactivity_timers.schedule(
+                chat_id, self._inactivity_reminder, self._on_inactivity_reminder
+            )
+        else:
+            self._inactivity_timers.schedule(
+                chat_id, self._inactivity_close, self._on_inactivity_close
+            )
 
-        elif message_kind == "visitor":
-            await self._send_text_and_keyboard(chat_id, DO_NOT_UNDERSTAND_TEXT)
+    def _on_inactivity_reminder(self, chat_id):
+        self._log.info(f"Visitor is inactive in chat {chat_id!r}, sending reminder")
+        if self._inactivity_close:
+            self._inactivity_timers.schedule(
+                chat_id,
+                self._inactivity_close - self._inactivity_reminder,
+                self._on_inactivity_close,
+            )
+        self._try_submit(
+            REPLY,
+            self.send_text_message(chat_id, self._inactivity_reminder_text),
+            chat_id=chat_id,
+            event="inactivity_reminder",
+        )
 
-        else:
-            self._log.warning(f"Unsupported message kind {message_kind!r}")
-            await self._send_text_and_keyboard(chat_id, UNEXPECTED_UPDATE_TEXT)
+    def _on_inactivity_close(self, chat_id):
+        self._log.info(f"Visitor is inactive in chat {chat_id!r}, closing chat")
+        self._try_submit(
+            URGENT, self.close_chat(chat_id), chat_id=chat_id, event="inactivity_close"
+        )
 
-    async def _send_text_and_keyboard(self, chat_id, text):
-        await self.send_text_message(chat_id, text)
-        await self.send_keyboard(chat_id)
+    async def _run_transition(self, chat_id, transition, received=None):
+        """
+        Выполнить по порядку действия перехода из описания диалога. Отправка
+        текстов, файлов и клавиатур, срок которой с получения обновления received
+        истёк, пропускается. Если включён буфер исходящих сообщений, сообщения
+        отправляются через него
+        """
+
+        buffered = []
+        for action in transition.actions:
+            deadline = self._action_deadline(action, received)
+            if deadline is not None and time.monotonic() > deadline:
+                self._metrics.inc("deadline.dropped_actions")
+                self._log.warning(
+                    f"Dropping expired {action.kind.value!r} action of"
+                    f" {transition.name!r} in chat {chat_id!r},"
+                    f" {time.monotonic() - received:.1f}s after update"
+                )
+                continue
+
+            if self._outbox is not None:
+                if action.kind in (ActionKind.SEND, ActionKind.KEYBOARD):
+                    message = self._action_message(action)
+                    buffered.append(self._outbox.send(chat_id, message, deadline))
+                    continue
+                # Перевод и закрытие чата выполняются после сообщений перед ними
+                await self._outbox.flush(chat_id)
+
+            token = _deadline.set(deadline)
+            try:
+                await self._run_action(chat_id, action)
+            finally:
+                _deadline.reset(token)
+
+        if buffered:
+            with job_stage("outbox"):
+                await asyncio.gather(*buffered)
+
+    def _action_message(self, action):
+        if action.kind is ActionKind.SEND:
+            return action.message
+        return self._flow.keyboard_message(
+            action.state, self._webim_version, action.page
+        )
+
+    async def _send_buffered(self, chat_id, message, deadline):
+        token = _deadline.set(deadline)
+        try:
+            return await self.send_message(chat_id, message)
+        finally:
+            _deadline.reset(token)
+
+    def _action_deadline(self, action, received):
+        if received is None or action.kind not in (
+            ActionKind.SEND,
+            ActionKind.KEYBOARD,
+        ):
+            return None
+        expires = action.expires or self._reply_deadline
+        return received + expires if expires else None
+
+    async def _run_action(self, chat_id, action):
+        if action.kind is ActionKind.SEND:
+            await self.send_message(chat_id, action.message)
+        elif action.kind is ActionKind.KEYBOARD:
+            await self.send_keyboard(chat_id, action.state, action.page)
+        elif action.kind is ActionKind.FORWARD:
+            if self._inactivity_timers is not None:
+                self._inactivity_timers.cancel(chat_id)
+            if self._analytics is not None:
+                self._analytics.forward(action.forward_info)
+            await self.forward_chat(chat_id, action.forward_info)
+        elif action.kind is ActionKind.CLOSE:
+            if self._inactivity_timers is not None:
+                self._inactivity_timers.cancel(chat_id)
+            await self.close_chat(chat_id)
 
     async def send_text_message(self, chat_id, text):
         """
@@ -251,14 +667,14 @@ class ApiV2Sample:
         )
         return await self.send_message(chat_id, message)
 
-    async def send_keyboard(self, chat_id):
+    async def send_keyboard(self, chat_id, state=None, page=0):
         """
-        Отправить в чат клавиатуру с кнопками бота
+        Отправить в чат клавиатуру с кнопками бота. По умолчанию отправляется
+        клавиатура начального состояния диалога, для меню — его первая страница
         """
 
-        message = dict(
-            kind="keyboard",
-            buttons=self._build_keyboard(),
+        message = self._flow.keyboard_message(
+            state or self._flow.start, self._webim_version, page
         )
         return await self.send_message(chat_id, message)
 
@@ -272,7 +688,7 @@ class ApiV2Sample:
             message=message,
         )
 
-        await self.make_request("send_message", data)
+        return await self.make_request("send_message", data)
 
     async def close_chat(self, chat_id):
         """
@@ -280,7 +696,7 @@ class ApiV2Sample:
         """
 
         data = dict(chat_id=chat_id)
-        await self.make_request("close_chat", data)
+        return await self.make_request("close_chat", data)
 
     async def forward_chat(self, chat_id, forward_info):
         """
@@ -288,48 +704,91 @@ class ApiV2Sample:
         """
 
         data = dict(chat_id=chat_id, **forward_info)
-        await self.make_request("redirect_chat", data)
+        return await self.make_request("redirect_chat", data)
 
     async def send_file(self, chat_id, file_data):
         """
-        Отправить в чат файл
+        Отправить в чат файл. Вместо описания файла можно передать имя файла из
+        директории, которую раздаёт бот (см. extbot.files)
         """
 
+        if isinstance(file_data, str):
+            name = file_data
+            file_data = self._files.file_data(name) if self._files else None
+            if file_data is None:
+                self._log.error(f"File {name!r} is not in files directory")
+                return
+
         message = dict(
             kind="file_operator",
             data=file_data,
         )
-        await self.send_message(chat_id, message)
+        return await self.send_message(chat_id, message)
 
     async def make_request(self, method, data=None):
         """
-        Выполнить HTTP-запрос к API Webim и обработать возможные ошибки
+        Выполнить HTTP-запрос к API Webim и обработать возможные ошибки. Возвращает
+        ответ Webim или None, если запрос завершился ошибкой или не отправлен,
+        потому что срок выполняемого действия истёк
         """
 
-        url = f"https://{self._api_domain}/api/bot/v2/{method}"
+        url = self._api_url + method
         headers = {"Authorization": f"Token {self._api_token}"}
-
-        self._log.debug(f"Requesting {url} with data:\n" + pretty_json(data))
-
-        try:
-            response = await self._api_session.post(url, headers=headers, json=data)
-            response_content = await response.json()
-        except ContentTypeError:
-            ct = response.content_type
-            self._log.error(
-                f"Webim returned unexpected Content-Type {ct!r} for url {url!r}"
-            )
-            return
-        except JSONDecodeError:
-            # если дошло до декодирования, то response уже определён и тело получено
-            body = await response.text()
-            self._log.error(f"Webim returned invalid json {body!r} for url {url!r}")
-            return
-        except ClientError as e:
-            self._log.error(f"Request error: {e}")
-            return
-
-        self._log.debug("Received response:\n" + pretty_json(response_content))
+        deadline = _deadline.get()
+        if self._expired(deadline, method, data):
+            return None
+
+        # Этап задания виден в служебном API, пока бот ждёт ответа Webim
+        with job_stage(f"make_request {method}"):
+            # Число одновременных запросов подстраивается под задержку и ошибки Webim
+            await self._limiter.acquire()
+            # Пока запрос ждал места, срок мог истечь. Такой запрос не отправляется
+            # и не попадает в журнал переписки
+            if self._expired(deadline, method, data):
+                self._limiter.abandon()
+                return None
+
+            if self._transcript is not None:
+                record = dict(method=method, data=data)
+                self._transcript.append((data or {}).get("chat_id"), OUTBOUND, record)
+
+            if self._log.isEnabledFor(logging.DEBUG):
+                self._log.debug(f"Requesting {url} with data:\n" + pretty_json(data))
+
+            started = time.monotonic()
+            overloaded = True
+            cancelled = False
+            try:
+                response = await self._api_session.post(url, headers=headers, json=data)
+                overloaded = response.status == 429 or response.status >= 500
+                response_content = await response.json()
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            except ContentTypeError:
+                ct = response.content_type
+                self._log.error(
+                    f"Webim returned unexpected Content-Type {ct!r} for url {url!r}"
+                )
+                return
+            except JSONDecodeError:
+                # если дошло до декодирования, то response уже определён и тело получено
+                body = await response.text()
+                self._log.error(f"Webim returned invalid json {body!r} for url {url!r}")
+                return
+            except ClientError as e:
+                self._log.error(f"Request error: {e}")
+                return
+            finally:
+                if cancelled:
+                    # Запрос отменил сам бот, например при отмене задания или
+                    # остановке: это ничего не говорит о задержке и ошибках Webim
+                    self._limiter.abandon()
+                else:
+                    self._limiter.release(time.monotonic() - started, overloaded)
+
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Received response:\n" + pretty_json(response_content))
 
         if not response.ok or "error" in response_content:
             error_details = dict(
@@ -341,3 +800,17 @@ class ApiV2Sample:
             error_items = (f"{k}={v!r}" for k, v in error_details.items() if v)
             error_string = ", ".join(error_items)
             self._log.error(f"Error returned by Webim: {error_string}")
+            return None
+
+        return response_content
+
+    def _expired(self, deadline, method, data):
+        if deadline is None or time.monotonic() <= deadline:
+            return False
+        chat_id = (data or {}).get("chat_id")
+        self._metrics.inc("deadline.dropped_requests")
+        self._log.warning(
+            f"Dropping expired request {method!r} in chat {chat_id!r},"
+            f" {time.monotonic() - deadline:.1f}s past deadline"
+        )
+        return True
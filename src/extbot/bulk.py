@@ -0,0 +1,566 @@
+"""
+Массовые операции с чатами: рассылка сообщений, закрытие и перевод чатов
+
+Во время инцидентов бывает нужно написать в сотни открытых чатов, закрыть их или
+перевести на операторов. Массовая операция выполняет одно действие бота API 2.0 для
+списка чатов: не больше concurrency чатов одновременно и не чаще rate чатов в
+секунду. Результат по каждому чату сохраняется, поэтому прерванную или отменённую
+операцию можно продолжить: чаты, для которых действие уже выполнено, пропускаются.
+Если задана директория, операции и их результаты переживают перезапуск бота.
+Запуск из командной строки:
+    extbot-bulk --url http://localhost:8000 --admin-token <токен> close_chat ids.txt
+"""
+
+
+import argparse
+import asyncio
+import json
+import secrets
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import ClientError, ClientSession, web
+
+ACTIONS = ("send_text_message", "send_keyboard", "close_chat", "forward_chat")
+FORWARD_KEYS = ("operator_id", "dep_key")
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_RATE = 20.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+
+OK = "ok"
+FAILED = "failed"
+
+RESULTS_SUFFIX = ".results.jsonl"
+
+
+class BulkError(ValueError):
+    pass
+
+
+def _positive(data, key, default, kind):
+    value = data.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, kind) or value <= 0:
+        raise BulkError(f"{key!r} must be a positive number")
+    return value
+
+
+def parse_spec(data, states=None):
+    """
+    Проверить описание массовой операции из запроса администратора и вернуть его в
+    виде словаря с заполненными значениями по умолчанию. Если заданы states, состояние
+    клавиатуры send_keyboard должно быть одним из них
+    """
+
+    if not isinstance(data, dict):
+        raise BulkError("operation must be a JSON object")
+
+    action = data.get("action")
+    if action not in ACTIONS:
+        raise BulkError(f"'action' must be one of {', '.join(ACTIONS)}")
+
+    chat_ids = data.get("chat_ids")
+    if (
+        not isinstance(chat_ids, list)
+        or not chat_ids
+        or not all(isinstance(chat_id, str) and chat_id for chat_id in chat_ids)
+    ):
+        raise BulkError("'chat_ids' must be a non-empty list of strings")
+
+    spec = dict(
+        action=action,
+        # Повторы в списке не должны приводить к повторной отправке
+        chat_ids=list(dict.fromkeys(chat_ids)),
+        concurrency=_positive(data, "concurrency", DEFAULT_CONCURRENCY, int),
+        rate=_positive(data, "rate", DEFAULT_RATE, (int, float)),
+    )
+
+    if action == "send_text_message":
+        text = data.get("text")
+        if not isinstance(text, str) or not text:
+            raise BulkError("'text' is required for send_text_message")
+        spec["text"] = text
+    elif action == "send_keyboard":
+        state = data.get("state")
+        if state is not None and not isinstance(state, str):
+            raise BulkError("'state' must be a string")
+        if state is not None and states is not None and state not in states:
+            raise BulkError(f"State {state!r} is not defined in dialog flow")
+        spec["state"] = state
+    elif action == "forward_chat":
+        forward = data.get("forward")
+        if (
+            not isinstance(forward, dict)
+            or len(forward) != 1
+            or next(iter(forward)) not in FORWARD_KEYS
+        ):
+            raise BulkError(
+                "'forward' must be an object with either 'operator_id' or 'dep_key'"
+            )
+        spec["forward"] = forward
+
+    return spec
+
+
+class BulkOperation:
+    """
+    Массовая операция: описание, состояние и результаты по чатам
+    """
+
+    def __init__(self, operation_id, spec, status=RUNNING, created=None, results=None):
+        self.id = operation_id
+        self.spec = spec
+        self.status = status
+        self.created = created if created is not None else time.time()
+        self.results = results if results is not None else {}
+
+    @property
+    def remaining(self):
+        """
+        Чаты, для которых действие ещё не выполнено успешно
+        """
+
+        return [
+            chat_id
+            for chat_id in self.spec["chat_ids"]
+            if self.results.get(chat_id, {}).get("status") != OK
+        ]
+
+    def progress(self):
+        statuses = [result["status"] for result in self.results.values()]
+        return dict(
+            total=len(self.spec["chat_ids"]),
+            ok=statuses.count(OK),
+            failed=statuses.count(FAILED),
+        )
+
+    def to_json(self, with_results=False):
+        data = dict(
+            id=self.id,
+            status=self.status,
+            created=self.created,
+            spec=self.spec,
+            progress=self.progress(),
+        )
+        if with_results:
+            data["results"] = [
+                dict(chat_id=chat_id, **self.results[chat_id])
+                for chat_id in self.spec["chat_ids"]
+                if chat_id in self.results
+            ]
+        return data
+
+
+class BulkOperations:
+    """
+    Выполнение массовых операций через бота API 2.0. Если задана директория, то для
+    каждой операции в ней хранятся описание <id>.json и результаты по чатам
+    <id>.results.jsonl. Операции, которые выполнялись во время остановки бота, после
+    запуска получают статус interrupted и продолжаются по запросу администратора
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        bot,
+        directory=None,
+        clock=time.monotonic,
+        states=None,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._bot = bot
+        self._states = states
+        self._directory = Path(directory) if directory is not None else None
+        self._clock = clock
+
+        self._operations = {}
+        self._tasks = {}
+        self._closing = False
+
+        metrics.gauge("bulk.running", lambda: len(self._tasks))
+
+    async def startup(self, *_):
+        if self._directory is None:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        operations = await loop.run_in_executor(None, _load_operations, self._directory)
+        for operation in operations:
+            if operation.status == RUNNING:
+                operation.status = INTERRUPTED
+                await self._save(operation)
+            self._operations[operation.id] = operation
+        if operations:
+            self._log.info(f"Loaded {len(operations)} bulk operation(s)")
+
+    async def cleanup(self, *_):
+        self._closing = True
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get(self, operation_id):
+        return self._operations.get(operation_id)
+
+    def operations(self):
+        return sorted(self._operations.values(), key=lambda o: o.created)
+
+    async def start(self, spec):
+        """
+        Начать новую массовую операцию по описанию, проверенному parse_spec
+        """
+
+        operation_id = time.strftime("%Y%m%d%H%M%S") + "-" + secrets.token_hex(3)
+        operation = BulkOperation(operation_id, spec)
+        self._operations[operation_id] = operation
+        await self._save(operation)
+        self._run(operation)
+        return operation
+
+    async def resume(self, operation_id):
+        """
+        Продолжить операцию: выполнить действие для чатов, для которых оно ещё не
+        выполнено или завершилось ошибкой
+        """
+
+        operation = self._operations[operation_id]
+        if operation_id in self._tasks:
+            raise BulkError(f"Operation {operation_id} is already running")
+        operation.status = RUNNING
+        await self._save(operation)
+        self._run(operation)
+        return operation
+
+    async def cancel(self, operation_id):
+        task = self._tasks.get(operation_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return self._operations[operation_id]
+
+    async def wait(self, operation_id):
+        task = self._tasks.get(operation_id)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+        return self._operations[operation_id]
+
+    def _run(self, operation):
+        task = asyncio.ensure_future(self._execute(operation))
+        self._tasks[operation.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(operation.id, None))
+
+    async def _execute(self, operation):
+        spec = operation.spec
+        queue = list(reversed(operation.remaining))
+        interval = 1 / spec["rate"]
+        next_start = self._clock()
+        self._log.info(
+            f"Bulk operation {operation.id}: {spec['action']}"
+            f" for {len(queue)} chat(s)"
+        )
+
+        async def worker():
+            nonlocal next_start
+            while queue:
+                chat_id = queue.pop()
+                # Запуски равномерно распределяются во времени, не чаще rate в секунду
+                now = self._clock()
+                start_at = max(next_start, now)
+                next_start = start_at + interval
+                if start_at > now:
+                    await asyncio.sleep(start_at - now)
+                await self._execute_one(operation, chat_id)
+
+        workers = [
+            asyncio.ensure_future(worker())
+            for _ in range(min(spec["concurrency"], len(queue)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            operation.status = INTERRUPTED if self._closing else CANCELLED
+            raise
+        else:
+            operation.status = DONE
+        finally:
+            await asyncio.shield(self._save(operation))
+            progress = operation.progress()
+            self._log.info(
+                f"Bulk operation {operation.id} is {operation.status}:"
+                f" {progress['ok']} ok, {progress['failed']} failed"
+                f" of {progress['total']}"
+            )
+
+    async def _execute_one(self, operation, chat_id):
+        spec = operation.spec
+        action = spec["action"]
+        try:
+            if action == "send_text_message":
+                response = await self._bot.send_text_message(chat_id, spec["text"])
+            elif action == "send_keyboard":
+                response = await self._bot.send_keyboard(chat_id, spec["state"])
+            elif action == "close_chat":
+                response = await self._bot.close_chat(chat_id)
+            else:
+                response = await self._bot.forward_chat(chat_id, spec["forward"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._log.exception(f"Bulk {action} failed for chat {chat_id!r}")
+            result = dict(status=FAILED, error=repr(e))
+        else:
+            if response is None:
+                result = dict(status=FAILED, error="Webim request failed, see log")
+            else:
+                result = dict(status=OK)
+
+        result["time"] = time.time()
+        operation.results[chat_id] = result
+        self._metrics.inc(f"bulk.{result['status']}")
+        if self._directory is not None:
+            line = json.dumps(dict(chat_id=chat_id, **result)) + "\n"
+            path = self._directory / f"{operation.id}{RESULTS_SUFFIX}"
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, _append_line, path, line)
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Результат уже учтён в памяти, поэтому при отмене операции он
+                # должен успеть попасть и на диск
+                await future
+                raise
+
+    async def _save(self, operation):
+        if self._directory is None:
+            return
+        data = dict(
+            id=operation.id,
+            status=operation.status,
+            created=operation.created,
+            spec=operation.spec,
+        )
+        path = self._directory / f"{operation.id}.json"
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, _write_file, path, json.dumps(data))
+        except OSError as e:
+            self._log.error(f"Error saving bulk operation {operation.id}: {e}")
+
+    def register_admin_routes(self, admin):
+        admin.add_route("GET", "/bulk", self._get_operations)
+        admin.add_route("POST", "/bulk", self._post_operation)
+        admin.add_route("GET", "/bulk/{operation_id}", self._get_operation)
+        admin.add_route("POST", "/bulk/{operation_id}/cancel", self._post_cancel)
+        admin.add_route("POST", "/bulk/{operation_id}/resume", self._post_resume)
+
+    async def _get_operations(self, request):
+        operations = [operation.to_json() for operation in self.operations()]
+        return web.json_response(dict(operations=operations))
+
+    async def _post_operation(self, request):
+        try:
+            spec = parse_spec(await request.json(), self._states)
+        except json.JSONDecodeError as e:
+            raise web.HTTPBadRequest(text=f"Invalid JSON: {e}") from e
+        except BulkError as e:
+            raise web.HTTPBadRequest(text=str(e)) from e
+        operation = await self.start(spec)
+        return web.json_response(operation.to_json(), status=202)
+
+    def _operation_id(self, request):
+        operation_id = request.match_info["operation_id"]
+        if operation_id not in self._operations:
+            raise web.HTTPNotFound(text=f"No bulk operation {operation_id}")
+        return operation_id
+
+    async def _get_operation(self, request):
+        operation = self._operations[self._operation_id(request)]
+        return web.json_response(operation.to_json(with_results=True))
+
+    async def _post_cancel(self, request):
+        operation = await self.cancel(self._operation_id(request))
+        return web.json_response(operation.to_json())
+
+    async def _post_resume(self, request):
+        try:
+            operation = await self.resume(self._operation_id(request))
+        except BulkError as e:
+            raise web.HTTPConflict(text=str(e)) from e
+        return web.json_response(operation.to_json(), status=202)
+
+
+def _write_file(path, content):
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_text(content, encoding="utf-8")
+    temp_path.replace(path)
+
+
+def _append_line(path, line):
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(line)
+
+
+def _load_operations(directory):
+    operations = []
+    for path in sorted(directory.glob("*.json")):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        results = {}
+        results_path = directory / f"{data['id']}{RESULTS_SUFFIX}"
+        if results_path.exists():
+            with open(results_path, encoding="utf-8") as file:
+                for line in file:
+                    # Последняя строка могла остаться недописанной при аварии
+                    try:
+                        result = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    results[result.pop("chat_id")] = result
+        operations.append(
+            BulkOperation(
+                data["id"], data["spec"], data["status"], data["created"], results
+            )
+        )
+    return operations
+
+
+def read_chat_ids(path):
+    """
+    Прочитать id чатов из файла, по одному в строке. Пустые строки пропускаются,
+    "-" означает стандартный ввод
+    """
+
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+async def run_cli(args):
+    base_url = args.url.rstrip("/") + "/admin/bulk"
+    headers = {"Authorization": f"Token {args.admin_token}"}
+
+    async with ClientSession(headers=headers, raise_for_status=True) as session:
+        if args.resume:
+            url = f"{base_url}/{args.resume}"
+            async with session.post(f"{url}/resume"):
+                pass
+        else:
+            spec = dict(
+                action=args.action,
+                chat_ids=read_chat_ids(args.chat_ids),
+                concurrency=args.concurrency,
+                rate=args.rate,
+            )
+            if args.action == "send_text_message":
+                spec["text"] = args.text
+            elif args.action == "send_keyboard":
+                spec["state"] = args.state
+            elif args.action == "forward_chat":
+                if args.agent_id is not None:
+                    spec["forward"] = dict(operator_id=args.agent_id)
+                else:
+                    spec["forward"] = dict(dep_key=args.dep_key)
+            async with session.post(base_url, json=spec) as response:
+                operation = await response.json()
+            url = f"{base_url}/{operation['id']}"
+            print(f"Started bulk operation {operation['id']}", file=sys.stderr)
+
+        while True:
+            async with session.get(url) as response:
+                operation = await response.json()
+            progress = operation["progress"]
+            print(
+                f"{operation['status']}: {progress['ok']} ok, {progress['failed']}"
+                f" failed of {progress['total']}",
+                file=sys.stderr,
+            )
+            if operation["status"] != RUNNING:
+                break
+            await asyncio.sleep(args.poll_interval)
+
+    for result in operation["results"]:
+        print(json.dumps(result, ensure_ascii=False))
+    sys.stdout.flush()
+    return operation
+
+
+def _positive_int(value):
+    try:
+        int_value = int(value)
+        if int_value > 0:
+            return int_value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected positive integer, not {value!r}")
+
+
+def _positive_float(value):
+    try:
+        float_value = float(value)
+        if 0 < float_value < float("inf"):
+            return float_value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected positive number, not {value!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="extbot-bulk",
+        description="Run bulk operation on Webim chats through Extbot admin API",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--url", required=True, help="Extbot URL")
+    parser.add_argument("--admin-token", required=True, help="extbot --admin-token")
+    parser.add_argument("--resume", help="resume bulk operation with this id")
+    parser.add_argument("action", nargs="?", choices=ACTIONS)
+    parser.add_argument(
+        "chat_ids", nargs="?", help="file with chat ids, one per line, or -"
+    )
+    parser.add_argument("--text", help="message text for send_text_message")
+    parser.add_argument("--state", help="dialog state of keyboard for send_keyboard")
+    parser.add_argument("--agent-id", type=int, help="forward_chat to this agent")
+    parser.add_argument("--dep-key", help="forward_chat to this department")
+    parser.add_argument(
+        "--concurrency", type=_positive_int, default=DEFAULT_CONCURRENCY
+    )
+    parser.add_argument("--rate", type=_positive_float, default=DEFAULT_RATE)
+    parser.add_argument(
+        "--poll-interval", type=_positive_float, default=DEFAULT_POLL_INTERVAL
+    )
+    args = parser.parse_args()
+
+    if not args.resume:
+        if not args.action or not args.chat_ids:
+            parser.error("action and chat ids file are required")
+        if args.action == "send_text_message" and not args.text:
+            parser.error("--text is required for send_text_message")
+        if args.action == "forward_chat" and (args.agent_id is None) == (
+            args.dep_key is None
+        ):
+            parser.error("either --agent-id or --dep-key is required for forward_chat")
+
+    try:
+        operation = asyncio.run(run_cli(args))
+    except ClientError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if operation["progress"]["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
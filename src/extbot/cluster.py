@@ -0,0 +1,230 @@
+"""
+Работа нескольких экземпляров бота как одного кластера
+
+Каждый узел кластера знает адреса всех узлов и по кольцу консистентного хеширования
+определяет, какой узел отвечает за чат. Обновление чужого чата узел пересылает узлу-
+владельцу по постоянному соединению, поэтому все обновления одного чата
+обрабатываются одним узлом независимо от того, на какой узел их прислал балансировщик.
+При изменении списка узлов владельца меняет только небольшая часть чатов.
+"""
+
+
+import asyncio
+import bisect
+import hashlib
+import json
+from pathlib import Path
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
+
+FORWARDED_HEADER = "X-Extbot-Forwarded"
+DEFAULT_REPLICAS = 100
+DEFAULT_RELOAD_INTERVAL = 5
+FORWARD_TIMEOUT = ClientTimeout(total=10)
+
+# Заголовки, которые относятся к соединению с этим узлом, а не к обновлению
+_HOP_BY_HOP_HEADERS = frozenset(
+    ("host", "content-length", "connection", "keep-alive", "transfer-encoding")
+)
+
+
+def _hash(value):
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """
+    Кольцо консистентного хеширования. Каждый узел занимает на кольце replicas точек,
+    чтобы чаты распределялись между узлами равномерно
+    """
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        self.nodes = frozenset(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key):
+        if not self._nodes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def read_peers_file(path):
+    """
+    Прочитать адреса узлов из файла: по одному на строке, пустые строки и строки,
+    начинающиеся с #, пропускаются
+    """
+
+    peers = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            peers.append(line.rstrip("/"))
+    return peers
+
+
+def _chat_id(body):
+    try:
+        update = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(update, dict):
+        return None
+
+    chat_id = update.get("chat_id")
+    if chat_id is None and isinstance(update.get("chat"), dict):
+        chat_id = update["chat"].get("id")
+    return chat_id
+
+
+class Cluster:
+    """
+    Узел кластера с адресом self_url. Список узлов задаётся списком peers и/или
+    файлом peers_file, который перечитывается раз в reload_interval секунд. Сам узел
+    входит в кластер, даже если его нет в списке
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        self_url,
+        peers=(),
+        peers_file=None,
+        reload_interval=DEFAULT_RELOAD_INTERVAL,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._self_url = self_url.rstrip("/")
+        self._static_peers = [peer.rstrip("/") for peer in peers]
+        self._peers_file = peers_file
+        self._reload_interval = reload_interval
+        self._peers_file_mtime = None
+
+        self._ring = HashRing([self._self_url, *self._static_peers])
+        self._session = None
+        self._task = None
+
+        metrics.gauge("cluster.nodes", lambda: len(self._ring.nodes))
+
+    @property
+    def nodes(self):
+        return self._ring.nodes
+
+    def owner(self, chat_id):
+        return self._ring.owner(chat_id)
+
+    def set_peers(self, peers):
+        """
+        Заменить список узлов. Чаты, владелец которых изменился, с этого момента
+        обрабатываются новым владельцем
+        """
+
+        ring = HashRing([self._self_url, *self._static_peers, *peers])
+        if ring.nodes == self._ring.nodes:
+            return
+
+        added = sorted(ring.nodes - self._ring.nodes)
+        removed = sorted(self._ring.nodes - ring.nodes)
+        self._ring = ring
+        self._metrics.inc("cluster.rebalances")
+        self._log.info(
+            f"Cluster membership changed: {len(ring.nodes)} node(s),"
+            f" added {added}, removed {removed}"
+        )
+
+    def reload_peers(self):
+        """
+        Перечитать файл со списком узлов, если он изменился
+        """
+
+        if self._peers_file is None:
+            return
+
+        try:
+            mtime = Path(self._peers_file).stat().st_mtime_ns
+            if mtime == self._peers_file_mtime:
+                return
+            peers = read_peers_file(self._peers_file)
+        except OSError as e:
+            self._log.error(f"Error reading cluster peers file: {e}")
+            return
+
+        self._peers_file_mtime = mtime
+        self.set_peers(peers)
+
+    async def startup(self, *_):
+        # Соединения между узлами постоянные: обновления пересылаются без установки
+        # нового соединения
+        self._session = ClientSession(
+            connector=TCPConnector(keepalive_timeout=60), timeout=FORWARD_TIMEOUT
+        )
+        self.reload_peers()
+        if self._peers_file is not None:
+            self._task = asyncio.ensure_future(self._reload_periodically())
+
+    async def cleanup(self, *_):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+
+    async def _reload_periodically(self):
+        while True:
+            await asyncio.sleep(self._reload_interval)
+            self.reload_peers()
+
+    async def route(self, request):
+        """
+        Переслать обновление узлу-владельцу чата. Возвращает ответ владельца или None,
+        если обновление нужно обработать на этом узле: чат принадлежит этому узлу,
+        обновление уже переслано другим узлом или владелец недоступен
+        """
+
+        if FORWARDED_HEADER in request.headers:
+            self._metrics.inc("cluster.received")
+            return None
+
+        body = await request.read()
+        chat_id = _chat_id(body)
+        owner = self._ring.owner(chat_id) if chat_id is not None else None
+        if owner is None or owner == self._self_url:
+            return None
+
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in _HOP_BY_HOP_HEADERS
+        }
+        headers[FORWARDED_HEADER] = self._self_url
+
+        try:
+            async with self._session.post(
+                owner + request.path, data=body, headers=headers
+            ) as response:
+                response_body = await response.read()
+                self._metrics.inc("cluster.forwarded")
+                return web.Response(
+                    body=response_body,
+                    status=response.status,
+                    content_type=response.content_type,
+                )
+        except (ClientError, asyncio.TimeoutError) as e:
+            self._metrics.inc("cluster.forward_errors")
+            self._log.warning(
+                f"Could not forward update for chat {chat_id!r} to {owner}: {e!r}."
+                " Handling it locally"
+            )
+            return None
@@ -0,0 +1,203 @@
+"""Потоковое скачивание файлов, которые отправляют посетители"""
+
+
+import asyncio
+import hashlib
+import inspect
+import os
+import re
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+from aiohttp import ClientError, ClientTimeout
+from aiojobs import Scheduler
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE_MB = 20
+DEFAULT_ALLOWED_TYPES = ("image/*", "application/pdf", "text/plain")
+DEFAULT_CONCURRENCY = 4
+PENDING_LIMIT = 100
+DOWNLOAD_TIMEOUT = ClientTimeout(total=300, sock_read=30)
+
+_SAFE_SUFFIX_RE = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+
+DownloadedFile = namedtuple(
+    "DownloadedFile", ["chat_id", "name", "media_type", "path", "size", "sha256"]
+)
+DownloadedFile.__doc__ = "Скачанный файл посетителя"
+
+
+class DownloadRejected(Exception):
+    """Файл не удовлетворяет ограничениям на размер или тип"""
+
+
+class FileDownloader:
+    """
+    Скачивает файлы посетителей в директорию на диске по частям, не держа файл в
+    памяти целиком. Одновременно скачивается не больше заданного числа файлов,
+    независимо от обработки сообщений. После скачивания файл передаётся в функцию
+    обработки (hook). Асинхронная функция выполняется в event loop, а обычная — в
+    пуле потоков, чтобы не задерживать обработку остальных чатов
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        directory,
+        max_size=DEFAULT_MAX_SIZE_MB * 1024 * 1024,
+        allowed_types=DEFAULT_ALLOWED_TYPES,
+        concurrency=DEFAULT_CONCURRENCY,
+        hook=None,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._directory = Path(directory)
+        self._max_size = max_size
+        self._allowed_types = tuple(allowed_types)
+        self._concurrency = concurrency
+        self._hook = hook
+
+        self._session = None
+        self._scheduler = None
+
+        metrics.gauge("downloads.active", self._active_count)
+
+    def start(self, session):
+        """
+        Подготовить скачивание через заданную сессию. Повторный вызов ничего не делает
+        """
+
+        if self._scheduler is not None:
+            return
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._session = session
+        self._scheduler = Scheduler(
+            limit=self._concurrency, pending_limit=PENDING_LIMIT
+        )
+
+    async def close(self):
+        if self._scheduler is not None:
+            await self._scheduler.close()
+
+    def _active_count(self):
+        return self._scheduler.active_count if self._scheduler is not None else 0
+
+    async def submit(self, chat_id, file_data):
+        """
+        Поставить файл в очередь на скачивание. Если очередь переполнена, файл
+        пропускается, чтобы не задерживать обработку сообщений
+        """
+
+        if self._scheduler.pending_count >= PENDING_LIMIT:
+            self._metrics.inc("downloads.dropped")
+            self._log.warning(
+                f"Download queue is full, skipping file in chat {chat_id!r}"
+            )
+            return
+
+        await self._scheduler.spawn(self.download(chat_id, file_data))
+
+    def is_allowed_type(self, media_type):
+        media_type = (media_type or "").lower()
+        for allowed in self._allowed_types:
+            if allowed.endswith("/*"):
+                if media_type.startswith(allowed[:-1]):
+                    return True
+            elif media_type == allowed:
+                return True
+        return False
+
+    async def download(self, chat_id, file_data):
+        """
+        Скачать файл и передать его в функцию обработки. Возвращает DownloadedFile
+        или None, если файл не удалось скачать или он отклонён
+        """
+
+        url = file_data.get("url")
+        name = file_data.get("name") or ""
+        if not url:
+            self._log.warning(f"File message in chat {chat_id!r} has no url")
+            return None
+
+        try:
+            downloaded = await self._download(chat_id, url, name, file_data)
+        except DownloadRejected as e:
+            self._metrics.inc("downloads.rejected")
+            self._log.warning(f"Rejected file {name!r} in chat {chat_id!r}: {e}")
+            return None
+        except (ClientError, asyncio.TimeoutError, OSError) as e:
+            self._metrics.inc("downloads.failed")
+            self._log.error(f"Error downloading file {name!r} from {url!r}: {e!r}")
+            return None
+
+        self._metrics.inc("downloads.completed")
+        self._metrics.inc("downloads.bytes", downloaded.size)
+        self._log.info(
+            f"Downloaded file {name!r} from chat {chat_id!r}"
+            f" ({downloaded.size} bytes) to {downloaded.path}"
+        )
+
+        if self._hook is not None:
+            try:
+                if inspect.iscoroutinefunction(self._hook):
+                    await self._hook(downloaded)
+                else:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self._hook, downloaded)
+            except Exception:
+                self._log.exception(
+                    f"Error processing downloaded file {downloaded.path}"
+                )
+
+        return downloaded
+
+    async def _download(self, chat_id, url, name, file_data):
+        declared_type = file_data.get("media_type")
+        if declared_type and not self.is_allowed_type(declared_type):
+            raise DownloadRejected(f"media type {declared_type!r} is not allowed")
+
+        declared_size = file_data.get("size")
+        if isinstance(declared_size, int) and declared_size > self._max_size:
+            raise DownloadRejected(f"size {declared_size} exceeds {self._max_size}")
+
+        loop = asyncio.get_running_loop()
+
+        async with self._session.get(url, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+
+            media_type = response.content_type
+            if not self.is_allowed_type(media_type):
+                raise DownloadRejected(f"media type {media_type!r} is not allowed")
+            if response.content_length and response.content_length > self._max_size:
+                raise DownloadRejected(
+                    f"size {response.content_length} exceeds {self._max_size}"
+                )
+
+            fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".part")
+            try:
+                checksum = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, "wb") as temp_file:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self._max_size:
+                            raise DownloadRejected(f"size exceeds {self._max_size}")
+                        checksum.update(chunk)
+                        # Запись на диск может заблокировать поток, поэтому выполняется
+                        # в пуле потоков, а не в event loop
+                        await loop.run_in_executor(None, temp_file.write, chunk)
+
+                sha256 = checksum.hexdigest()
+                suffix = Path(name).suffix
+                if not _SAFE_SUFFIX_RE.match(suffix):
+                    suffix = ""
+                path = self._directory / f"{sha256}{suffix}"
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+        return DownloadedFile(chat_id, name, media_type, path, size, sha256)
@@ -0,0 +1,217 @@
+"""
+Поиск ответов на свободные вопросы посетителей по базе FAQ
+
+База FAQ — это JSON-файл со списком записей, у каждой записи есть варианты вопроса и
+ответ:
+
+    [
+        {
+            "questions": ["Как оплатить заказ?", "How can I pay?"],
+            "answer": "Оплатить заказ можно картой на сайте"
+        }
+    ]
+
+При запуске бота по вопросам строится инвертированный индекс с весами TF-IDF. Поиск
+перебирает только списки документов для слов из сообщения посетителя. Для каждого
+слова хранится не больше CHAMPIONS_PER_TERM документов с наибольшим весом этого слова,
+поэтому время поиска ограничено и почти не зависит от размера базы: частые слова
+имеют малый вес и мало влияют на выбор ответа.
+"""
+
+
+import json
+import math
+import re
+from array import array
+
+DEFAULT_THRESHOLD = 0.5
+CHAMPIONS_PER_TERM = 128
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_CYRILLIC_RE = re.compile("[а-я]")
+_MIN_STEM_LENGTH = 3
+
+STOP_WORDS = frozenset(
+    """
+    a an and are as at be by can could do does for from how i in is it me my of on
+    or please the this to was what when where which who why will with you your
+    а без бы в во вы где да для до же и из или как ли мне мой мы на не ни но о об от
+    по при с со так то ты у уже что чтобы это я
+    """.split()
+)
+
+# Окончания упорядочены от длинных к коротким, отсекается самое длинное подходящее
+_RU_SUFFIXES = tuple(
+    sorted(
+        """
+        иями ями ами ией ого его ому ему ыми ими ешь ишь ете ите ется ются ает яет
+        ах ях ов ев ой ей ий ый ая яя ое ее ые ие ом ем ам ям ую юю ть ся ет ит ут ют
+        ат ят а я о е ы и у ю ь
+        """.split(),
+        key=len,
+        reverse=True,
+    )
+)
+_EN_SUFFIXES = ("ing", "ies", "ed", "es", "ly", "s")
+
+
+class FaqError(ValueError):
+    """Ошибка в базе FAQ"""
+
+
+def normalize(text):
+    """
+    Разбить текст на нормализованные слова: в нижнем регистре, без стоп-слов и с
+    отсечёнными окончаниями русского или английского языка
+    """
+
+    tokens = []
+    for word in _WORD_RE.findall(text.lower().replace("ё", "е")):
+        if word in STOP_WORDS:
+            continue
+        suffixes = _RU_SUFFIXES if _CYRILLIC_RE.search(word) else _EN_SUFFIXES
+        for suffix in suffixes:
+            if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM_LENGTH:
+                word = word[: -len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+
+def _term_weights(tokens, idf, unknown_idf):
+    """
+    Нормированный вектор весов TF-IDF для слов документа или запроса. Слова, которых
+    нет в базе, считаются самыми редкими: они не дают совпадений, но уменьшают вес
+    остальных слов запроса
+    """
+
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+
+    weights = {
+        token: (1 + math.log(count)) * idf.get(token, unknown_idf)
+        for token, count in counts.items()
+    }
+    norm = math.sqrt(sum(w * w for w in weights.values()))
+    if not norm:
+        return {}
+    return {token: w / norm for token, w in weights.items()}
+
+
+class FaqIndex:
+    """
+    Индекс базы FAQ. Каждый вариант вопроса — отдельный документ, а совпадение
+    сообщения с документом оценивается косинусной мерой от 0 до 1
+    """
+
+    def __init__(self, entries, threshold=DEFAULT_THRESHOLD):
+        self.answers = []
+        self._threshold = threshold
+        self._doc_entries = array("i")
+
+        documents = []
+        for entry_number, entry in enumerate(entries):
+            try:
+                questions = entry["questions"]
+                answer = entry["answer"]
+            except (KeyError, TypeError) as e:
+                raise FaqError(
+                    f"entry {entry_number} has no questions or answer"
+                ) from e
+            if (
+                not isinstance(questions, list)
+                or not questions
+                or not all(isinstance(q, str) for q in questions)
+            ):
+                raise FaqError(
+                    f"questions of entry {entry_number} must be"
+                    " a non-empty list of strings"
+                )
+            if not isinstance(answer, str) or not answer:
+                raise FaqError(
+                    f"answer of entry {entry_number} must be a non-empty string"
+                )
+
+            self.answers.append(answer)
+            for question in questions:
+                documents.append(normalize(question))
+                self._doc_entries.append(entry_number)
+
+        document_frequency = {}
+        for tokens in documents:
+            for token in set(tokens):
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+
+        total = len(documents)
+        self._unknown_idf = math.log(total + 1) + 1
+        self._idf = {
+            token: math.log((total + 1) / (df + 1)) + 1
+            for token, df in document_frequency.items()
+        }
+
+        postings = {}
+        for doc_id, tokens in enumerate(documents):
+            doc_weights = _term_weights(tokens, self._idf, self._unknown_idf)
+            for token, weight in doc_weights.items():
+                postings.setdefault(token, []).append((weight, doc_id))
+
+        self._postings = {}
+        for token, token_postings in postings.items():
+            token_postings.sort(reverse=True)
+            champions = token_postings[:CHAMPIONS_PER_TERM]
+            self._postings[token] = (
+                array("i", (doc_id for _, doc_id in champions)),
+                array("f", (weight for weight, _ in champions)),
+            )
+
+    @classmethod
+    def load(cls, path, threshold=DEFAULT_THRESHOLD):
+        """
+        Прочитать базу FAQ из JSON-файла и построить по ней индекс
+        """
+
+        try:
+            with open(path, encoding="utf-8") as faq_file:
+                entries = json.load(faq_file)
+        except (OSError, ValueError) as e:
+            raise FaqError(f"could not read FAQ from {path!r}: {e}") from e
+
+        if not isinstance(entries, list):
+            raise FaqError(f"FAQ in {path!r} must be a list of entries")
+        return cls(entries, threshold)
+
+    def __len__(self):
+        return len(self._doc_entries)
+
+    def search(self, text):
+        """
+        Найти самый похожий вопрос. Возвращает пару (номер записи, оценка) или
+        (None, 0.0), если ничего похожего нет
+        """
+
+        query = _term_weights(normalize(text), self._idf, self._unknown_idf)
+        scores = {}
+        get_score = scores.get
+        for token, query_weight in query.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            doc_ids, weights = postings
+            for doc_id, weight in zip(doc_ids, weights):
+                scores[doc_id] = get_score(doc_id, 0.0) + query_weight * weight
+
+        if not scores:
+            return None, 0.0
+
+        best_doc = max(scores, key=scores.__getitem__)
+        return self._doc_entries[best_doc], scores[best_doc]
+
+    def match(self, text):
+        """
+        Номер записи FAQ, ответ которой подходит к тексту с оценкой не ниже порога,
+        или None
+        """
+
+        entry, score = self.search(text)
+        return entry if score >= self._threshold else None
@@ -0,0 +1,104 @@
+"""Раздача файлов бота с его собственного сервера"""
+
+
+import hashlib
+import mimetypes
+from collections import namedtuple
+from pathlib import Path
+from urllib.parse import quote
+
+from aiohttp import web
+
+FILES_PREFIX = "/files"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_MEDIA_TYPE = "application/octet-stream"
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+FileInfo = namedtuple(
+    "FileInfo", ["name", "path", "size", "media_type", "sha256", "etag", "url"]
+)
+FileInfo.__doc__ = "Метаданные файла из директории бота"
+
+
+class FileStore:
+    """
+    Файлы из локальной директории, которые бот отправляет посетителям и раздаёт по
+    ссылкам вида <public_base_url>/<имя файла>?v=<хеш>. Метаданные всех файлов
+    собираются один раз при запуске, поэтому ни отправка ссылки, ни ответ на
+    повторный запрос с If-None-Match не обращаются к файловой системе. Сами файлы
+    отдаются через aiohttp.web.FileResponse, который использует sendfile и
+    поддерживает запросы диапазонов. Ссылка меняется вместе с содержимым файла,
+    поэтому браузеры могут кешировать файлы без ограничений
+    """
+
+    def __init__(self, logger, directory, public_base_url):
+        self._log = logger
+        self._directory = Path(directory)
+        self._public_base_url = public_base_url.rstrip("/") + "/"
+        self._files = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def scan(self):
+        """
+        Собрать метаданные всех файлов директории, кроме скрытых. Новые или
+        изменённые файлы будут видны только после повторного вызова
+        """
+
+        files = {}
+        for path in sorted(self._directory.rglob("*")):
+            relative = path.relative_to(self._directory)
+            if not path.is_file() or any(p.startswith(".") for p in relative.parts):
+                continue
+
+            name = relative.as_posix()
+            stat = path.stat()
+            sha256 = _file_sha256(path)
+            media_type = mimetypes.guess_type(name)[0] or DEFAULT_MEDIA_TYPE
+            # Тот же формат ETag, что и у web.FileResponse
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            url = f"{self._public_base_url}{quote(name)}?v={sha256[:16]}"
+            files[name] = FileInfo(
+                name, path, stat.st_size, media_type, sha256, etag, url
+            )
+
+        self._files = files
+        self._log.info(f"Serving {len(files)} file(s) from {self._directory}")
+
+    def get(self, name):
+        return self._files.get(name)
+
+    def file_data(self, name):
+        """
+        Описание файла для сообщения Webim с файлом или None, если файла нет
+        """
+
+        info = self._files.get(name)
+        if info is None:
+            return None
+        return dict(url=info.url, name=Path(info.name).name, media_type=info.media_type)
+
+    def get_routes(self):
+        return [web.get(FILES_PREFIX + "/{name:.+}", self.serve)]
+
+    async def serve(self, request):
+        info = self._files.get(request.match_info["name"])
+        if info is None:
+            raise web.HTTPNotFound
+
+        headers = {"Cache-Control": CACHE_CONTROL}
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None and info.etag in if_none_match:
+            headers["ETag"] = info.etag
+            raise web.HTTPNotModified(headers=headers)
+
+        return web.FileResponse(info.path, headers=headers)
+
+
+def _file_sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
@@ -0,0 +1,157 @@
+"""
+Защита от потока обновлений из одного чата
+
+Посетитель, который без остановки нажимает кнопки, или сломанный виджет может
+присылать сотни обновлений в секунду, и ответы на них съедают общий для всех чатов
+лимит запросов к Webim. Бот считает сообщения каждого чата в скользящем окне, и
+если их больше limit за window секунд, один раз просит посетителя не торопиться,
+а следующие cooldown секунд не отвечает на сообщения этого чата.
+
+Окно приближается двумя соседними интервалами по window секунд: число сообщений
+в прошлом интервале учитывается с весом, который убывает по мере движения окна.
+Поэтому на чат хранится несколько чисел. Если бот запущен несколькими процессами,
+счётчики хранятся в общем хранилище из опции --state (extbot.state), чтобы
+ограничение было общим, а не своим в каждом процессе; ключи счётчиков удаляются
+по сроку жизни. Без хранилища счётчики хранятся в памяти процесса, а число чатов
+ограничено max_chats: давно не писавшие чаты забываются первыми.
+"""
+
+
+import collections
+import time
+
+FLOOD_TEXT = "You are sending messages too fast. Please wait a little."
+DEFAULT_WINDOW = 10.0
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_MAX_CHATS = 100_000
+
+ALLOW = "allow"
+WARN = "warn"
+DROP = "drop"
+
+
+class _ChatCounter:
+    __slots__ = ("start", "count", "previous", "blocked_until")
+
+    def __init__(self, now):
+        self.start = now
+        self.count = 0
+        self.previous = 0
+        self.blocked_until = None
+
+
+class FloodGuard:
+    """
+    Счётчики сообщений по чатам в хранилище state или, если оно не задано, в
+    памяти процесса. Метод check говорит, что делать с очередным сообщением чата:
+    обработать (ALLOW), ответить просьбой не торопиться (WARN) или пропустить (DROP)
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        limit,
+        window=DEFAULT_WINDOW,
+        cooldown=DEFAULT_COOLDOWN,
+        text=FLOOD_TEXT,
+        max_chats=DEFAULT_MAX_CHATS,
+        clock=time.time,
+        state=None,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._limit = limit
+        self._window = window
+        self._cooldown = cooldown
+        self.text = text
+        self._max_chats = max_chats
+        self._clock = clock
+        self._state = state
+
+        self._chats = collections.OrderedDict()
+
+        # В общем хранилище число чатов не видно, ключи удаляются по сроку жизни
+        if state is None:
+            metrics.gauge("flood.chats", self._chats.__len__)
+
+    async def check(self, chat_id):
+        if self._state is not None:
+            return await self._check_shared(chat_id)
+        return self._check_local(chat_id)
+
+    async def _check_shared(self, chat_id):
+        # Интервалы выровнены по часам, одинаковым во всех процессах
+        now = self._clock()
+        interval = int(now // self._window)
+        prefix = f"flood:{chat_id}"
+        blocked_key = f"{prefix}:blocked"
+        current_key = f"{prefix}:{interval}"
+        previous_key = f"{prefix}:{interval - 1}"
+
+        # Обычное сообщение стоит двух обращений к хранилищу: чтения и увеличения
+        values = await self._state.get_many([blocked_key, previous_key])
+        if values[blocked_key] is not None:
+            self._metrics.inc("flood.dropped")
+            return DROP
+        previous = values[previous_key] or 0
+        count = await self._state.incr(current_key, ttl=2 * self._window)
+
+        weight = 1 - (now - interval * self._window) / self._window
+        if previous * weight + count <= self._limit:
+            return ALLOW
+
+        # Просьбу не торопиться отправляет только процесс, который первым
+        # заблокировал чат
+        if not await self._state.compare_and_set(
+            blocked_key, None, True, ttl=self._cooldown
+        ):
+            self._metrics.inc("flood.dropped")
+            return DROP
+        await self._state.delete(current_key)
+        await self._state.delete(previous_key)
+        self._warn(chat_id)
+        return WARN
+
+    def _check_local(self, chat_id):
+        now = self._clock()
+        counter = self._chats.get(chat_id)
+        if counter is None:
+            counter = self._chats[chat_id] = _ChatCounter(now)
+            if len(self._chats) > self._max_chats:
+                self._chats.popitem(last=False)
+                self._metrics.inc("flood.evicted")
+        else:
+            self._chats.move_to_end(chat_id)
+
+        if counter.blocked_until is not None:
+            if now < counter.blocked_until:
+                self._metrics.inc("flood.dropped")
+                return DROP
+            counter.blocked_until = None
+
+        elapsed = now - counter.start
+        if elapsed >= self._window:
+            periods = int(elapsed // self._window)
+            counter.previous = counter.count if periods == 1 else 0
+            counter.count = 0
+            counter.start += periods * self._window
+        counter.count += 1
+
+        weight = 1 - (now - counter.start) / self._window
+        if counter.previous * weight + counter.count <= self._limit:
+            return ALLOW
+
+        # Пока чат заблокирован, его сообщения не считаются, и после блокировки
+        # отсчёт начинается заново
+        counter.blocked_until = now + self._cooldown
+        counter.count = counter.previous = 0
+        self._warn(chat_id)
+        return WARN
+
+    def _warn(self, chat_id):
+        self._metrics.inc("flood.warned")
+        self._log.warning(
+            f"Chat {chat_id!r} sends more than {self._limit} messages"
+            f" in {self._window:g}s, ignoring it for {self._cooldown:g}s"
+        )
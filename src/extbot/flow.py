@@ -0,0 +1,505 @@
+"""
+Декларативное описание диалогов бота
+
+Диалог описывается в JSON и при запуске бота компилируется в словари переходов и
+заранее подготовленные сообщения, общие для API 1.0 и API 2.0. Поэтому выбор ответа
+на обновление стоит одного поиска в словаре, сколько бы кнопок и состояний ни было
+описано. Пример описания:
+
+    {
+        "start": "main",
+        "states": {
+            "main": {"keyboard": [["say_hi", "close_chat"]]}
+        },
+        "buttons": {
+            "say_hi": {
+                "text": "Say hi",
+                "actions": [{"text": "Hi!"}, {"keyboard": "main"}]
+            },
+            "close_chat": {
+                "text": "Close chat",
+                "actions": [{"text": "Bye!"}, {"close": true}]
+            }
+        },
+        "events": {
+            "new_chat": [{"text": "Hello!"}, {"keyboard": "main"}]
+        },
+        "messages": {
+            "visitor": [{"text": "Use my buttons:"}, {"keyboard": "main"}]
+        },
+        "unexpected": [{"text": "Oops"}, {"keyboard": "main"}]
+    }
+
+Состояние (state) — это меню бота, то есть клавиатура с кнопками. Переходы описаны
+для нажатия кнопки (buttons), для события (events), для сообщения посетителя
+заданного вида (messages) и для любого другого обновления (unexpected). Каждый
+переход — это список действий:
+
+    {"text": "..."}                    отправить текст
+    {"file": {"url": ..., "name": ..., "media_type": ...}}
+                                       отправить файл по ссылке
+    {"file": "<имя>"}                  отправить файл из директории бота, см.
+                                       extbot.files
+    {"keyboard": "<state>"}            отправить клавиатуру состояния
+    {"forward": {"operator_id": ...}}  перевести диалог на оператора
+    {"forward": {"dep_key": ...}}      перевести диалог в отдел
+    {"queue": true}                    перевести диалог в очередь
+    {"close": true}                    закрыть диалог
+
+Кнопку можно показывать только в Webim не старее заданной версии, указав
+"min_webim_version".
+
+Отправке текста, файла или клавиатуры можно задать срок в секундах с получения
+обновления: {"text": "Hello!", "expires": 10}. Если обновление прождало в очереди
+дольше, бот API 2.0 пропускает такое действие, потому что приветствие через
+полминуты уже бесполезно. Без "expires" действует срок из опции --reply-deadline.
+Переводы и закрытие диалога срока не имеют и выполняются всегда.
+
+Для больших меню (отделы, операторы, темы обращений) вместо клавиатуры можно
+указать список кнопок, который бот сам разложит по рядам и страницам с кнопками
+перехода между страницами:
+
+    "departments": {
+        "menu": ["sales", "support", "billing", ...],
+        "per_row": 3,
+        "row_width": 40,
+        "rows_per_page": 5,
+        "prev_text": "Back",
+        "next_text": "More"
+    }
+
+В ряду будет не больше per_row кнопок с суммарной длиной текста не больше
+row_width символов (если задано), на странице — не больше rows_per_page рядов.
+Действие {"keyboard": "departments"} отправляет первую страницу меню. Каждая
+страница раскладывается один раз для каждой версии Webim и кешируется.
+"""
+
+
+import functools
+import json
+from enum import Enum
+
+from packaging.version import InvalidVersion
+from packaging.version import parse as parse_version
+
+from .utils import to_rows
+
+KEYBOARD_CACHE_SIZE = 1024
+
+DEFAULT_MENU_PER_ROW = 2
+DEFAULT_MENU_ROWS_PER_PAGE = 5
+PREV_PAGE_TEXT = "« Back"
+NEXT_PAGE_TEXT = "More »"
+
+
+class FlowError(ValueError):
+    """Ошибка в описании диалога"""
+
+
+class ActionKind(Enum):
+    SEND = "send"
+    KEYBOARD = "keyboard"
+    FORWARD = "forward"
+    CLOSE = "close"
+
+
+class Action:
+    """
+    Скомпилированное действие. Для SEND в message лежит готовое сообщение, для
+    KEYBOARD в state — имя состояния и в page — номер страницы меню, для FORWARD в
+    forward_info — параметры перевода диалога (пустой словарь означает перевод в
+    очередь). В expires — срок действия в секундах с получения обновления или None,
+    если срок не задан
+    """
+
+    __slots__ = ("kind", "message", "state", "page", "forward_info", "expires")
+
+    def __init__(
+        self,
+        kind,
+        message=None,
+        state=None,
+        page=0,
+        forward_info=None,
+        expires=None,
+    ):
+        self.kind = kind
+        self.message = message
+        self.state = state
+        self.page = page
+        self.forward_info = forward_info
+        self.expires = expires
+
+
+class Transition:
+    """
+    Скомпилированный переход: последовательность действий в ответ на обновление
+    """
+
+    __slots__ = ("name", "actions")
+
+    def __init__(self, name, actions):
+        self.name = name
+        self.actions = actions
+
+
+class Menu:
+    """
+    Скомпилированное меню со страницами. Кнопки хранятся вместе с минимальной
+    версией Webim, а раскладка по рядам и страницам выполняется при отрисовке
+    """
+
+    __slots__ = ("buttons", "per_row", "row_width", "rows_per_page", "prev", "next")
+
+    def __init__(self, buttons, per_row, row_width, rows_per_page, prev, next):
+        self.buttons = buttons
+        self.per_row = per_row
+        self.row_width = row_width
+        self.rows_per_page = rows_per_page
+        self.prev = prev
+        self.next = next
+
+    def pages(self, buttons):
+        rows = list(
+            to_rows(
+                buttons,
+                self.per_row,
+                self.row_width,
+                width=lambda button: len(button["text"]),
+            )
+        )
+        return [
+            rows[start : start + self.rows_per_page]
+            for start in range(0, len(rows), self.rows_per_page)
+        ] or [[]]
+
+
+class Flow:
+    """
+    Скомпилированный диалог. Создаётся функцией compile_flow
+    """
+
+    def __init__(
+        self, start, keyboards, buttons, events, messages, unexpected, menus=None
+    ):
+        self.start = start
+        self._keyboards = keyboards
+        self._menus = menus or {}
+        # Имена состояний с клавиатурой или меню
+        self.states = frozenset(keyboards) | frozenset(self._menus)
+        self._buttons = buttons
+        self._events = events
+        self._messages = messages
+        self.unexpected = unexpected
+
+        self.keyboard_message = functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)(
+            self._render_keyboard
+        )
+
+    def button(self, button_id):
+        """
+        Переход по нажатию кнопки или None, если кнопка неизвестна
+        """
+
+        return self._buttons.get(button_id)
+
+    def event(self, event):
+        """
+        Переход по событию или None, если событие не поддерживается
+        """
+
+        return self._events.get(event)
+
+    def message(self, message_kind):
+        """
+        Переход по сообщению посетителя или None, если вид сообщения не поддерживается
+        """
+
+        return self._messages.get(message_kind)
+
+    def reply(self, text, state=None):
+        """
+        Построить переход, который отправляет текст и клавиатуру состояния, по
+        умолчанию начального
+        """
+
+        return Transition(
+            "reply",
+            (
+                Action(ActionKind.SEND, message=_text_message(text)),
+                Action(ActionKind.KEYBOARD, state=state or self.start),
+            ),
+        )
+
+    def _render_keyboard(self, state, webim_version, page=0):
+        """
+        Сообщение с клавиатурой состояния, для меню — с его страницей page. Кнопки,
+        которые не поддерживаются версией Webim, не показываются, а опустевшие ряды
+        убираются. Результат кешируется
+        """
+
+        menu = self._menus.get(state)
+        if menu is not None:
+            return self._render_menu(state, menu, webim_version, page)
+
+        rows = []
+        for row in self._keyboards[state]:
+            buttons = [
+                button
+                for button, min_version in row
+                if _supported(min_version, webim_version)
+            ]
+            if buttons:
+                rows.append(buttons)
+
+        return dict(kind="keyboard", buttons=rows)
+
+    def _render_menu(self, state, menu, webim_version, page):
+        buttons = [
+            button
+            for button, min_version in menu.buttons
+            if _supported(min_version, webim_version)
+        ]
+        pages = menu.pages(buttons)
+        page = min(max(page, 0), len(pages) - 1)
+
+        rows = list(pages[page])
+        navigation = []
+        if page > 0:
+            navigation.append(dict(id=_page_button_id(state, page - 1), text=menu.prev))
+        if page < len(pages) - 1:
+            navigation.append(dict(id=_page_button_id(state, page + 1), text=menu.next))
+        if navigation:
+            rows.append(navigation)
+
+        return dict(kind="keyboard", buttons=rows)
+
+
+def _supported(min_version, webim_version):
+    return min_version is None or (
+        webim_version is not None and webim_version >= min_version
+    )
+
+
+def _page_button_id(state, page):
+    return f"page:{state}:{page}"
+
+
+def load_flow(path, files=None):
+    """
+    Прочитать описание диалога из JSON-файла и скомпилировать его
+    """
+
+    try:
+        with open(path, encoding="utf-8") as flow_file:
+            definition = json.load(flow_file)
+    except (OSError, ValueError) as e:
+        raise FlowError(f"could not read flow from {path!r}: {e}") from e
+
+    return compile_flow(definition, files)
+
+
+def compile_flow(definition, files=None):
+    """
+    Проверить описание диалога и скомпилировать его в Flow. Файлы, указанные по
+    имени, ищутся в files (extbot.files.FileStore)
+    """
+
+    _check_type(definition, dict, "flow", "an object")
+    states = _check_type(definition.get("states") or {}, dict, "states", "an object")
+    start = definition.get("start")
+    if start not in states:
+        raise FlowError(f"start state {start!r} is not defined in states")
+
+    button_definitions = _check_type(
+        definition.get("buttons") or {}, dict, "buttons", "an object"
+    )
+    for button_id, button in button_definitions.items():
+        _check_type(button, dict, f"button {button_id!r}", "an object")
+    compile_actions = functools.partial(_compile_actions, states=states, files=files)
+
+    keyboards = {}
+    menus = {}
+    for state, state_definition in states.items():
+        _check_type(state_definition, dict, f"state {state!r}", "an object")
+        if "menu" in state_definition:
+            menus[state] = _compile_menu(state, state_definition, button_definitions)
+        else:
+            keyboards[state] = _compile_keyboard(
+                state, state_definition.get("keyboard", []), button_definitions
+            )
+
+    buttons = {
+        button_id: Transition(
+            f"button:{button_id}",
+            compile_actions(button.get("actions", []), f"button {button_id!r}"),
+        )
+        for button_id, button in button_definitions.items()
+    }
+    for state, menu in menus.items():
+        # Кнопки переходов между страницами готовятся заранее для наибольшего
+        # числа страниц, то есть для всех кнопок меню
+        pages = menu.pages([button for button, _ in menu.buttons])
+        for page in range(len(pages)):
+            button_id = _page_button_id(state, page)
+            if button_id in buttons:
+                raise FlowError(f"button {button_id!r} is reserved for menu pages")
+            action = Action(ActionKind.KEYBOARD, state=state, page=page)
+            buttons[button_id] = Transition(f"button:{button_id}", (action,))
+    events = {
+        event: Transition(
+            f"event:{event}", compile_actions(actions, f"event {event!r}")
+        )
+        for event, actions in _check_type(
+            definition.get("events") or {}, dict, "events", "an object"
+        ).items()
+    }
+    messages = {
+        kind: Transition(
+            f"message:{kind}", compile_actions(actions, f"message {kind!r}")
+        )
+        for kind, actions in _check_type(
+            definition.get("messages") or {}, dict, "messages", "an object"
+        ).items()
+    }
+
+    if "unexpected" not in definition:
+        raise FlowError("unexpected update actions are not defined")
+    unexpected = Transition(
+        "unexpected", compile_actions(definition["unexpected"], "unexpected")
+    )
+
+    return Flow(start, keyboards, buttons, events, messages, unexpected, menus)
+
+
+def _check_type(value, expected, where, description):
+    """
+    Проверить тип элемента описания диалога. Возвращает сам элемент
+    """
+
+    if not isinstance(value, expected):
+        raise FlowError(f"{where} must be {description}, got {value!r}")
+    return value
+
+
+def _compile_keyboard(state, rows, button_definitions):
+    where = f"keyboard of state {state!r}"
+    _check_type(rows, list, where, "a list of rows")
+    return [
+        [
+            _compile_button(state, button_id, button_definitions)
+            for button_id in _check_type(
+                row, list, f"row {number} of {where}", "a list of button ids"
+            )
+        ]
+        for number, row in enumerate(rows)
+    ]
+
+
+def _compile_menu(state, definition, button_definitions):
+    if "keyboard" in definition:
+        raise FlowError(f"state {state!r} has both keyboard and menu")
+
+    button_ids = definition["menu"]
+    if not isinstance(button_ids, list):
+        raise FlowError(f"menu of state {state!r} must be a list of button ids")
+
+    def positive(name, default):
+        value = definition.get(name, default)
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, int) or value <= 0
+        ):
+            raise FlowError(f"{name} of state {state!r} must be a positive integer")
+        return value
+
+    return Menu(
+        [
+            _compile_button(state, button_id, button_definitions)
+            for button_id in button_ids
+        ],
+        positive("per_row", DEFAULT_MENU_PER_ROW),
+        positive("row_width", None),
+        positive("rows_per_page", DEFAULT_MENU_ROWS_PER_PAGE),
+        definition.get("prev_text", PREV_PAGE_TEXT),
+        definition.get("next_text", NEXT_PAGE_TEXT),
+    )
+
+
+def _compile_button(state, button_id, button_definitions):
+    _check_type(button_id, str, f"button id in state {state!r}", "a string")
+    button = button_definitions.get(button_id)
+    if button is None:
+        raise FlowError(f"button {button_id!r} of state {state!r} is not defined")
+    if "text" not in button:
+        raise FlowError(f"button {button_id!r} has no text")
+
+    min_version = button.get("min_webim_version")
+    if min_version is not None:
+        try:
+            min_version = parse_version(min_version)
+        except InvalidVersion as e:
+            raise FlowError(f"button {button_id!r}: {e}") from e
+
+    rendered = dict(id=button_id, text=button["text"])
+    return rendered, min_version
+
+
+def _compile_actions(actions, where, states, files):
+    _check_type(actions, list, f"{where}: actions", "a list")
+    return tuple(_compile_action(action, where, states, files) for action in actions)
+
+
+def _compile_action(action, where, states, files):
+    if not isinstance(action, dict):
+        raise FlowError(f"{where}: action must be an object with one key: {action!r}")
+
+    action = dict(action)
+    expires = action.pop("expires", None)
+    if len(action) != 1:
+        raise FlowError(f"{where}: action must be an object with one key: {action!r}")
+
+    [(name, value)] = action.items()
+    compiled = _compile_action_kind(name, value, where, states, files)
+
+    if expires is not None:
+        if compiled.kind not in (ActionKind.SEND, ActionKind.KEYBOARD):
+            raise FlowError(f"{where}: action {name!r} can not expire")
+        if (
+            isinstance(expires, bool)
+            or not isinstance(expires, (int, float))
+            or expires <= 0
+        ):
+            raise FlowError(f"{where}: expires must be a positive number of seconds")
+        compiled.expires = expires
+    return compiled
+
+
+def _compile_action_kind(name, value, where, states, files):
+    if name == "text":
+        return Action(ActionKind.SEND, message=_text_message(value))
+    elif name == "file":
+        if isinstance(value, str):
+            file_data = files.file_data(value) if files is not None else None
+            if file_data is None:
+                raise FlowError(f"{where}: file {value!r} is not in files directory")
+            value = file_data
+        message = dict(kind="file_operator", data=value)
+        return Action(ActionKind.SEND, message=message)
+    elif name == "keyboard":
+        if value not in states:
+            raise FlowError(f"{where}: keyboard of unknown state {value!r}")
+        return Action(ActionKind.KEYBOARD, state=value)
+    elif name == "forward":
+        if not isinstance(value, dict):
+            raise FlowError(f"{where}: forward parameters must be an object")
+        return Action(ActionKind.FORWARD, forward_info=dict(value))
+    elif name == "queue":
+        return Action(ActionKind.FORWARD, forward_info=dict())
+    elif name == "close":
+        return Action(ActionKind.CLOSE)
+    else:
+        raise FlowError(f"{where}: unknown action {name!r}")
+
+
+def _text_message(text):
+    return dict(kind="operator", text=text)
@@ -0,0 +1,66 @@
+"""Проверка того, что цикл событий бота отзывчив"""
+
+
+import asyncio
+import time
+
+DEFAULT_LAG_THRESHOLD = 1.0
+CHECK_INTERVAL = 0.5
+
+
+class LoopLagMonitor:
+    """
+    Каждые interval секунд засыпает на interval и измеряет, насколько позже
+    запланированного проснулся. Эта задержка показывает, сколько ждёт любой
+    обработчик, прежде чем цикл событий дойдёт до него. Цикл событий считается
+    здоровым, если задержка меньше threshold секунд и монитор недавно просыпался
+    """
+
+    def __init__(
+        self,
+        metrics,
+        threshold=DEFAULT_LAG_THRESHOLD,
+        interval=CHECK_INTERVAL,
+        clock=time.monotonic,
+    ):
+        self._metrics = metrics
+        self._threshold = threshold
+        self._interval = interval
+        self._clock = clock
+
+        self.lag = 0.0
+        self._last_tick = None
+        self._task = None
+
+        metrics.gauge("loop.lag", lambda: self.lag)
+
+    async def startup(self, *_):
+        if self._task is None:
+            self._last_tick = self._clock()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def cleanup(self, *_):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def is_healthy(self):
+        if self._last_tick is None:
+            return True
+        # Если цикл событий заблокирован надолго, монитор не успевает обновить
+        # задержку, поэтому учитывается и время с последнего пробуждения
+        overdue = self._clock() - self._last_tick - self._interval
+        return max(self.lag, overdue) < self._threshold
+
+    def tick(self, expected):
+        now = self._clock()
+        self.lag = max(0.0, now - expected)
+        self._last_tick = now
+        self._metrics.observe("loop.lag", self.lag)
+
+    async def _run(self):
+        while True:
+            expected = self._clock() + self._interval
+            await asyncio.sleep(self._interval)
+            self.tick(expected)
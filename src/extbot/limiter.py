@@ -0,0 +1,167 @@
+"""
+Адаптивное ограничение числа одновременных запросов к API Webim
+
+Ограничение подбирается по алгоритму AIMD, как в TCP: пока запросы проходят быстро и
+без ошибок, ограничение растёт примерно на единицу за каждое ограничение завершённых
+запросов, а при ошибке перегрузки или росте задержки — уменьшается в несколько раз.
+Быстрой считается задержка не больше latency_tolerance базовых задержек, а базовая
+задержка — это минимальная задержка за последнее время. Поэтому на здоровом Webim
+бот быстро выходит на большое число параллельных запросов, а на деградирующем —
+перестаёт добавлять к его нагрузке свою очередь.
+"""
+
+
+import asyncio
+import collections
+import time
+
+DEFAULT_INITIAL_LIMIT = 10
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 100
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_BACKOFF = 0.7
+MIN_RTT_WINDOW = 30.0
+OVERLOAD_FAILURES = 5
+OVERLOAD_RECOVERY = 30.0
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель числа одновременных запросов к одному домену. Перед запросом нужно
+    дождаться acquire(), а после запроса обязательно вызвать release() с задержкой
+    запроса и признаком ошибки перегрузки. Ожидающие запросы пропускаются в порядке
+    очереди
+    """
+
+    def __init__(
+        self,
+        metrics,
+        name,
+        initial_limit=DEFAULT_INITIAL_LIMIT,
+        min_limit=DEFAULT_MIN_LIMIT,
+        max_limit=DEFAULT_MAX_LIMIT,
+        latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+        backoff=DEFAULT_BACKOFF,
+        clock=time.monotonic,
+    ):
+        self._metrics = metrics
+        self._prefix = f"limiter.{name}"
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._latency_tolerance = latency_tolerance
+        self._backoff = backoff
+        self._clock = clock
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._inflight = 0
+        self._waiters = collections.deque()
+        self._min_rtt = None
+        self._min_rtt_updated = 0.0
+        self._last_decrease = float("-inf")
+        self._failures = 0
+        self._last_failure = float("-inf")
+
+        metrics.gauge(f"{self._prefix}.limit", lambda: self.limit)
+        metrics.gauge(f"{self._prefix}.inflight", lambda: self._inflight)
+        metrics.gauge(f"{self._prefix}.queued", lambda: len(self._waiters))
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    @property
+    def overloaded(self):
+        """
+        Webim перегружен или недоступен: OVERLOAD_FAILURES запросов подряд завершились
+        ошибкой перегрузки. Через OVERLOAD_RECOVERY секунд после последней ошибки
+        Webim снова считается доступным, даже если запросов к нему больше не было
+        """
+
+        return (
+            self._failures >= OVERLOAD_FAILURES
+            and self._clock() - self._last_failure < OVERLOAD_RECOVERY
+        )
+
+    async def acquire(self):
+        if self._inflight < self.limit and not self._waiters:
+            self._inflight += 1
+            self._metrics.observe(f"{self._prefix}.queue_delay", 0.0)
+            return
+
+        started = self._clock()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Место уже выделено, но ждавший запрос отменён: отдаём место дальше
+                self.abandon()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        self._metrics.observe(f"{self._prefix}.queue_delay", self._clock() - started)
+
+    def abandon(self):
+        """
+        Освободить место, не учитывая результат: запрос так и не был отправлен
+        """
+
+        self._inflight -= 1
+        self._wake_up()
+
+    def release(self, rtt, overloaded=False):
+        """
+        Освободить место и учесть результат запроса: задержку rtt в секундах и то, была
+        ли ошибка перегрузки (таймаут, ошибка соединения, ответ 429 или 5xx)
+        """
+
+        self._inflight -= 1
+        self._metrics.observe(f"{self._prefix}.rtt", rtt)
+        now = self._clock()
+
+        # Ошибка соединения или 5xx приходит быстрее настоящего ответа, поэтому по
+        # ней базовая задержка не считается: иначе все обычные запросы казались бы
+        # медленными
+        if overloaded:
+            pass
+        elif self._min_rtt is None or rtt < self._min_rtt:
+            self._min_rtt = rtt
+            self._min_rtt_updated = now
+        elif now - self._min_rtt_updated > MIN_RTT_WINDOW:
+            # Базовая задержка могла вырасти навсегда, например после переезда
+            # Webim, поэтому старый минимум постепенно забывается
+            self._min_rtt = (self._min_rtt + rtt) / 2
+            self._min_rtt_updated = now
+
+        if overloaded:
+            self._failures += 1
+            self._last_failure = now
+        else:
+            self._failures = 0
+
+        min_rtt = self._min_rtt or 0.0
+        slow = self._min_rtt is not None and rtt > min_rtt * self._latency_tolerance
+        if overloaded or slow:
+            # Уменьшаем не чаще раза за базовую задержку: запросы, отправленные до
+            # уменьшения, ещё сообщают о старой перегрузке
+            if now - self._last_decrease >= min_rtt:
+                self._limit = max(self._min_limit, self._limit * self._backoff)
+                self._last_decrease = now
+                self._metrics.inc(f"{self._prefix}.decreases")
+        elif self._inflight + 1 >= self._limit / 2:
+            # Увеличиваем, только если ограничение действительно используется
+            self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+
+        self._wake_up()
+
+    def _wake_up(self):
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._inflight += 1
+                waiter.set_result(None)
@@ -0,0 +1,118 @@
+"""Профилирование памяти для длительной работы бота"""
+
+
+import gc
+import os
+import tracemalloc
+from collections import Counter
+
+from aiohttp import web
+
+TRACEMALLOC_FRAMES = 5
+DEFAULT_TOP_LIMIT = 20
+
+
+def get_rss():
+    """
+    Текущий размер резидентной памяти процесса в байтах или None, если ОС не
+    позволяет его узнать
+    """
+
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def count_objects(limit=DEFAULT_TOP_LIMIT):
+    """
+    Типы объектов, отслеживаемых сборщиком мусора, с наибольшим числом экземпляров
+    """
+
+    counter = Counter(type(obj).__qualname__ for obj in gc.get_objects())
+    return dict(counter.most_common(limit))
+
+
+class MemoryProfiler:
+    """
+    Метрики памяти процесса и, если включён tracemalloc, снимки распределения
+    памяти по строкам кода. Хранится только последний снимок, с которым сравнивается
+    следующий, поэтому сам профилировщик не растёт со временем
+    """
+
+    def __init__(self, logger, metrics, use_tracemalloc=False):
+        self._log = logger
+        self._use_tracemalloc = use_tracemalloc
+        self._last_snapshot = None
+
+        metrics.gauge("memory.rss_bytes", get_rss)
+        metrics.gauge("memory.gc_objects", lambda: len(gc.get_objects()))
+        if use_tracemalloc:
+            metrics.gauge("memory.traced_bytes", self._traced_bytes)
+
+    def start(self):
+        if self._use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._log.info("Tracing memory allocations with tracemalloc")
+
+    def register_admin_routes(self, admin):
+        admin.add_route("GET", "/memory", self._get_memory)
+        admin.add_route("POST", "/memory/snapshot", self._post_snapshot)
+
+    @staticmethod
+    def _traced_bytes():
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+    def snapshot_diff(self, limit=DEFAULT_TOP_LIMIT):
+        """
+        Снять снимок памяти и сравнить его с предыдущим. Для первого снимка
+        возвращаются самые крупные места выделения памяти
+        """
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+        if self._last_snapshot is None:
+            stats = snapshot.statistics("traceback")
+            top = [
+                dict(size=s.size, count=s.count, traceback=s.traceback.format())
+                for s in stats[:limit]
+            ]
+        else:
+            stats = snapshot.compare_to(self._last_snapshot, "traceback")
+            top = [
+                dict(
+                    size=s.size,
+                    size_diff=s.size_diff,
+                    count=s.count,
+                    count_diff=s.count_diff,
+                    traceback=s.traceback.format(),
+                )
+                for s in stats[:limit]
+            ]
+
+        self._last_snapshot = snapshot
+        return top
+
+    async def _get_memory(self, request):
+        info = dict(
+            rss_bytes=get_rss(),
+            gc_counts=gc.get_count(),
+            objects=count_objects(),
+            traced_bytes=self._traced_bytes(),
+        )
+        return web.json_response(info)
+
+    async def _post_snapshot(self, request):
+        if not tracemalloc.is_tracing():
+            raise web.HTTPConflict(text="tracemalloc is not enabled, see --tracemalloc")
+
+        try:
+            limit = int(request.query.get("limit", DEFAULT_TOP_LIMIT))
+        except ValueError:
+            raise web.HTTPBadRequest(text="limit must be an integer")
+        top = self.snapshot_diff(limit)
+        return web.json_response(dict(top=top))
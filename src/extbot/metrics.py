@@ -0,0 +1,60 @@
+"""Метрики внутренней работы бота"""
+
+
+class Metrics:
+    """
+    Реестр метрик бота: счётчики, текущие значения и функции, которые вычисляют
+    значение в момент запроса. Все метрики хранятся в памяти процесса, их число
+    ограничено числом мест в коде, которые их обновляют
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1):
+        """
+        Увеличить счётчик на заданное значение
+        """
+
+        self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        Запомнить текущее значение метрики
+        """
+
+        self._values[name] = value
+
+    def observe(self, name, value):
+        """
+        Учесть очередное измерение, например длительность операции. Хранятся только
+        число измерений, их сумма и максимум
+        """
+
+        self.inc(f"{name}.count")
+        self.inc(f"{name}.total", value)
+        max_name = f"{name}.max"
+        if value > self._values.get(max_name, value - 1):
+            self._values[max_name] = value
+
+    def gauge(self, name, func):
+        """
+        Зарегистрировать функцию без аргументов, значение которой будет вычисляться
+        при каждом запросе метрик
+        """
+
+        self._gauges[name] = func
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def snapshot(self):
+        """
+        Получить словарь со значениями всех метрик
+        """
+
+        result = dict(self._values)
+        for name, func in self._gauges.items():
+            result[name] = func()
+        return dict(sorted(result.items()))
@@ -0,0 +1,163 @@
+"""
+Модели обновлений, которые Webim присылает боту
+
+Тело запроса разбирается и проверяется один раз, прямо в обработчике webhook, до того
+как бот подтвердит получение обновления. Обработчики дальше работают с атрибутами
+моделей и не обращаются к вложенным словарям, поэтому обновление в неверном формате
+отклоняется ответом 400, а не падает с KeyError в фоновой задаче.
+"""
+
+
+import json
+
+KEYBOARD_RESPONSE = "keyboard_response"
+FILE_VISITOR = "file_visitor"
+
+# Типы сравниваются точно, без isinstance: это быстрее и не пропускает bool вместо int
+_DICT = (dict,)
+_STR = (str,)
+_ID = (str, int)
+_TYPE_NAMES = {_DICT: "an object", _STR: "a string", _ID: "a string or a number"}
+
+
+class UpdateError(ValueError):
+    """Обновление от Webim не соответствует формату API"""
+
+
+class Message:
+    """
+    Сообщение в чате. Для нажатия кнопки заполнен button_id, для файла от
+    посетителя — file_data с описанием файла
+    """
+
+    __slots__ = ("kind", "text", "button_id", "file_data")
+
+    def __init__(self, kind, text=None, button_id=None, file_data=None):
+        self.kind = kind
+        self.text = text
+        self.button_id = button_id
+        self.file_data = file_data
+
+
+class Update:
+    """
+    Обновление от Webim. Исходный словарь сохраняется в raw для журналов
+    """
+
+    __slots__ = ("event", "chat_id", "visitor_id", "message", "raw")
+
+    def __init__(self, event, chat_id, visitor_id=None, message=None, raw=None):
+        self.event = event
+        self.chat_id = chat_id
+        self.visitor_id = visitor_id
+        self.message = message
+        self.raw = raw
+
+
+def _field(data, key, types, where, required=True):
+    value = data.get(key)
+    if value.__class__ in types:
+        return value
+    if value is None:
+        if required:
+            raise UpdateError(f"{where}.{key} is required")
+        return None
+    raise UpdateError(f"{where}.{key} must be {_TYPE_NAMES[types]}")
+
+
+def _parse_message(data, data_key, where):
+    kind = _field(data, "kind", _STR, where)
+    text = _field(data, "text", _STR, where, required=False)
+    payload = _field(
+        data,
+        data_key,
+        _DICT,
+        where,
+        required=kind in (KEYBOARD_RESPONSE, FILE_VISITOR),
+    )
+
+    if kind == KEYBOARD_RESPONSE:
+        button = payload.get("button")
+        if button.__class__ is dict and button.get("id").__class__ is str:
+            return Message(kind, text, button_id=button["id"])
+        # Медленный путь только для того, чтобы сообщить, что именно не так
+        button = _field(payload, "button", _DICT, f"{where}.{data_key}")
+        _field(button, "id", _STR, f"{where}.{data_key}.button")
+    if kind == FILE_VISITOR:
+        return Message(kind, text, file_data=payload)
+    return Message(kind, text)
+
+
+def load_update(body):
+    """
+    Разобрать JSON тела запроса с обновлением. При ошибке бросает UpdateError
+    """
+
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise UpdateError(f"invalid JSON: {e}") from e
+
+    if not isinstance(data, dict):
+        raise UpdateError("update must be an object")
+    return data
+
+
+def _visitor_id(data):
+    visitor = _field(data, "visitor", _DICT, "update", required=False)
+    if visitor is None:
+        return None
+    return _field(visitor, "id", _ID, "update.visitor", required=False)
+
+
+def parse_v1_update(data):
+    """
+    Проверить обновление API 1.0, в котором поля сообщения лежат прямо в обновлении
+    """
+
+    event = _field(data, "event", _STR, "update")
+    known_event = event in ("new_chat", "new_message")
+    chat = _field(data, "chat", _DICT, "update", required=known_event) or {}
+    chat_id = _field(chat, "id", _ID, "update.chat", required=known_event)
+
+    if event == "new_message":
+        message = _parse_message(data, "response", "update")
+        return Update(event, chat_id, message=message, raw=data)
+    return Update(event, chat_id, _visitor_id(data), raw=data)
+
+
+def parse_v2_update(data):
+    """
+    Проверить обновление API 2.0
+    """
+
+    event = _field(data, "event", _STR, "update")
+
+    if event == "new_message":
+        chat_id = _field(data, "chat_id", _ID, "update")
+        message_data = _field(data, "message", _DICT, "update")
+        message = _parse_message(message_data, "data", "update.message")
+        return Update(event, chat_id, message=message, raw=data)
+
+    chat = _field(data, "chat", _DICT, "update", required=event == "new_chat")
+    if chat is not None:
+        chat_id = _field(chat, "id", _ID, "update.chat", event == "new_chat")
+    else:
+        chat_id = _field(data, "chat_id", _ID, "update", required=False)
+    return Update(event, chat_id, _visitor_id(data), raw=data)
+
+
+def decode_v1_update(body):
+    """
+    Разобрать тело запроса API 1.0. При ошибке формата бросает UpdateError
+    """
+
+    return parse_v1_update(load_update(body))
+
+
+def decode_v2_update(body):
+    """
+    Разобрать тело запроса API 2.0. При ошибке формата бросает UpdateError
+    """
+
+    return parse_v2_update(load_update(body))
@@ -0,0 +1,167 @@
+"""
+Выполнение тяжёлой для процессора обработки сообщений в пуле процессов
+
+Разбор текста посетителя моделью, поиск по большому индексу или отрисовка больших
+шаблонов в обработчике обновления занимают цикл событий, и все остальные чаты ждут.
+Такую обработку можно вынести в функцию (hook) и указать её в опции
+--offload-hook: бот вызывает её в отдельных процессах для каждого сообщения
+посетителя. Функция получает словарь с id чата и текстом сообщения (а не всё
+обновление, чтобы передавать в процесс поменьше данных) и возвращает текст ответа
+или None, если отвечать должен сам бот:
+
+    def answer(message):
+        return "Hi!" if "hello" in message["text"].lower() else None
+
+Процессы пула запускаются вместе с ботом. Функция из --offload-init вызывается
+один раз в каждом процессе при его запуске и может заранее загрузить данные,
+например модель или шаблоны. Каждый вызов ограничен по времени: зависший вызов
+прерывается внутри процесса, а бот отвечает так, как если бы функция вернула None.
+"""
+
+
+import asyncio
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .utils import import_hook
+
+DEFAULT_TIMEOUT = 5.0
+# Запас времени на передачу результата из процесса, если таймер внутри процесса
+# не сработал, например в долгом вызове кода на C
+TIMEOUT_GRACE = 1.0
+
+_hook = None
+
+
+class HookTimeout(TimeoutError):
+    """Вызов функции обработки не уложился в отведённое время"""
+
+
+def _init_worker(hook, init):
+    global _hook
+
+    # Процессы пула останавливает бот, а не Ctrl+C в терминале
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _hook = import_hook(hook)
+    if init is not None:
+        import_hook(init)()
+
+
+def _on_alarm(signum, frame):
+    raise HookTimeout()
+
+
+def _call_hook(payload, timeout):
+    alarm = timeout and hasattr(signal, "setitimer")
+    if alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    started = time.perf_counter()
+    try:
+        return _hook(payload), time.perf_counter() - started
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _ping():
+    return os.getpid()
+
+
+class ProcessOffload:
+    """
+    Пул из workers процессов, выполняющих функцию hook ("module:function"). В
+    метриках видны число ждущих и выполняемых вызовов, время выполнения в процессе
+    и полное время с ожиданием в очереди
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        hook,
+        init=None,
+        workers=None,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._hook = hook
+        self._init = init
+        self._workers = workers or os.cpu_count() or 1
+        self._timeout = timeout
+
+        self._executor = None
+        self._pending = 0
+
+        metrics.gauge("offload.pending", lambda: self._pending)
+
+    async def startup(self, *_):
+        if self._executor is None:
+            self._executor = self._make_executor()
+            await self._warm_up()
+
+    async def cleanup(self, *_):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=False)
+
+    async def run(self, payload):
+        """
+        Вызвать функцию обработки в пуле. Возвращает её результат или None, если
+        вызов завершился ошибкой или не уложился в timeout секунд
+        """
+
+        if self._executor is None:
+            self._executor = self._make_executor()
+        executor = self._executor
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self._pending += 1
+        try:
+            future = loop.run_in_executor(executor, _call_hook, payload, self._timeout)
+            result, run_time = await asyncio.wait_for(
+                future, self._timeout + TIMEOUT_GRACE
+            )
+        except (HookTimeout, asyncio.TimeoutError):
+            self._metrics.inc("offload.timeouts")
+            self._log.warning(f"Offload hook {self._hook} timed out")
+            return None
+        except BrokenProcessPool:
+            # Процесс пула упал, например из-за нехватки памяти: пул пересоздаётся
+            self._metrics.inc("offload.errors")
+            if self._executor is executor:
+                self._log.error("Offload process pool is broken, restarting it")
+                executor.shutdown(wait=False)
+                self._executor = self._make_executor()
+            return None
+        except Exception:
+            self._metrics.inc("offload.errors")
+            self._log.exception(f"Error in offload hook {self._hook}")
+            return None
+        finally:
+            self._pending -= 1
+            self._metrics.observe("offload.latency", loop.time() - started)
+
+        self._metrics.observe("offload.time", run_time)
+        return result
+
+    def _make_executor(self):
+        return ProcessPoolExecutor(
+            self._workers,
+            initializer=_init_worker,
+            initargs=(self._hook, self._init),
+        )
+
+    async def _warm_up(self):
+        # Пул запускает процессы по мере надобности, поэтому все процессы
+        # запускаются заранее одновременными пустыми вызовами
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _ping) for _ in range(self._workers))
+        )
+        self._log.info(f"Started {len(set(pids))} offload process(es)")
@@ -0,0 +1,155 @@
+"""
+Буфер исходящих сообщений бота по чатам
+
+Когда посетитель быстро нажимает несколько кнопок, на каждое нажатие бот отвечает
+текстом и новой клавиатурой, и все клавиатуры, кроме последней, посетителю уже не
+нужны. Буфер придерживает сообщения чата на короткое время linger и отправляет их
+одной пачкой, из которой убраны клавиатуры, заменённые более поздними, и
+повторяющиеся подряд одинаковые тексты. Порядок оставшихся сообщений сохраняется.
+"""
+
+
+import asyncio
+
+DEFAULT_LINGER = 0.2
+
+
+def coalesce(messages):
+    """
+    Номера сообщений, которые нужно отправить: из клавиатур остаётся только
+    последняя, а из нескольких одинаковых текстов подряд — первый
+    """
+
+    keyboards = [
+        i for i, message in enumerate(messages) if message["kind"] == "keyboard"
+    ]
+    last_keyboard = keyboards[-1] if keyboards else None
+
+    kept = []
+    for i, message in enumerate(messages):
+        if message["kind"] == "keyboard" and i != last_keyboard:
+            continue
+        if message["kind"] == "operator" and kept and messages[kept[-1]] == message:
+            continue
+        kept.append(i)
+    return kept
+
+
+class _ChatBuffer:
+    __slots__ = ("items", "timer", "sending")
+
+    def __init__(self):
+        self.items = []
+        self.timer = None
+        self.sending = None
+
+
+class Outbox:
+    """
+    Буфер исходящих сообщений. Сообщения отправляет корутина send(chat_id,
+    message, deadline), где deadline — значение, переданное в Outbox.send
+    """
+
+    def __init__(self, logger, metrics, send, linger=DEFAULT_LINGER):
+        self._log = logger
+        self._metrics = metrics
+        self._send = send
+        self._linger = linger
+
+        self._buffers = {}
+        self._tasks = set()
+
+        metrics.gauge("outbox.chats", self._buffers.__len__)
+
+    def send(self, chat_id, message, deadline=None):
+        """
+        Добавить сообщение в буфер чата. Возвращает future с ответом Webim, который
+        будет готов после отправки, или с None, если сообщение заменено более
+        поздним или не отправлено из-за ошибки
+        """
+
+        loop = asyncio.get_running_loop()
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            buffer = self._buffers[chat_id] = _ChatBuffer()
+
+        future = loop.create_future()
+        buffer.items.append((message, deadline, future))
+        if buffer.timer is None:
+            buffer.timer = loop.call_later(self._linger, self._flush_later, chat_id)
+        return future
+
+    async def flush(self, chat_id):
+        """
+        Отправить сообщения чата, не дожидаясь конца linger, и дождаться отправки
+        всех его сообщений, в том числе отправляемых сейчас
+        """
+
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            return
+
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+            buffer.timer = None
+
+        if buffer.items:
+            items, buffer.items = buffer.items, []
+            # Пачки одного чата отправляются строго по очереди
+            task = asyncio.ensure_future(
+                self._send_items(chat_id, items, buffer.sending)
+            )
+            buffer.sending = task
+            task.add_done_callback(lambda task: self._forget(chat_id, buffer, task))
+
+        if buffer.sending is not None:
+            await asyncio.shield(buffer.sending)
+
+    async def close(self):
+        """
+        Отправить все сообщения из буфера
+        """
+
+        await asyncio.gather(*(self.flush(chat_id) for chat_id in list(self._buffers)))
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush_later(self, chat_id):
+        buffer = self._buffers.get(chat_id)
+        if buffer is not None:
+            buffer.timer = None
+        task = asyncio.ensure_future(self.flush(chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_items(self, chat_id, items, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+
+        kept = coalesce([message for message, _, _ in items])
+        saved = len(items) - len(kept)
+        if saved:
+            self._metrics.inc("outbox.saved", saved)
+            self._log.debug(f"Coalesced {saved} superseded messages in {chat_id!r}")
+
+        kept = set(kept)
+        for i, (message, deadline, future) in enumerate(items):
+            if i not in kept:
+                if not future.done():
+                    future.set_result(None)
+                continue
+
+            try:
+                result = await self._send(chat_id, message, deadline)
+            except Exception:
+                self._log.exception(f"Error sending message to chat {chat_id!r}")
+                result = None
+            self._metrics.inc("outbox.sent")
+            if not future.done():
+                future.set_result(result)
+
+    def _forget(self, chat_id, buffer, task):
+        if buffer.sending is task:
+            buffer.sending = None
+        if not buffer.items and buffer.timer is None and buffer.sending is None:
+            if self._buffers.get(chat_id) is buffer:
+                del self._buffers[chat_id]
@@ -0,0 +1,148 @@
+"""
+Цепочка этапов обработки обновления, общая для ботов API 1.0 и API 2.0
+
+Обновление проходит этапы по порядку: decode (разбор JSON), validate (проверка
+формата), flood (защита от потока сообщений из одного чата, если она включена),
+дополнительные этапы из опции --update-middleware, затем этапы бота:
+у API 1.0 — route (выбор ответа), handle (сборка сообщений) и send (ответ
+Webim), у API 2.0 — enqueue (постановка в очередь), route и handle (отправка
+сообщений в Webim).
+
+Этап — это корутина stage(context, call_next). Она может изменить context
+(UpdateContext), вызвать следующие этапы через await call_next(context) и вернуть
+их результат, а может прервать обработку, вернув свой HTTP-ответ:
+
+    async def skip_closed_chats(context, call_next):
+        if context.update.event == "chat_closed":
+            return web.json_response(dict(result="ok"))
+        return await call_next(context)
+
+Цепочка собирается один раз при создании бота. Отключённые этапы (None) в неё не
+попадают и ничего не стоят. Время каждого этапа без учёта следующих этапов
+накапливается в метриках pipeline.<версия API>.<этап>.count и .total.
+"""
+
+
+import time
+
+from aiohttp import web
+
+from .models import UpdateError, load_update
+
+# Имена встроенных этапов ботов обеих версий API
+STAGE_NAMES = ("decode", "validate", "flood", "enqueue", "route", "handle", "send")
+
+
+class UpdateContext:
+    """
+    Состояние обработки одного обновления. Этапы заполняют поля по мере обработки
+    """
+
+    __slots__ = (
+        "request",
+        "body",
+        "data",
+        "update",
+        "received",
+        "webim_version",
+        "transition",
+        "response",
+        "nested",
+    )
+
+    def __init__(self, request):
+        self.request = request
+        self.body = None
+        self.data = None
+        self.update = None
+        self.received = time.monotonic()
+        self.webim_version = None
+        self.transition = None
+        self.response = None
+        # Суммарное время вложенных этапов, чтобы вычесть его из времени этапа
+        self.nested = 0.0
+
+
+class StageTimer:
+    __slots__ = ("count", "total")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+
+class Pipeline:
+    """
+    Цепочка этапов stages — список пар (имя, этап или None). Метрики этапов
+    называются pipeline.<name>.<имя этапа>
+    """
+
+    def __init__(self, metrics, name, stages, clock=time.perf_counter):
+        stages = [(stage_name, stage) for stage_name, stage in stages if stage]
+        self.timers = {stage_name: StageTimer() for stage_name, _ in stages}
+        if len(self.timers) != len(stages):
+            raise ValueError("stage names must be unique")
+
+        call = _end
+        for stage_name, stage in reversed(stages):
+            timer = self.timers[stage_name]
+            call = _timed(stage, call, timer, clock)
+            prefix = f"pipeline.{name}.{stage_name}"
+            metrics.gauge(f"{prefix}.count", lambda timer=timer: timer.count)
+            metrics.gauge(f"{prefix}.total", lambda timer=timer: timer.total)
+        self._call = call
+
+    async def run(self, context):
+        return await self._call(context)
+
+
+async def _end(context):
+    return context.response
+
+
+def _timed(stage, call_next, timer, clock):
+    async def call(context):
+        started = clock()
+        nested = context.nested
+        try:
+            return await stage(context, call_next)
+        finally:
+            elapsed = clock() - started
+            timer.count += 1
+            timer.total += elapsed - (context.nested - nested)
+            context.nested = nested + elapsed
+
+    return call
+
+
+def decoder(logger):
+    """
+    Этап decode: прочитать тело запроса и разобрать JSON
+    """
+
+    async def decode(context, call_next):
+        context.body = await context.request.read()
+        try:
+            context.data = load_update(context.body)
+        except UpdateError as e:
+            logger.warning(f"Invalid update: {e}")
+            raise web.HTTPBadRequest(text=str(e)) from e
+        return await call_next(context)
+
+    return decode
+
+
+def validator(parse, logger):
+    """
+    Этап validate: проверить формат обновления функцией parse из extbot.models
+    """
+
+    async def validate(context, call_next):
+        try:
+            context.update = parse(context.data)
+        except UpdateError as e:
+            logger.warning(f"Invalid update: {e}")
+            raise web.HTTPBadRequest(text=str(e)) from e
+        return await call_next(context)
+
+    return validate
@@ -0,0 +1,352 @@
+"""
+Очередь обработки обновлений с классами приоритета
+
+Когда обновлений больше, чем бот успевает обрабатывать одновременно, они ждут в
+очереди. Обновления из очереди берутся по классам приоритета: сначала действия,
+которые передают чат людям или закрывают его, затем ответы в уже начатых чатах и
+только потом приветствия в новых чатах. Чтобы обновления низких классов не ждали
+бесконечно, обновление, прождавшее дольше max_wait секунд, обрабатывается раньше
+остальных. Всего в очереди ждёт не больше max_pending обновлений: при всплеске
+обновлений новые отклоняются, чтобы очередь не занимала память без ограничения.
+
+Каждое обновление в очереди — это задание с номером, чатом и текущим этапом
+обработки. Задания можно посмотреть и отменить через служебный API, а сторож
+сообщает о заданиях, которые выполняются дольше job_timeout секунд, и при
+необходимости отменяет их, чтобы они не занимали соединения с Webim.
+"""
+
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import itertools
+import time
+
+from aiohttp import web
+
+URGENT = "urgent"
+REPLY = "reply"
+GREETING = "greeting"
+DEFAULT_ORDER = (URGENT, REPLY, GREETING)
+
+DEFAULT_CONCURRENCY = 100
+DEFAULT_MAX_WAIT = 5.0
+DEFAULT_HIGH_WATER = 1000
+DEFAULT_MAX_PENDING = 10000
+
+QUEUED = "queued"
+HANDLING = "handling"
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def job_stage(stage):
+    """
+    Отметить этап обработки текущего задания очереди на время блока with. Вне
+    задания ничего не делает
+    """
+
+    job = _current_job.get()
+    if job is None:
+        yield
+        return
+
+    previous = job.stage, job.stage_started
+    job.stage, job.stage_started = stage, job.clock()
+    try:
+        yield
+    finally:
+        job.stage, job.stage_started = previous
+
+
+class Job:
+    __slots__ = (
+        "id",
+        "priority",
+        "coro",
+        "chat_id",
+        "event",
+        "clock",
+        "enqueued",
+        "stage",
+        "stage_started",
+        "task",
+        "reported",
+    )
+
+    def __init__(self, job_id, priority, coro, chat_id, event, clock):
+        self.id = job_id
+        self.priority = priority
+        self.coro = coro
+        self.chat_id = chat_id
+        self.event = event
+        self.clock = clock
+        self.enqueued = clock()
+        self.stage = QUEUED
+        self.stage_started = self.enqueued
+        self.task = None
+        self.reported = False
+
+    def to_json(self):
+        now = self.clock()
+        return dict(
+            id=self.id,
+            priority=self.priority,
+            chat_id=self.chat_id,
+            event=self.event,
+            active=self.task is not None,
+            age=round(now - self.enqueued, 3),
+            stage=self.stage,
+            stage_age=round(now - self.stage_started, 3),
+        )
+
+
+class PriorityWorkQueue:
+    """
+    Выполняет не больше concurrency корутин одновременно, остальные ждут в очередях
+    своих классов. Классы перечислены в order от самого важного к наименее важному
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        order=DEFAULT_ORDER,
+        concurrency=DEFAULT_CONCURRENCY,
+        max_wait=DEFAULT_MAX_WAIT,
+        clock=time.monotonic,
+        job_timeout=None,
+        cancel_stuck=False,
+        max_pending=DEFAULT_MAX_PENDING,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._order = tuple(order)
+        self._concurrency = concurrency
+        self._max_wait = max_wait
+        self._clock = clock
+        self._job_timeout = job_timeout
+        self._cancel_stuck = cancel_stuck
+        self._max_pending = max_pending
+
+        self._queues = {name: collections.deque() for name in self._order}
+        self._active = {}
+        self._job_ids = itertools.count(1)
+        self._watchdog = None
+        self._closed = False
+
+        for name, queue in self._queues.items():
+            metrics.gauge(f"queue.{name}.depth", queue.__len__)
+        metrics.gauge("queue.active", self.__len__)
+
+    def __len__(self):
+        return len(self._active)
+
+    @property
+    def pending_count(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        """
+        Запустить сторожа заданий, если задан job_timeout
+        """
+
+        if self._job_timeout is not None and self._watchdog is None:
+            self._watchdog = asyncio.ensure_future(self._run_watchdog())
+
+    def submit(self, priority, coro, chat_id=None, event=None):
+        """
+        Поставить корутину в очередь класса priority. Чат и событие нужны только
+        для просмотра и отмены заданий. Если корутина не может начаться сразу, а в
+        очереди уже ждут max_pending заданий, выбрасывает QueueFullError
+        """
+
+        if self._closed:
+            coro.close()
+            raise RuntimeError("work queue is closed")
+
+        if (
+            len(self._active) >= self._concurrency
+            and self.pending_count >= self._max_pending
+        ):
+            coro.close()
+            self._metrics.inc(f"queue.{priority}.rejected")
+            raise QueueFullError(f"{self.pending_count} updates are already queued")
+
+        job = Job(next(self._job_ids), priority, coro, chat_id, event, self._clock)
+        self._queues[priority].append(job)
+        self._dispatch()
+        return job
+
+    def jobs(self):
+        """
+        Выполняемые и ждущие задания, начиная с самых старых
+        """
+
+        jobs = list(self._active.values())
+        for queue in self._queues.values():
+            jobs.extend(queue)
+        return sorted(jobs, key=lambda job: job.id)
+
+    def cancel(self, job_id):
+        """
+        Отменить задание по номеру. Возвращает задание или None, если его уже нет
+        """
+
+        job = self._active.get(job_id)
+        if job is not None:
+            job.task.cancel()
+            self._metrics.inc("queue.cancelled")
+            return job
+
+        for queue in self._queues.values():
+            for job in queue:
+                if job.id == job_id:
+                    queue.remove(job)
+                    job.coro.close()
+                    self._metrics.inc("queue.cancelled")
+                    return job
+        return None
+
+    def cancel_chat(self, chat_id):
+        """
+        Отменить все задания чата. Возвращает отменённые задания. Id чатов
+        сравниваются как строки: в служебный API id приходит строкой, а в
+        обновлениях Webim может быть числом
+        """
+
+        chat_id = str(chat_id)
+        jobs = [job for job in self.jobs() if str(job.chat_id) == chat_id]
+        for job in jobs:
+            self.cancel(job.id)
+        return jobs
+
+    def check_stuck(self):
+        """
+        Сообщить о выполняемых заданиях старше job_timeout секунд и, если задано
+        cancel_stuck, отменить их. Возвращает такие задания
+        """
+
+        now = self._clock()
+        stuck = [
+            job
+            for job in self._active.values()
+            if now - job.enqueued > self._job_timeout
+        ]
+        for job in stuck:
+            if job.reported:
+                continue
+            job.reported = True
+            self._metrics.inc("queue.stuck")
+            self._log.warning(
+                f"Job {job.id} for chat {job.chat_id!r} is running for"
+                f" {now - job.enqueued:.1f}s, stage {job.stage!r}"
+            )
+            if self._cancel_stuck:
+                self._log.warning(f"Cancelling stuck job {job.id}")
+                self.cancel(job.id)
+        return stuck
+
+    async def close(self):
+        self._closed = True
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            await asyncio.gather(self._watchdog, return_exceptions=True)
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().coro.close()
+        tasks = [job.task for job in self._active.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_watchdog(self):
+        interval = min(self._job_timeout / 2, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            self.check_stuck()
+
+    def _next(self):
+        now = self._clock()
+
+        # Защита от голодания: обновление, которое ждёт слишком долго, идёт первым,
+        # а из нескольких таких — то, что ждёт дольше всех
+        starved = None
+        for name in self._order:
+            queue = self._queues[name]
+            if queue and now - queue[0].enqueued > self._max_wait:
+                if (
+                    starved is None
+                    or queue[0].enqueued < self._queues[starved][0].enqueued
+                ):
+                    starved = name
+        if starved is not None:
+            self._metrics.inc(f"queue.{starved}.starved")
+            return starved
+
+        for name in self._order:
+            if self._queues[name]:
+                return name
+        return None
+
+    def _dispatch(self):
+        while len(self._active) < self._concurrency:
+            name = self._next()
+            if name is None:
+                return
+
+            job = self._queues[name].popleft()
+            now = self._clock()
+            self._metrics.observe(f"queue.{name}.wait", now - job.enqueued)
+            job.stage, job.stage_started = HANDLING, now
+            job.task = asyncio.ensure_future(self._run_job(job))
+            self._active[job.id] = job
+            job.task.add_done_callback(lambda task, job=job: self._done(job, task))
+
+    @staticmethod
+    async def _run_job(job):
+        # Задача выполняется в своей копии контекста, поэтому job_stage внутри
+        # корутины видит именно это задание
+        _current_job.set(job)
+        return await job.coro
+
+    def _done(self, job, task):
+        del self._active[job.id]
+        if not task.cancelled() and task.exception() is not None:
+            self._log.error("Error handling update", exc_info=task.exception())
+        if not self._closed:
+            self._dispatch()
+
+    def register_admin_routes(self, admin):
+        admin.add_route("GET", "/jobs", self._get_jobs)
+        admin.add_route("POST", "/jobs/cancel", self._post_cancel_chat)
+        admin.add_route("POST", "/jobs/{job_id}/cancel", self._post_cancel)
+
+    async def _get_jobs(self, request):
+        jobs = [job.to_json() for job in self.jobs()]
+        return web.json_response(
+            dict(active=len(self._active), pending=self.pending_count, jobs=jobs)
+        )
+
+    async def _post_cancel(self, request):
+        try:
+            job_id = int(request.match_info["job_id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text="job id must be an integer")
+        job = self.cancel(job_id)
+        if job is None:
+            raise web.HTTPNotFound(text=f"No job {job_id}")
+        return web.json_response(job.to_json())
+
+    async def _post_cancel_chat(self, request):
+        chat_id = request.query.get("chat_id")
+        if not chat_id:
+            raise web.HTTPBadRequest(text="chat_id is required")
+        jobs = self.cancel_chat(chat_id)
+        return web.json_response(dict(cancelled=[job.id for job in jobs]))
@@ -0,0 +1,359 @@
+"""
+Запись входящих запросов от Webim и их воспроизведение
+
+Запись включается опцией --record-dir. Каждый запрос к webhook бота записывается
+в формате JSON Lines: адрес, заголовки с версиями API и Webim, тело и время
+получения. Файлы записи сменяются при достижении заданного размера, старые файлы
+удаляются. По желанию из записи убираются тексты сообщений и данные посетителей,
+а заголовки с токенами в запись не попадают никогда.
+
+Воспроизведение записи на другой экземпляр бота с исходными интервалами между
+запросами или в N раз быстрее:
+    extbot-replay <файл или директория записи> --url http://localhost:8000 --speed 10
+"""
+
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+from .cluster import FORWARDED_HEADER
+
+DEFAULT_MAX_SIZE_MB = 64
+DEFAULT_MAX_FILES = 10
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_REPLAY_CONCURRENCY = 100
+
+FILE_PREFIX = "traffic-"
+FILE_SUFFIX = ".jsonl"
+RECORDED_HEADERS = ("X-Bot-API-Dialect", "X-Bot-API-Version", "X-Webim-Version")
+
+SCRUBBED = "***"
+# Поля обновлений, в которых могут быть тексты посетителей и их персональные данные
+SCRUBBED_FIELDS = frozenset(
+    ("text", "name", "phone", "email", "url", "fields", "info", "provided_fields")
+)
+
+
+def scrub(value):
+    """
+    Заменить в обновлении тексты, файлы и данные посетителя на "***". Идентификаторы
+    чатов, посетителей и кнопок остаются, чтобы запись можно было воспроизвести
+    """
+
+    if isinstance(value, dict):
+        return {
+            key: _scrub_all(item) if key in SCRUBBED_FIELDS else scrub(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+def _scrub_all(value):
+    if isinstance(value, dict):
+        return {key: _scrub_all(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_scrub_all(item) for item in value]
+    return SCRUBBED if value is not None else None
+
+
+def _capture_paths(directory):
+    return sorted(Path(directory).glob(f"{FILE_PREFIX}*{FILE_SUFFIX}"))
+
+
+class TrafficRecorder:
+    """
+    Запись запросов к webhook бота. Записи копятся в памяти и дописываются в файл
+    раз в flush_interval секунд в пуле потоков. Когда файл достигает max_size байт,
+    начинается новый, а из старых файлов остаются только max_files последних
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        directory,
+        max_size=DEFAULT_MAX_SIZE_MB * 1024 * 1024,
+        max_files=DEFAULT_MAX_FILES,
+        scrub_pii=False,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._directory = Path(directory)
+        self._max_size = max_size
+        self._max_files = max_files
+        self._scrub_pii = scrub_pii
+        self._flush_interval = flush_interval
+
+        self._number = 0
+        self._size = 0
+        self._pending = []
+        self._flush_lock = None
+        self._task = None
+
+    async def startup(self, *_):
+        self._directory.mkdir(parents=True, exist_ok=True)
+        paths = _capture_paths(self._directory)
+        # Каждый запуск бота начинает новый файл
+        last = int(paths[-1].stem[len(FILE_PREFIX) :]) if paths else 0
+        self._number = last + 1
+        self._size = 0
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def cleanup(self, *_):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+
+    def wrap(self, handler):
+        """
+        Обернуть обработчик webhook так, чтобы каждый запрос записывался до
+        обработки. Запросы, пересланные другим узлом кластера, не записываются,
+        потому что их уже записал узел, получивший их от Webim
+        """
+
+        async def recorded_handler(request):
+            if FORWARDED_HEADER not in request.headers:
+                self.record(request.path, request.headers, await request.read())
+            return await handler(request)
+
+        return recorded_handler
+
+    def record(self, path, headers, body):
+        body = body.decode("utf-8", errors="replace")
+        if self._scrub_pii:
+            try:
+                body = json.dumps(scrub(json.loads(body)), ensure_ascii=False)
+            except ValueError:
+                body = SCRUBBED
+
+        record = dict(
+            time=time.time(),
+            path=path,
+            headers={
+                name: headers[name] for name in RECORDED_HEADERS if name in headers
+            },
+            body=body,
+        )
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+
+        if self._size and self._size + len(line) > self._max_size:
+            self._number += 1
+            self._size = 0
+        self._pending.append((self._number, line))
+        self._size += len(line)
+        self._metrics.inc("recorder.records")
+
+    async def flush(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write, pending)
+            except OSError as e:
+                self._metrics.inc("recorder.write_errors")
+                self._log.error(f"Error writing traffic record: {e}")
+
+    def _path(self, number):
+        return self._directory / f"{FILE_PREFIX}{number:06d}{FILE_SUFFIX}"
+
+    def _write(self, pending):
+        files = {}
+        for number, line in pending:
+            files.setdefault(number, bytearray()).extend(line)
+        for number, content in sorted(files.items()):
+            with open(self._path(number), "ab") as capture_file:
+                capture_file.write(content)
+
+        if len(files) > 1 or len(_capture_paths(self._directory)) > self._max_files:
+            for path in _capture_paths(self._directory)[: -self._max_files]:
+                path.unlink()
+                self._log.info(f"Removed old traffic record {path}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+
+def read_capture(path):
+    """
+    Прочитать записанные запросы из файла или из всех файлов директории записи
+    """
+
+    path = Path(path)
+    paths = _capture_paths(path) if path.is_dir() else [path]
+    for capture_path in paths:
+        with open(capture_path, encoding="utf-8") as capture_file:
+            for line in capture_file:
+                # Последняя строка могла остаться недописанной при аварии
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+async def replay(
+    session, url, records, speed=1.0, concurrency=DEFAULT_REPLAY_CONCURRENCY
+):
+    """
+    Отправить записанные запросы на url с исходными интервалами, ускоренными в
+    speed раз. Если speed равен 0, запросы отправляются без пауз. Запрос
+    отправляется по расписанию, даже если ответы на предыдущие ещё не получены, но
+    одновременно выполняется не больше concurrency запросов. Возвращает список пар
+    (задержка ответа в секундах, код ответа или None при ошибке соединения)
+    """
+
+    base_url = url.rstrip("/")
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    results = []
+
+    async def send(record):
+        async with semaphore:
+            started = loop.time()
+            try:
+                async with session.post(
+                    base_url + record["path"],
+                    data=record["body"].encode(),
+                    headers=dict(
+                        record["headers"], **{"Content-Type": "application/json"}
+                    ),
+                ) as response:
+                    await response.read()
+                    status = response.status
+            except (ClientError, asyncio.TimeoutError):
+                status = None
+            results.append((loop.time() - started, status))
+
+    tasks = []
+    replay_started = loop.time()
+    first_time = None
+    for record in records:
+        if first_time is None:
+            first_time = record["time"]
+        if speed:
+            delay = (record["time"] - first_time) / speed
+            wait = replay_started + delay - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        tasks.append(asyncio.ensure_future(send(record)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(results, duration):
+    """
+    Сводка по результатам воспроизведения: число запросов, ошибок и задержки ответов
+    """
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status is None or status >= 400)
+
+    def percentile(fraction):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+    return dict(
+        requests=len(results),
+        errors=errors,
+        duration=round(duration, 3),
+        p50_ms=round(percentile(0.5) * 1000, 2),
+        p90_ms=round(percentile(0.9) * 1000, 2),
+        p99_ms=round(percentile(0.99) * 1000, 2),
+        max_ms=round((latencies[-1] if latencies else 0.0) * 1000, 2),
+    )
+
+
+def compare(summary, baseline):
+    """
+    Разница между сводками двух прогонов, например текущей сборки и предыдущей
+    """
+
+    return {
+        key: round(summary[key] - baseline[key], 3)
+        for key in summary
+        if key in baseline and key != "requests"
+    }
+
+
+async def run_replay(args):
+    records = read_capture(args.capture)
+    timeout = ClientTimeout(total=args.timeout)
+    async with ClientSession(timeout=timeout) as session:
+        started = time.monotonic()
+        results = await replay(session, args.url, records, args.speed, args.concurrency)
+        return summarize(results, time.monotonic() - started)
+
+
+def add_replay_arguments(parser):
+    """
+    Добавить общие опции воспроизведения в парсер аргументов командной строки
+    """
+
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay this many times faster than recorded, 0 means without pauses",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_REPLAY_CONCURRENCY,
+        help="send at most this many requests at once",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0, help="request timeout")
+    parser.add_argument("--report", help="save summary to this JSON file")
+    parser.add_argument(
+        "--baseline", help="summary JSON file of previous run to compare with"
+    )
+
+
+def report(summary, args):
+    """
+    Вывести сводку и, если задан --baseline, её разницу с предыдущим прогоном
+    """
+
+    output = dict(summary=summary)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        output["delta"] = compare(summary, baseline)
+    if args.report:
+        Path(args.report).write_text(json.dumps(summary), encoding="utf-8")
+    print(json.dumps(output, indent=2))
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="extbot-replay",
+        description="Replay traffic recorded by extbot --record-dir",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("capture", help="record file or directory")
+    parser.add_argument(
+        "--url", required=True, help="bot URL, e.g. http://localhost:8000"
+    )
+    add_replay_arguments(parser)
+    args = parser.parse_args()
+    report(asyncio.run(run_replay(args)), args)
+
+
+if __name__ == "__main__":
+    main()
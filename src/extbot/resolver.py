@@ -0,0 +1,79 @@
+"""
+Выбор перехода в ответ на сообщение посетителя, общий для ботов API 1.0 и API 2.0
+
+Сообщение посетителя проверяется по порядку: функцией обработки в пуле процессов
+(extbot.offload), затем нажатие кнопки ищется среди кнопок описания диалога, а текст
+сообщения — в базе FAQ. Если ничего не подошло, выбирается переход для вида
+сообщения из описания диалога.
+"""
+
+
+from .models import KEYBOARD_RESPONSE
+from .priority import job_stage
+
+
+class MessageResolver:
+    """
+    Выбирает переход из описания диалога flow в ответ на сообщение. База FAQ,
+    статистика и пул процессов необязательны
+    """
+
+    def __init__(self, logger, flow, faq=None, analytics=None, offload=None):
+        self._log = logger
+        self._flow = flow
+        self._faq = faq
+        self._faq_replies = [flow.reply(a) for a in faq.answers] if faq else []
+        self._analytics = analytics
+        self._offload = offload
+
+    async def resolve(self, chat_id, message):
+        """
+        Переход в ответ на сообщение или None, если сообщение не поддерживается
+        """
+
+        if self._analytics is not None:
+            self._analytics.new_message(chat_id)
+        with job_stage("offload"):
+            transition = await self._offload_reply(chat_id, message)
+        if transition is None:
+            transition = self._resolve_message(message)
+        return transition
+
+    async def _offload_reply(self, chat_id, message):
+        """
+        Ответ на сообщение посетителя от функции обработки в пуле процессов или
+        None, если пул не настроен или функция не ответила
+        """
+
+        if self._offload is None or message.kind != "visitor" or not message.text:
+            return None
+
+        reply = await self._offload.run(dict(chat_id=chat_id, text=message.text))
+        if not isinstance(reply, str) or not reply:
+            return None
+        self._log.info(f"Answering from offload hook in chat {chat_id!r}")
+        return self._flow.reply(reply)
+
+    def _resolve_message(self, message):
+        message_kind = message.kind
+
+        if message_kind == KEYBOARD_RESPONSE:
+            button_id = message.button_id
+            transition = self._flow.button(button_id)
+            if transition is None:
+                self._log.warning(f"Unexpected button id {button_id!r}")
+            elif self._analytics is not None:
+                self._analytics.button_click(button_id)
+        elif message_kind == "visitor" and self._faq is not None:
+            entry = self._faq.match(message.text or "")
+            if entry is not None:
+                self._log.info(f"Answering from FAQ entry {entry}")
+                transition = self._faq_replies[entry]
+            else:
+                transition = self._flow.message(message_kind)
+        else:
+            transition = self._flow.message(message_kind)
+            if transition is None:
+                self._log.warning(f"Unsupported message kind {message_kind!r}")
+
+        return transition
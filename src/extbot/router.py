@@ -7,16 +7,34 @@ from aiohttp import web
 class ApiVersionRouter:
     """Маршрутизатор для автоматического определения версии API"""
 
-    def __init__(self, logger, api_v1_bot, api_v2_bot=None):
+    def __init__(
+        self,
+        logger,
+        api_v1_bot,
+        api_v2_bot=None,
+        cluster=None,
+        loop_monitor=None,
+        recorder=None,
+    ):
         self._log = logger
         self._api_v1_bot = api_v1_bot
         self._api_v2_bot = api_v2_bot
+        self._cluster = cluster
+        self._loop_monitor = loop_monitor
+        self._recorder = recorder
 
     def get_routes(self):
+        webhooks = dict(index=self.index, v1=self.v1, v2=self.v2)
+        if self._recorder is not None:
+            webhooks = {
+                name: self._recorder.wrap(handler) for name, handler in webhooks.items()
+            }
         return [
-            web.post("/", self.index),
-            web.post("/v1", self.v1),
-            web.post("/v2", self.v2),
+            web.post("/", webhooks["index"]),
+            web.post("/v1", webhooks["v1"]),
+            web.post("/v2", webhooks["v2"]),
+            web.get("/healthz", self.healthz),
+            web.get("/readyz", self.readyz),
         ]
 
     async def index(self, request):
@@ -55,7 +73,47 @@ class ApiVersionRouter:
                 " See extbot --help for the required arguments"
             )
             raise web.HTTPNotFound
+        if self._cluster is not None:
+            response = await self._cluster.route(request)
+            if response is not None:
+                return response
         return await self._api_v2_bot.webhook(request)
 
     async def v1(self, request):
+        if self._cluster is not None:
+            response = await self._cluster.route(request)
+            if response is not None:
+                return response
         return await self._api_v1_bot.webhook(request)
+
+    async def healthz(self, request):
+        """
+        Проверка живости бота для оркестратора: цикл событий отвечает без большой
+        задержки. Не обращается ни к Webim, ни к обработке обновлений
+        """
+
+        if self._loop_monitor is None:
+            return web.json_response(dict(status="ok"))
+
+        lag = round(self._loop_monitor.lag, 3)
+        if not self._loop_monitor.is_healthy():
+            return web.json_response(dict(status="unhealthy", loop_lag=lag), status=503)
+        return web.json_response(dict(status="ok", loop_lag=lag))
+
+    async def readyz(self, request):
+        """
+        Проверка готовности бота для оркестратора: пока соединения с Webim не
+        прогреты, Webim перегружен или очередь обновлений переполнена, бот отвечает
+        503. В ответе перечислены результаты всех проверок
+        """
+
+        # Бот без API 2.0 обслуживает только API 1.0 и поэтому всегда готов
+        checks = dict(api_v2=self._api_v2_bot is not None)
+        if self._api_v2_bot is not None:
+            checks.update(self._api_v2_bot.readiness())
+
+        if not all(value for name, value in checks.items() if name != "api_v2"):
+            return web.json_response(
+                dict(status="not ready", checks=checks), status=503
+            )
+        return web.json_response(dict(status="ok", checks=checks))
@@ -2,7 +2,9 @@
 
 
 import argparse
+import json
 import logging
+import sqlite3
 import sys
 from string import ascii_letters, digits
 
@@ -10,9 +12,52 @@ import validators
 from aiohttp import web
 
 from . import __version__
+from .admin import AdminApi
+from .analytics import DEFAULT_RETENTION_HOURS, Analytics
 from .api_v1 import ApiV1Sample
-from .api_v2 import ApiV2Sample
+from .api_v2 import INACTIVITY_REMINDER_TEXT, ApiV2Sample
+from .bulk import BulkOperations
+from .cluster import Cluster
+from .downloads import (
+    DEFAULT_ALLOWED_TYPES,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_SIZE_MB,
+    FileDownloader,
+)
+from .faq import DEFAULT_THRESHOLD, FaqError, FaqIndex
+from .files import FileStore
+from .flood import DEFAULT_COOLDOWN as DEFAULT_FLOOD_COOLDOWN
+from .flood import DEFAULT_WINDOW as DEFAULT_FLOOD_WINDOW
+from .flood import FLOOD_TEXT, FloodGuard
+from .flow import FlowError, load_flow
+from .health import DEFAULT_LAG_THRESHOLD, LoopLagMonitor
+from .limiter import DEFAULT_MAX_LIMIT
+from .memory import MemoryProfiler
+from .metrics import Metrics
+from .offload import DEFAULT_TIMEOUT as DEFAULT_OFFLOAD_TIMEOUT
+from .offload import ProcessOffload
+from .pipeline import STAGE_NAMES
+from .priority import DEFAULT_CONCURRENCY as DEFAULT_UPDATE_CONCURRENCY
+from .priority import (
+    DEFAULT_HIGH_WATER,
+    DEFAULT_MAX_PENDING,
+    DEFAULT_MAX_WAIT,
+    DEFAULT_ORDER,
+)
+from .recorder import DEFAULT_MAX_FILES, TrafficRecorder
+from .recorder import DEFAULT_MAX_SIZE_MB as DEFAULT_RECORD_SIZE_MB
 from .router import ApiVersionRouter
+from .state import open_state_backend, parse_state_spec
+from .transcript import DEFAULT_SEGMENT_SIZE_MB, TranscriptLog
+from .tuning import (
+    DEFAULT_PRESET,
+    PRESETS,
+    request_metrics_middleware,
+    resolve_tuning,
+    run_app_kwargs,
+)
+from .utils import import_hook
+from .warmup import DEFAULT_KEEPALIVE_INTERVAL
 
 _PORT_MIN = 1
 _PORT_MAX = 65535
@@ -52,6 +97,90 @@ def positive_int(value):
     raise argparse.ArgumentTypeError(f"expected positive integer, not {value!r}")
 
 
+def non_negative_int(value):
+    int_value = validate_int(value)
+    if int_value >= 0:
+        return int_value
+    raise argparse.ArgumentTypeError(f"expected non-negative integer, not {value!r}")
+
+
+def score_threshold(value):
+    try:
+        float_value = float(value)
+        if 0 < float_value <= 1:
+            return float_value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected number in (0, 1], not {value!r}")
+
+
+def media_types(value):
+    types = [t.strip().lower() for t in value.split(",") if t.strip()]
+    if types and all("/" in t for t in types):
+        return types
+    raise argparse.ArgumentTypeError(
+        f"expected comma separated media types, e.g. image/*,application/pdf,"
+        f" not {value!r}"
+    )
+
+
+def hook_function(value):
+    try:
+        return import_hook(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def state_spec(value):
+    try:
+        parse_state_spec(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def hook_spec(value):
+    # Функция импортируется заранее, чтобы проверить опцию и чтобы её модуль уже
+    # был загружен в процессах пула, а дальше передаётся по имени
+    hook_function(value)
+    return value
+
+
+def http_url(value):
+    if validators.url(value, simple_host=True) and value.startswith(
+        ("http://", "https://")
+    ):
+        return value
+    raise argparse.ArgumentTypeError(
+        f"expected URL, e.g. https://bot.example.com/files/, not {value!r}"
+    )
+
+
+def http_urls(value):
+    urls = [url.strip() for url in value.split(",") if url.strip()]
+    return [http_url(url) for url in urls]
+
+
+def priority_order(value):
+    order = [name.strip() for name in value.split(",")]
+    if sorted(order) == sorted(DEFAULT_ORDER):
+        return order
+    raise argparse.ArgumentTypeError(
+        f"expected comma separated {', '.join(DEFAULT_ORDER)} in any order,"
+        f" not {value!r}"
+    )
+
+
+def positive_float(value):
+    try:
+        float_value = float(value)
+        if float_value > 0:
+            return float_value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected positive number, not {value!r}")
+
+
 def tcp_port(value):
     int_value = validate_int(value)
     if _PORT_MIN <= int_value <= _PORT_MAX:
@@ -80,6 +209,60 @@ def server_address(value):
     raise argparse.ArgumentTypeError(f"expected ip address or hostname, not {value!r}")
 
 
+def config_arguments(path, parser=None):
+    """
+    Прочитать JSON-файл настроек и превратить его в опции командной строки. Ключи
+    файла — имена опций без "--", значение true включает флаг, а списки
+    записываются через запятую. Опции парсера parser, которые можно повторять,
+    повторяются для каждого элемента списка
+    """
+
+    with open(path, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+    if not isinstance(config, dict):
+        raise ValueError("config must be an object with option names as keys")
+
+    arguments = []
+    for name, value in config.items():
+        option = "--" + name.replace("_", "-")
+        if value is True:
+            arguments.append(option)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list) and _is_append_option(parser, option):
+            arguments.extend(f"{option}={item}" for item in value)
+        elif isinstance(value, list):
+            arguments.append(f"{option}={','.join(str(item) for item in value)}")
+        else:
+            arguments.append(f"{option}={value}")
+    return arguments
+
+
+def _is_append_option(parser, option):
+    if parser is None:
+        return False
+    action = parser._option_string_actions.get(option)
+    return isinstance(action, argparse._AppendAction)
+
+
+def parse_args(parser, argv=None):
+    """
+    Разобрать опции командной строки. Опции из файла --config разбираются первыми,
+    поэтому опции командной строки их переопределяют
+    """
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config")
+    known, _ = config_parser.parse_known_args(argv)
+    if known.config:
+        try:
+            argv = config_arguments(known.config, parser) + argv
+        except (OSError, ValueError) as e:
+            parser.error(f"could not read config {known.config!r}: {e}")
+    return parser.parse_args(argv)
+
+
 def get_argument_parser():
     parser = argparse.ArgumentParser(
         prog="extbot",
@@ -114,11 +297,331 @@ def get_argument_parser():
     parser.add_argument(
         "--dep-key", help="(API v2) add button to forward chat to this department"
     )
+    parser.add_argument(
+        "--flow",
+        dest="flow_path",
+        help="JSON file describing bot dialog, replaces the default buttons and texts",
+    )
+    parser.add_argument(
+        "--files-dir",
+        help="serve files from this directory, flow can send them by name",
+    )
+    parser.add_argument(
+        "--files-base-url",
+        type=http_url,
+        help="public URL at which --files-dir is served, ends with /files/",
+    )
+    parser.add_argument(
+        "--faq",
+        dest="faq_path",
+        help="JSON file with FAQ entries to answer visitor questions from",
+    )
+    parser.add_argument(
+        "--faq-threshold",
+        default=DEFAULT_THRESHOLD,
+        type=score_threshold,
+        help="minimal similarity of visitor message and FAQ question to answer it",
+    )
+    parser.add_argument(
+        "--warm-connections",
+        type=positive_int,
+        help="(API v2) keep this many connections to Webim open and warm",
+    )
+    parser.add_argument(
+        "--keepalive-interval",
+        default=DEFAULT_KEEPALIVE_INTERVAL,
+        type=positive_int,
+        help="(API v2) seconds between requests keeping warm connections alive",
+    )
+    parser.add_argument(
+        "--max-concurrent-requests",
+        default=DEFAULT_MAX_LIMIT,
+        type=positive_int,
+        help="(API v2) upper bound of adaptive limit of concurrent requests to Webim",
+    )
+    parser.add_argument(
+        "--max-concurrent-updates",
+        default=DEFAULT_UPDATE_CONCURRENCY,
+        type=positive_int,
+        help="(API v2) updates handled at once, others wait in priority queue",
+    )
+    parser.add_argument(
+        "--priority-order",
+        default=",".join(DEFAULT_ORDER),
+        type=priority_order,
+        help="(API v2) order of priority classes of queued updates",
+    )
+    parser.add_argument(
+        "--priority-max-wait",
+        default=DEFAULT_MAX_WAIT,
+        type=positive_float,
+        help="(API v2) seconds after which queued update is handled out of order",
+    )
+    parser.add_argument(
+        "--max-queued-updates",
+        default=DEFAULT_MAX_PENDING,
+        type=positive_int,
+        help="(API v2) answer 503 to new updates while this many wait in queue",
+    )
+    parser.add_argument(
+        "--reply-deadline",
+        type=positive_float,
+        help="(API v2) skip texts and keyboards of updates older than this many"
+        " seconds, flow actions can set their own expires",
+    )
+    parser.add_argument(
+        "--outbox-linger",
+        type=positive_float,
+        help="(API v2) hold bot messages for this many seconds to drop keyboards"
+        " and repeated texts superseded by later ones",
+    )
+    parser.add_argument(
+        "--ready-queue-high-water",
+        default=DEFAULT_HIGH_WATER,
+        type=positive_int,
+        help="(API v2) report not ready while this many updates wait in queue",
+    )
+    parser.add_argument(
+        "--loop-lag-threshold",
+        default=DEFAULT_LAG_THRESHOLD,
+        type=positive_float,
+        help="report unhealthy at /healthz when event loop lags this many seconds",
+    )
+    parser.add_argument(
+        "--job-timeout",
+        type=positive_float,
+        help="(API v2) log updates handled for longer than this many seconds",
+    )
+    parser.add_argument(
+        "--cancel-stuck-jobs",
+        action="store_true",
+        help="(API v2) also cancel updates handled for longer than --job-timeout",
+    )
+    parser.add_argument(
+        "--inactivity-reminder",
+        type=positive_float,
+        help="(API v2) remind visitor after this many seconds of silence",
+    )
+    parser.add_argument(
+        "--inactivity-close",
+        type=positive_float,
+        help="(API v2) close chat after this many seconds of visitor silence",
+    )
+    parser.add_argument(
+        "--inactivity-reminder-text",
+        default=INACTIVITY_REMINDER_TEXT,
+        help="(API v2) text of reminder sent to silent visitor",
+    )
+    parser.add_argument(
+        "--download-dir",
+        help="(API v2) download files sent by visitors to this directory",
+    )
+    parser.add_argument(
+        "--download-max-size",
+        default=DEFAULT_MAX_SIZE_MB,
+        type=positive_int,
+        help="(API v2) skip visitor files larger than this many megabytes",
+    )
+    parser.add_argument(
+        "--download-types",
+        default=",".join(DEFAULT_ALLOWED_TYPES),
+        type=media_types,
+        help="(API v2) comma separated media types of visitor files to download",
+    )
+    parser.add_argument(
+        "--download-concurrency",
+        default=DEFAULT_CONCURRENCY,
+        type=positive_int,
+        help="(API v2) download at most this many visitor files at once",
+    )
+    parser.add_argument(
+        "--download-hook",
+        type=hook_function,
+        help="(API v2) module:function to call with each downloaded visitor file",
+    )
+    parser.add_argument(
+        "--update-middleware",
+        dest="middlewares",
+        action="append",
+        default=[],
+        type=hook_function,
+        help="module:function to add as update processing stage, can be repeated",
+    )
+    parser.add_argument(
+        "--offload-hook",
+        type=hook_spec,
+        help="module:function answering visitor messages in a process pool",
+    )
+    parser.add_argument(
+        "--offload-init",
+        type=hook_spec,
+        help="module:function called once in each pool process to preload data",
+    )
+    parser.add_argument(
+        "--offload-workers",
+        type=positive_int,
+        help="number of pool processes, by default number of CPUs",
+    )
+    parser.add_argument(
+        "--offload-timeout",
+        default=DEFAULT_OFFLOAD_TIMEOUT,
+        type=positive_float,
+        help="interrupt --offload-hook call after this many seconds",
+    )
+    parser.add_argument(
+        "--flood-limit",
+        type=positive_int,
+        help="ignore chats sending more than this many messages in --flood-window",
+    )
+    parser.add_argument(
+        "--flood-window",
+        default=DEFAULT_FLOOD_WINDOW,
+        type=positive_float,
+        help="length in seconds of sliding window for --flood-limit",
+    )
+    parser.add_argument(
+        "--flood-cooldown",
+        default=DEFAULT_FLOOD_COOLDOWN,
+        type=positive_float,
+        help="ignore messages of flooding chat for this many seconds",
+    )
+    parser.add_argument(
+        "--flood-text",
+        default=FLOOD_TEXT,
+        help="text sent once to visitor exceeding --flood-limit",
+    )
+    parser.add_argument(
+        "--transcript-dir",
+        help="(API v2) record all updates and bot requests to this directory",
+    )
+    parser.add_argument(
+        "--transcript-segment-size",
+        default=DEFAULT_SEGMENT_SIZE_MB,
+        type=positive_int,
+        help="(API v2) start new transcript file after this many megabytes",
+    )
+    parser.add_argument(
+        "--transcript-retention-days",
+        type=positive_float,
+        help="(API v2) remove transcript files older than this many days",
+    )
+    parser.add_argument(
+        "--analytics-dir",
+        help="save hourly usage statistics to this directory",
+    )
+    parser.add_argument(
+        "--analytics-retention-hours",
+        default=DEFAULT_RETENTION_HOURS,
+        type=positive_int,
+        help="keep usage statistics for this many last hours",
+    )
+    parser.add_argument(
+        "--record-dir",
+        help="record all webhook requests to this directory for extbot-replay",
+    )
+    parser.add_argument(
+        "--record-max-size",
+        default=DEFAULT_RECORD_SIZE_MB,
+        type=positive_int,
+        help="start new record file after this many megabytes",
+    )
+    parser.add_argument(
+        "--record-max-files",
+        default=DEFAULT_MAX_FILES,
+        type=positive_int,
+        help="keep this many last record files",
+    )
+    parser.add_argument(
+        "--record-scrub",
+        action="store_true",
+        help="replace message texts and visitor data in records with ***",
+    )
     parser.add_argument("--custom-button", help="add extra button with this text")
     parser.add_argument(
         "--custom-button-response",
         help="respond with this text when the custom button is clicked",
     )
+    parser.add_argument(
+        "--cluster-url",
+        type=http_url,
+        help="enable cluster mode, other nodes reach this node at this URL",
+    )
+    parser.add_argument(
+        "--cluster-peers",
+        default=[],
+        type=http_urls,
+        help="comma separated URLs of other cluster nodes",
+    )
+    parser.add_argument(
+        "--cluster-peers-file",
+        help="file with URLs of other cluster nodes, one per line, reread on change",
+    )
+    parser.add_argument(
+        "--state",
+        type=state_spec,
+        help="state shared by bot processes: memory or sqlite:<path>",
+    )
+    parser.add_argument(
+        "--admin-token",
+        help="enable admin API at /admin/ protected with this token",
+    )
+    parser.add_argument(
+        "--bulk-dir",
+        help="(API v2) keep admin bulk operations in this directory to resume them",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="trace memory allocations for admin API memory snapshots",
+    )
+    parser.add_argument(
+        "--config",
+        help='JSON file with options, e.g. {"preset": "throughput"},'
+        " command line options override it",
+    )
+    parser.add_argument(
+        "--preset",
+        default=DEFAULT_PRESET,
+        choices=sorted(PRESETS),
+        help="server tuning preset for options below that are not set",
+    )
+    parser.add_argument(
+        "--access-log",
+        action="store_const",
+        const=True,
+        help="log every webhook request",
+    )
+    parser.add_argument(
+        "--request-metrics-sample",
+        type=non_negative_int,
+        help="measure every Nth request in metrics, 0 disables",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=positive_int,
+        help="queue at most this many incoming connections",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=positive_float,
+        help="close idle keep-alive connections after this many seconds",
+    )
+    parser.add_argument(
+        "--client-max-size",
+        type=positive_int,
+        help="reject requests with body larger than this many kilobytes",
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=positive_float,
+        help="seconds to wait for running handlers on shutdown",
+    )
+    parser.add_argument(
+        "--handler-cancellation",
+        action="store_const",
+        const=True,
+        help="cancel request handler when client disconnects",
+    )
     parser.add_argument(
         "--debug",  # deprecated
         action="store_true",
@@ -133,11 +636,37 @@ def get_argument_parser():
 
 def main():
     parser = get_argument_parser()
-    args = parser.parse_args()
-
-    app = web.Application()
+    args = parse_args(parser)
+    if args.files_dir and not args.files_base_url:
+        parser.error("--files-base-url is required with --files-dir")
+    if (args.cluster_peers or args.cluster_peers_file) and not args.cluster_url:
+        parser.error("--cluster-url is required with cluster peers")
+    stage_names = [stage.__name__ for stage in args.middlewares] + list(STAGE_NAMES)
+    if len(set(stage_names)) != len(stage_names):
+        parser.error("--update-middleware function names must be unique")
+    if args.offload_init and not args.offload_hook:
+        parser.error("--offload-hook is required with --offload-init")
+    if args.cancel_stuck_jobs and not args.job_timeout:
+        parser.error("--job-timeout is required with --cancel-stuck-jobs")
+    if (
+        args.inactivity_reminder
+        and args.inactivity_close
+        and args.inactivity_close <= args.inactivity_reminder
+    ):
+        parser.error("--inactivity-close must be greater than --inactivity-reminder")
 
     logger = get_logger(args.verbose or args.debug)
+    metrics = Metrics()
+
+    tuning = resolve_tuning(args)
+    middlewares = []
+    if tuning["request_metrics_sample"]:
+        middlewares.append(
+            request_metrics_middleware(metrics, tuning["request_metrics_sample"])
+        )
+    app = web.Application(
+        client_max_size=tuning["client_max_size"] * 1024, middlewares=middlewares
+    )
 
     if args.debug:
         logger.warning(
@@ -145,9 +674,118 @@ def main():
             " Please use --verbose instead"
         )
 
-    v1_bot = ApiV1Sample(logger, args.custom_button, args.custom_button_response)
+    if args.files_dir:
+        files = FileStore(logger, args.files_dir, args.files_base_url)
+        try:
+            files.scan()
+        except OSError as e:
+            logger.critical(f"Error reading files directory: {e}")
+            sys.exit(1)
+        app.add_routes(files.get_routes())
+    else:
+        files = None
+
+    if args.flow_path:
+        try:
+            flow = load_flow(args.flow_path, files)
+        except FlowError as e:
+            logger.critical(f"Invalid dialog flow: {e}")
+            sys.exit(1)
+    else:
+        flow = None
+
+    if args.faq_path:
+        try:
+            faq = FaqIndex.load(args.faq_path, args.faq_threshold)
+        except FaqError as e:
+            logger.critical(f"Invalid FAQ: {e}")
+            sys.exit(1)
+        logger.info(f"Loaded {len(faq)} FAQ question(s) from {args.faq_path}")
+    else:
+        faq = None
+
+    analytics = Analytics(
+        logger, args.analytics_dir, retention_hours=args.analytics_retention_hours
+    )
+    app.on_startup.append(analytics.startup)
+    app.on_cleanup.append(analytics.cleanup)
+
+    if args.offload_hook:
+        offload = ProcessOffload(
+            logger,
+            metrics,
+            args.offload_hook,
+            args.offload_init,
+            workers=args.offload_workers,
+            timeout=args.offload_timeout,
+        )
+        app.on_startup.append(offload.startup)
+    else:
+        offload = None
+
+    if args.state:
+        try:
+            state = open_state_backend(args.state)
+        except sqlite3.Error as e:
+            logger.critical(f"Error opening state {args.state!r}: {e}")
+            sys.exit(1)
+        app.on_startup.append(state.startup)
+    else:
+        state = None
+
+    if args.flood_limit:
+        flood = FloodGuard(
+            logger,
+            metrics,
+            args.flood_limit,
+            window=args.flood_window,
+            cooldown=args.flood_cooldown,
+            text=args.flood_text,
+            state=state,
+        )
+    else:
+        flood = None
+
+    middlewares = [(stage.__name__, stage) for stage in args.middlewares]
+
+    v1_bot = ApiV1Sample(
+        logger,
+        args.custom_button,
+        args.custom_button_response,
+        flow=flow,
+        faq=faq,
+        analytics=analytics,
+        offload=offload,
+        flood=flood,
+        metrics=metrics,
+        middlewares=middlewares,
+    )
 
     if args.api_domain and args.api_token:
+        if args.download_dir:
+            downloader = FileDownloader(
+                logger,
+                metrics,
+                args.download_dir,
+                max_size=args.download_max_size * 1024 * 1024,
+                allowed_types=args.download_types,
+                concurrency=args.download_concurrency,
+                hook=args.download_hook,
+            )
+        else:
+            downloader = None
+
+        if args.transcript_dir:
+            transcript = TranscriptLog(
+                logger,
+                metrics,
+                args.transcript_dir,
+                segment_size=args.transcript_segment_size * 1024 * 1024,
+                retention_days=args.transcript_retention_days,
+            )
+        else:
+            transcript = None
+
         v2_bot = ApiV2Sample(
             logger,
             args.api_domain,
@@ -156,7 +794,33 @@ def main():
             args.dep_key,
             args.custom_button,
             args.custom_button_response,
+            flow=flow,
+            faq=faq,
+            downloader=downloader,
+            files=files,
+            transcript=transcript,
+            analytics=analytics,
+            metrics=metrics,
+            warm_connections=args.warm_connections,
+            keepalive_interval=args.keepalive_interval,
+            inactivity_reminder=args.inactivity_reminder,
+            inactivity_close=args.inactivity_close,
+            inactivity_reminder_text=args.inactivity_reminder_text,
+            max_concurrent_requests=args.max_concurrent_requests,
+            max_concurrent_updates=args.max_concurrent_updates,
+            priority_order=args.priority_order,
+            priority_max_wait=args.priority_max_wait,
+            job_timeout=args.job_timeout,
+            cancel_stuck_jobs=args.cancel_stuck_jobs,
+            queue_high_water=args.ready_queue_high_water,
+            max_queued_updates=args.max_queued_updates,
+            reply_deadline=args.reply_deadline,
+            outbox_linger=args.outbox_linger,
+            offload=offload,
+            flood=flood,
+            middlewares=middlewares,
         )
+        app.on_startup.append(v2_bot.startup)
         app.on_cleanup.append(v2_bot.cleanup)
     else:
         v2_bot = None
@@ -166,16 +830,79 @@ def main():
             " see extbot --help for the required arguments"
         )
 
-    router = ApiVersionRouter(logger, v1_bot, v2_bot)
+    if offload is not None:
+        # Пул останавливается после ботов, которые могут ещё ждать его ответов
+        app.on_cleanup.append(offload.cleanup)
+
+    if state is not None:
+        # Хранилище закрывается после компонентов, которые с ним работают
+        app.on_cleanup.append(state.cleanup)
+
+    if args.cluster_url:
+        cluster = Cluster(
+            logger,
+            metrics,
+            args.cluster_url,
+            args.cluster_peers,
+            args.cluster_peers_file,
+        )
+        app.on_startup.append(cluster.startup)
+        app.on_cleanup.append(cluster.cleanup)
+    else:
+        cluster = None
+
+    loop_monitor = LoopLagMonitor(metrics, args.loop_lag_threshold)
+    app.on_startup.append(loop_monitor.startup)
+    app.on_cleanup.append(loop_monitor.cleanup)
+
+    if args.record_dir:
+        recorder = TrafficRecorder(
+            logger,
+            metrics,
+            args.record_dir,
+            max_size=args.record_max_size * 1024 * 1024,
+            max_files=args.record_max_files,
+            scrub_pii=args.record_scrub,
+        )
+        app.on_startup.append(recorder.startup)
+        app.on_cleanup.append(recorder.cleanup)
+    else:
+        recorder = None
+
+    router = ApiVersionRouter(logger, v1_bot, v2_bot, cluster, loop_monitor, recorder)
 
     routes = router.get_routes()
     app.add_routes(routes)
 
+    memory_profiler = MemoryProfiler(logger, metrics, args.tracemalloc)
+    memory_profiler.start()
+
+    if args.admin_token:
+        admin = AdminApi(logger, args.admin_token, metrics)
+        memory_profiler.register_admin_routes(admin)
+        analytics.register_admin_routes(admin)
+        if v2_bot is not None:
+            v2_bot.register_admin_routes(admin)
+            bulk = BulkOperations(
+                logger, metrics, v2_bot, args.bulk_dir, states=v2_bot.flow.states
+            )
+            # Операции останавливаются до закрытия сессии бота в on_cleanup
+            app.on_startup.append(bulk.startup)
+            app.on_shutdown.append(bulk.cleanup)
+            bulk.register_admin_routes(admin)
+        app.add_routes(admin.get_routes())
+
     index_url = f"http://{args.host}:{args.port}/"
     logger.info(f"Exbot is running on {index_url}")
 
     try:
-        web.run_app(app, host=args.host, port=args.port, print=None)
+        web.run_app(
+            app,
+            host=args.host,
+            port=args.port,
+            print=None,
+            **run_app_kwargs(tuning, logger),
+        )
     except Exception as e:
         logger.critical(f"Error running server on {index_url}: {e}")
         sys.exit(1)
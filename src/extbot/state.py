@@ -0,0 +1,319 @@
+"""
+Хранилища общего состояния бота: кешей, счётчиков ограничений и состояния чатов
+
+Все хранилища реализуют интерфейс StateBackend. MemoryStateBackend хранит данные в
+памяти процесса и подходит, когда бот запущен одним процессом. SqliteStateBackend
+хранит данные в файле SQLite и подходит для нескольких процессов бота на одной машине:
+атомарность операций обеспечивают транзакции SQLite. Значения — любые данные, которые
+можно сохранить в JSON. Срок жизни ключей отсчитывается по системным часам, чтобы он
+был одинаковым для всех процессов.
+
+Бот открывает хранилище по опции --state и передаёт его компонентам, которым нужно
+общее для процессов состояние, например защите от потока сообщений (extbot.flood).
+"""
+
+
+import abc
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+SQLITE_PREFIX = "sqlite:"
+SQLITE_BUSY_TIMEOUT = 5.0
+DEFAULT_PURGE_INTERVAL = 60.0
+
+
+class StateBackend(abc.ABC):
+    """
+    Интерфейс хранилища состояния. Методы асинхронные, чтобы хранилище могло
+    обращаться к сети или к диску, не останавливая event loop. Пока хранилище
+    запущено (startup), ключи с истёкшим сроком жизни раз в purge_interval секунд
+    удаляются
+    """
+
+    purge_interval = DEFAULT_PURGE_INTERVAL
+    _purge_task = None
+
+    async def startup(self, *_):
+        if self._purge_task is None:
+            self._purge_task = asyncio.ensure_future(self._purge_periodically())
+
+    async def cleanup(self, *_):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+        await self.close()
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            await self.purge_expired()
+
+    async def get(self, key):
+        """
+        Значение ключа или None, если ключа нет или его срок жизни истёк
+        """
+
+        return (await self.get_many([key]))[key]
+
+    @abc.abstractmethod
+    async def get_many(self, keys):
+        """
+        Значения нескольких ключей одним обращением: словарь из ключа в значение или
+        None
+        """
+
+    @abc.abstractmethod
+    async def set(self, key, value, ttl=None):
+        """
+        Записать значение. Если задан ttl, ключ удаляется через ttl секунд
+        """
+
+    @abc.abstractmethod
+    async def delete(self, key):
+        """
+        Удалить ключ
+        """
+
+    @abc.abstractmethod
+    async def incr(self, key, amount=1, ttl=None):
+        """
+        Атомарно увеличить целое значение ключа и вернуть новое значение.
+        Отсутствующий ключ считается равным 0. Срок жизни ttl задаётся только при
+        создании ключа, поэтому счётчик с ttl удобно использовать как окно ограничения
+        """
+
+    @abc.abstractmethod
+    async def compare_and_set(self, key, expected, value, ttl=None):
+        """
+        Атомарно записать значение, только если текущее значение равно expected.
+        expected=None означает, что ключа не должно быть. Возвращает True, если
+        значение записано
+        """
+
+    async def purge_expired(self):
+        """
+        Удалить ключи с истёкшим сроком жизни. Такие ключи и так не видны, метод
+        только освобождает место
+        """
+
+    async def close(self):
+        pass
+
+
+def _expires_at(ttl):
+    return time.time() + ttl if ttl is not None else None
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Хранилище в памяти процесса
+    """
+
+    def __init__(self):
+        self._data = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return item
+
+    async def get_many(self, keys):
+        now = time.time()
+        result = {}
+        for key in keys:
+            item = self._get(key, now)
+            result[key] = item[0] if item is not None else None
+        return result
+
+    async def set(self, key, value, ttl=None):
+        self._data[key] = (value, _expires_at(ttl))
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def incr(self, key, amount=1, ttl=None):
+        item = self._get(key, time.time())
+        if item is None:
+            value, expires_at = amount, _expires_at(ttl)
+        else:
+            value, expires_at = item[0] + amount, item[1]
+        self._data[key] = (value, expires_at)
+        return value
+
+    async def compare_and_set(self, key, expected, value, ttl=None):
+        item = self._get(key, time.time())
+        current = item[0] if item is not None else None
+        if current != expected:
+            return False
+        self._data[key] = (value, _expires_at(ttl))
+        return True
+
+    async def purge_expired(self):
+        now = time.time()
+        expired = [
+            key
+            for key, (_, expires_at) in self._data.items()
+            if expires_at is not None and expires_at <= now
+        ]
+        for key in expired:
+            del self._data[key]
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    Хранилище в файле SQLite, общее для всех процессов, которые открыли этот файл.
+    Запросы выполняются в отдельном потоке по одному: когда несколько процессов
+    одновременно ждут блокировку записи, ожидание (до SQLITE_BUSY_TIMEOUT секунд) не
+    останавливает event loop. База работает в режиме WAL, чтобы чтение не ждало
+    записи
+    """
+
+    def __init__(self, path):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="extbot-state")
+        # Соединение создаётся здесь, а используется только в потоке executor
+        self._connection = sqlite3.connect(
+            path,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS state"
+            " (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def get_many(self, keys):
+        return await self._run(self._get_many, list(keys))
+
+    async def set(self, key, value, ttl=None):
+        await self._run(self._set, key, json.dumps(value), _expires_at(ttl))
+
+    async def delete(self, key):
+        await self._run(self._execute, "DELETE FROM state WHERE key = ?", (key,))
+
+    async def incr(self, key, amount=1, ttl=None):
+        return await self._run(self._incr, key, amount, ttl)
+
+    async def compare_and_set(self, key, expected, value, ttl=None):
+        return await self._run(
+            self._compare_and_set, key, expected, json.dumps(value), ttl
+        )
+
+    async def purge_expired(self):
+        await self._run(
+            self._execute,
+            "DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+
+    async def close(self):
+        await self._run(self._connection.close)
+        self._executor.shutdown()
+
+    def _execute(self, sql, parameters):
+        self._connection.execute(sql, parameters)
+
+    def _get_many(self, keys):
+        result = dict.fromkeys(keys)
+        if not keys:
+            return result
+
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connection.execute(
+            f"SELECT key, value FROM state WHERE key IN ({placeholders})"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (*keys, time.time()),
+        )
+        for key, value in rows:
+            result[key] = json.loads(value)
+        return result
+
+    def _set(self, key, value, expires_at):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at),
+        )
+
+    def _current(self, key):
+        row = self._connection.execute(
+            "SELECT value, expires_at FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def _incr(self, key, amount, ttl):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому между чтением и
+        # записью значение не может изменить другой процесс
+        with self._transaction():
+            current, expires_at = self._current(key)
+            if current is None:
+                value, expires_at = amount, _expires_at(ttl)
+            else:
+                value = current + amount
+            self._set(key, json.dumps(value), expires_at)
+        return value
+
+    def _compare_and_set(self, key, expected, value, ttl):
+        with self._transaction():
+            current, _ = self._current(key)
+            if current != expected:
+                return False
+            self._set(key, value, _expires_at(ttl))
+        return True
+
+    @contextmanager
+    def _transaction(self):
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+
+def parse_state_spec(spec):
+    """
+    Разобрать строку настройки хранилища: "memory" или "sqlite:<путь к файлу>".
+    Возвращает пару (вид хранилища, путь или None)
+    """
+
+    if spec == "memory":
+        return "memory", None
+    if spec.startswith(SQLITE_PREFIX) and len(spec) > len(SQLITE_PREFIX):
+        return "sqlite", spec[len(SQLITE_PREFIX) :]
+    raise ValueError(f"expected memory or sqlite:<path>, not {spec!r}")
+
+
+def open_state_backend(spec):
+    """
+    Открыть хранилище по строке настройки: "memory" или "sqlite:<путь к файлу>"
+    """
+
+    kind, path = parse_state_spec(spec)
+    if kind == "memory":
+        return MemoryStateBackend()
+    return SqliteStateBackend(path)
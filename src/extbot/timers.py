@@ -0,0 +1,185 @@
+"""
+Иерархическое колесо таймеров для большого числа долгих таймеров
+
+Таймер на каждый чат через asyncio.sleep или loop.call_later стоит отдельной задачи или
+записи в куче event loop. Колесо хранит таймеры в ячейках по времени срабатывания и
+каждый такт просматривает только одну ячейку, поэтому запуск, перезапуск и отмена
+таймера выполняются за O(1) независимо от числа таймеров. Таймеры с далёким сроком
+лежат на верхних уровнях колеса с крупными ячейками и по мере приближения срока
+переносятся на нижние уровни.
+"""
+
+
+import asyncio
+import inspect
+import math
+import time
+
+DEFAULT_TICK = 1.0
+SLOT_BITS = 6
+LEVELS = 4
+
+_SLOTS = 1 << SLOT_BITS
+_SLOT_MASK = _SLOTS - 1
+
+
+class Timer:
+    """
+    Таймер в колесе. Таймеры различаются ключом, например id чата
+    """
+
+    __slots__ = ("key", "deadline", "deadline_tick", "callback", "slot")
+
+    def __init__(self, key, deadline, deadline_tick, callback):
+        self.key = key
+        self.deadline = deadline
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.slot = None
+
+
+class TimingWheel:
+    """
+    Колесо из LEVELS уровней по 2 ** SLOT_BITS ячеек. Ячейка нижнего уровня — один
+    такт длиной tick секунд, поэтому таймер срабатывает с опозданием не больше такта.
+    На каждый ключ приходится не больше одного таймера: повторный запуск таймера с
+    тем же ключом перезапускает его. Функция обратного вызова получает ключ таймера и
+    может быть как обычной, так и асинхронной
+    """
+
+    def __init__(self, logger, metrics, tick=DEFAULT_TICK, clock=time.monotonic):
+        self._log = logger
+        self._metrics = metrics
+        self._tick = tick
+        self._clock = clock
+
+        self._epoch = clock()
+        self._current_tick = 0
+        self._levels = [[{} for _ in range(_SLOTS)] for _ in range(LEVELS)]
+        self._timers = {}
+        self._task = None
+
+        metrics.gauge("timers.active", self.__len__)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, key, delay, callback):
+        """
+        Запустить таймер, который сработает через delay секунд. Если таймер с таким
+        ключом уже запущен, он перезапускается
+        """
+
+        self.cancel(key)
+        deadline = self._clock() + delay
+        deadline_tick = math.ceil((deadline - self._epoch) / self._tick)
+        timer = Timer(key, deadline, deadline_tick, callback)
+        self._timers[key] = timer
+        self._place(timer)
+
+    def cancel(self, key):
+        """
+        Отменить таймер. Возвращает False, если таймера с таким ключом нет
+        """
+
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del timer.slot[key]
+        return True
+
+    def _place(self, timer):
+        current = self._current_tick
+        delta = max(timer.deadline_tick - current, 1)
+        target = current + delta
+
+        for level in range(LEVELS):
+            if delta < 1 << (SLOT_BITS * (level + 1)):
+                break
+        else:
+            # Срок дальше, чем охватывает колесо: таймер ждёт в самой дальней ячейке
+            # верхнего уровня и будет размещён заново, когда до неё дойдёт очередь
+            target = current + (1 << (SLOT_BITS * LEVELS)) - 1
+
+        slot = self._levels[level][(target >> (SLOT_BITS * level)) & _SLOT_MASK]
+        slot[timer.key] = timer
+        timer.slot = slot
+
+    def advance(self):
+        """
+        Продвинуть колесо до текущего момента. Возвращает сработавшие таймеры, функции
+        обратного вызова при этом не вызываются
+        """
+
+        now_tick = int((self._clock() - self._epoch) / self._tick)
+        if not self._timers:
+            self._current_tick = max(self._current_tick, now_tick)
+            return []
+        fired = []
+
+        while self._current_tick < now_tick:
+            self._current_tick += 1
+            tick = self._current_tick
+
+            # Когда нижний уровень проходит полный оборот, таймеры из очередной
+            # ячейки уровня выше переносятся вниз
+            for level in range(1, LEVELS):
+                if tick & ((1 << (SLOT_BITS * level)) - 1):
+                    break
+                index = (tick >> (SLOT_BITS * level)) & _SLOT_MASK
+                slot = self._levels[level][index]
+                self._levels[level][index] = {}
+                for timer in slot.values():
+                    if timer.deadline_tick <= tick:
+                        # Срок наступил ровно на границе ячейки верхнего уровня:
+                        # перенос вниз отложил бы таймер ещё на такт
+                        del self._timers[timer.key]
+                        fired.append(timer)
+                    else:
+                        self._place(timer)
+
+            index = tick & _SLOT_MASK
+            slot = self._levels[0][index]
+            if not slot:
+                continue
+            self._levels[0][index] = {}
+            for timer in slot.values():
+                if timer.deadline_tick > tick:
+                    self._place(timer)  # перенесён с верхнего уровня раньше срока
+                    continue
+                del self._timers[timer.key]
+                fired.append(timer)
+
+        return fired
+
+    async def _run(self):
+        while True:
+            next_tick = self._epoch + (self._current_tick + 1) * self._tick
+            await asyncio.sleep(max(next_tick - self._clock(), 0))
+
+            now = self._clock()
+            for timer in self.advance():
+                self._metrics.inc("timers.fired")
+                self._metrics.observe("timers.lag", now - timer.deadline)
+                try:
+                    result = timer.callback(timer.key)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    self._log.exception(f"Error in timer {timer.key!r}")
@@ -0,0 +1,265 @@
+"""
+Журнал переписки бота: все обновления от Webim и все запросы бота к Webim
+
+Журнал пишется только в конец файлов (сегментов) в формате JSON Lines. Рядом с каждым
+сегментом лежит индекс: для каждой записи — чат, смещение и длина. Поэтому, чтобы
+прочитать переписку одного чата, достаточно прочитать небольшие индексы и взять из
+отображённых в память сегментов только нужные записи. Просмотр журнала:
+    extbot-transcript <директория журнала> <id чата>
+"""
+
+
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_SEGMENT_SIZE_MB = 64
+DEFAULT_FLUSH_INTERVAL = 1.0
+RETENTION_CHECK_INTERVAL = 60 * 60
+FLUSH_BYTES = 1024 * 1024
+
+SEGMENT_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+
+INBOUND = "in"
+OUTBOUND = "out"
+
+
+def _segment_paths(directory):
+    return sorted(Path(directory).glob(f"*{SEGMENT_SUFFIX}"))
+
+
+class TranscriptLog:
+    """
+    Запись журнала. Записи копятся в памяти и сбрасываются на диск с fsync пачками:
+    раз в flush_interval секунд или при накоплении FLUSH_BYTES. Запись на диск
+    выполняется в пуле потоков. Когда сегмент достигает segment_size байт, начинается
+    новый. Сегменты старше retention_days дней удаляются при смене сегмента и раз в
+    retention_check_interval секунд, даже если бот почти ничего не пишет
+    """
+
+    def __init__(
+        self,
+        logger,
+        metrics,
+        directory,
+        segment_size=DEFAULT_SEGMENT_SIZE_MB * 1024 * 1024,
+        retention_days=None,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        retention_check_interval=RETENTION_CHECK_INTERVAL,
+    ):
+        self._log = logger
+        self._metrics = metrics
+        self._directory = Path(directory)
+        self._segment_size = segment_size
+        self._retention_days = retention_days
+        self._flush_interval = flush_interval
+        self._retention_check_interval = retention_check_interval
+
+        self._segment = None
+        self._segment_offset = 0
+        self._pending = {}
+        self._pending_bytes = 0
+        self._flush_lock = None
+        self._flush_task = None
+        self._task = None
+
+    def open(self):
+        """
+        Подготовить директорию журнала. Каждый запуск бота начинает новый сегмент,
+        поэтому уже записанные сегменты никогда не изменяются
+        """
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._flush_lock = asyncio.Lock()
+        segments = _segment_paths(self._directory)
+        last = int(segments[-1].stem) if segments else 0
+        self._segment = last + 1
+        self._segment_offset = 0
+        self._remove_expired()
+
+    def start(self):
+        if self._task is None:
+            self.open()
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_lock is not None:
+            await self.flush()
+
+    def append(self, chat_id, direction, data):
+        """
+        Добавить запись в журнал. Запись станет видна читателям после сброса на диск
+        """
+
+        record = dict(time=time.time(), chat_id=chat_id, direction=direction, data=data)
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+
+        if (
+            self._segment_offset
+            and self._segment_offset + len(line) > self._segment_size
+        ):
+            self._segment += 1
+            self._segment_offset = 0
+            self._metrics.inc("transcript.segments")
+
+        segment_data, segment_index = self._pending.setdefault(
+            self._segment, (bytearray(), bytearray())
+        )
+        segment_data += line
+        index_entry = [chat_id, self._segment_offset, len(line)]
+        segment_index += (json.dumps(index_entry) + "\n").encode()
+
+        self._segment_offset += len(line)
+        self._pending_bytes += len(line)
+        self._metrics.inc("transcript.records")
+
+        if self._pending_bytes >= FLUSH_BYTES and self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """
+        Записать накопленные записи на диск
+        """
+
+        async with self._flush_lock:
+            self._flush_task = None
+            pending, self._pending = self._pending, {}
+            self._pending_bytes = 0
+            if not pending:
+                return
+
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write, pending)
+            except OSError as e:
+                self._metrics.inc("transcript.write_errors")
+                self._log.error(f"Error writing transcript: {e}")
+
+    def _write(self, pending):
+        for segment, (data, index) in sorted(pending.items()):
+            path = self._directory / f"{segment:08d}"
+            # Сначала записываются данные, потом индекс, чтобы индекс не ссылался на
+            # отсутствующие данные
+            for suffix, content in ((SEGMENT_SUFFIX, data), (INDEX_SUFFIX, index)):
+                with open(path.with_suffix(suffix), "ab") as segment_file:
+                    segment_file.write(content)
+                    segment_file.flush()
+                    os.fsync(segment_file.fileno())
+
+        if len(pending) > 1:
+            self._remove_expired()
+
+    async def _flush_periodically(self):
+        loop = asyncio.get_running_loop()
+        next_check = loop.time() + self._retention_check_interval
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+            if self._retention_days is not None and loop.time() >= next_check:
+                next_check = loop.time() + self._retention_check_interval
+                async with self._flush_lock:
+                    await loop.run_in_executor(None, self._remove_expired)
+
+    def _remove_expired(self):
+        if self._retention_days is None:
+            return
+
+        expire_before = time.time() - self._retention_days * 24 * 60 * 60
+        for path in _segment_paths(self._directory):
+            if int(path.stem) >= self._segment:
+                continue
+            try:
+                if path.stat().st_mtime < expire_before:
+                    path.unlink()
+                    path.with_suffix(INDEX_SUFFIX).unlink(missing_ok=True)
+                    self._log.info(f"Removed expired transcript segment {path}")
+            except OSError as e:
+                self._log.error(f"Error removing transcript segment {path}: {e}")
+
+
+def _chat_key(chat_id):
+    # Запросы без чата записываются с chat_id None, он не должен совпасть с "None"
+    return chat_id if chat_id is None else str(chat_id)
+
+
+class TranscriptReader:
+    """
+    Чтение журнала по чатам. Индексы сегментов читаются один раз и кешируются.
+    Id чатов сравниваются как строки: из командной строки id всегда приходит
+    строкой, а в обновлениях Webim может быть числом
+    """
+
+    def __init__(self, directory):
+        self._directory = Path(directory)
+        self._indexes = {}
+
+    def _load_index(self, segment_path):
+        index_path = segment_path.with_suffix(INDEX_SUFFIX)
+        stat = index_path.stat()
+        cached = self._indexes.get(index_path)
+        if cached is not None and cached[0] == stat.st_size:
+            return cached[1]
+
+        index = {}
+        with open(index_path, encoding="utf-8") as index_file:
+            for line in index_file:
+                try:
+                    chat_id, offset, length = json.loads(line)
+                except ValueError:
+                    break  # запись оборвалась при аварийном завершении
+                index.setdefault(_chat_key(chat_id), []).append((offset, length))
+
+        self._indexes[index_path] = (stat.st_size, index)
+        return index
+
+    def read_chat(self, chat_id):
+        """
+        Записи журнала по чату в порядке их добавления
+        """
+
+        for segment_path in _segment_paths(self._directory):
+            try:
+                entries = self._load_index(segment_path).get(_chat_key(chat_id))
+            except FileNotFoundError:
+                continue
+            if not entries:
+                continue
+
+            with open(segment_path, "rb") as segment_file:
+                with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for offset, length in entries:
+                        if offset + length > len(mm):
+                            break
+                        yield json.loads(mm[offset : offset + length])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="extbot-transcript",
+        description="Print transcript of one chat from Extbot transcript directory",
+    )
+    parser.add_argument("directory", help="directory passed to extbot --transcript-dir")
+    parser.add_argument("chat_id", help="chat id")
+    args = parser.parse_args()
+
+    reader = TranscriptReader(args.directory)
+    for record in reader.read_chat(args.chat_id):
+        print(json.dumps(record, ensure_ascii=False))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
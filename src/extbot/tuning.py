@@ -0,0 +1,115 @@
+"""
+Настройки HTTP-сервера бота
+
+Параметры web.run_app и web.Application, которые влияют на пропускную способность:
+журнал запросов, очередь входящих соединений, время жизни keep-alive соединений,
+наибольший размер тела запроса, время на завершение обработчиков при остановке и
+отмена обработчиков при разрыве соединения клиентом. Значения, не заданные явно,
+берутся из набора настроек (preset):
+
+    default     значения aiohttp по умолчанию, журнал запросов выключен
+    throughput  для большого потока обновлений: журнал запросов выключен, вместо
+                него в метрики попадает каждый sample-й запрос, очередь
+                соединений длиннее, обработчики отменяются при разрыве соединения
+"""
+
+
+import time
+
+from aiohttp import web
+
+DEFAULT_PRESET = "default"
+PRESETS = {
+    "default": dict(
+        access_log=False,
+        request_metrics_sample=0,
+        backlog=128,
+        keepalive_timeout=75.0,
+        client_max_size=1024,
+        shutdown_timeout=60.0,
+        handler_cancellation=False,
+    ),
+    "throughput": dict(
+        access_log=False,
+        request_metrics_sample=16,
+        backlog=1024,
+        keepalive_timeout=75.0,
+        client_max_size=1024,
+        shutdown_timeout=10.0,
+        handler_cancellation=True,
+    ),
+}
+ACCESS_LOG_FORMAT = '%a "%r" %s %b %Tfs'
+
+
+def resolve_tuning(args):
+    """
+    Настройки сервера: значения опций командной строки, а если опция не задана —
+    значения из набора настроек args.preset
+    """
+
+    preset = PRESETS[args.preset]
+    return {
+        name: default if getattr(args, name) is None else getattr(args, name)
+        for name, default in preset.items()
+    }
+
+
+def run_app_kwargs(tuning, logger):
+    """
+    Аргументы web.run_app для настроек tuning. Журнал запросов пишется в дочерний
+    логгер бота logger
+    """
+
+    kwargs = dict(
+        backlog=tuning["backlog"],
+        keepalive_timeout=tuning["keepalive_timeout"],
+        shutdown_timeout=tuning["shutdown_timeout"],
+        handler_cancellation=tuning["handler_cancellation"],
+    )
+    if tuning["access_log"]:
+        kwargs.update(
+            access_log=logger.getChild("access"), access_log_format=ACCESS_LOG_FORMAT
+        )
+    else:
+        # Без журнала aiohttp не создаёт объект журнала и не проверяет уровень
+        # логгера на каждом запросе
+        kwargs.update(access_log=None)
+    return kwargs
+
+
+def request_metrics_middleware(metrics, sample):
+    """
+    Middleware, которое считает все запросы к серверу, а для каждого sample-го
+    запроса измеряет время обработки и учитывает код ответа. Число ответов с кодом
+    каждого класса в метриках — оценка: один измеренный запрос считается за sample
+    """
+
+    requests = 0
+
+    def get_requests():
+        return requests
+
+    metrics.gauge("http.requests", get_requests)
+
+    @web.middleware
+    async def middleware(request, handler):
+        nonlocal requests
+        requests += 1
+        if requests % sample:
+            return await handler(request)
+
+        started = time.monotonic()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            metrics.observe("http.latency", time.monotonic() - started)
+            metrics.inc(f"http.status.{status // 100}xx", sample)
+
+    return middleware
@@ -1,9 +1,27 @@
 """Общие утилиты проекта"""
 
 
+import importlib
 import json
 
 
+def import_hook(spec):
+    """
+    Импортировать функцию по строке вида "package.module:function", например
+    функцию обработки скачанных файлов или этап обработки обновлений
+    """
+
+    module_name, _, function_name = spec.partition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"expected module:function, not {spec!r}")
+
+    try:
+        module = importlib.import_module(module_name)
+        return getattr(module, function_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"could not import {spec!r}: {e}") from e
+
+
 def pretty_json(data):
     return json.dumps(data, indent=1, ensure_ascii=False)
 
@@ -13,3 +31,27 @@ def to_nested(sequence, items_per_group):
         end = start + items_per_group
         row = sequence[start:end]
         yield row
+
+
+def to_rows(items, per_row, row_width=None, width=len):
+    """
+    Разложить элементы по рядам по порядку: в ряду не больше per_row элементов и,
+    если задан row_width, их суммарная ширина не больше row_width. Элемент шире
+    row_width занимает отдельный ряд
+    """
+
+    row = []
+    row_used = 0
+    for item in items:
+        item_width = width(item)
+        if row and (
+            len(row) >= per_row
+            or (row_width is not None and row_used + item_width > row_width)
+        ):
+            yield row
+            row = []
+            row_used = 0
+        row.append(item)
+        row_used += item_width
+    if row:
+        yield row
@@ -0,0 +1,105 @@
+"""Прогрев и поддержание соединений с API Webim"""
+
+
+import asyncio
+import time
+
+from aiohttp import ClientError, ClientTimeout
+
+DEFAULT_KEEPALIVE_INTERVAL = 10
+PING_TIMEOUT = ClientTimeout(total=10)
+RETRY_DELAY = 1
+
+
+class ConnectionWarmer:
+    """
+    Заранее открывает заданное число соединений к API Webim и периодически
+    поддерживает их лёгкими запросами, чтобы первые ответы бота после запуска или
+    простоя не тратили время на DNS, TCP и TLS
+    """
+
+    def __init__(self, logger, metrics, url, connections, interval):
+        self._log = logger
+        self._metrics = metrics
+        self._url = url
+        self._connections = connections
+        self._interval = interval
+
+        self._session = None
+        self._task = None
+        self.ready = False
+        self.warmup_time = None
+
+    @property
+    def keepalive_timeout(self):
+        """
+        Время, которое соединение должно жить в пуле без запросов, чтобы дождаться
+        следующего поддерживающего запроса
+        """
+
+        return self._interval * 2
+
+    def start(self, session):
+        """
+        Начать прогрев соединений сессии. Повторный вызов ничего не делает
+        """
+
+        if self._task is not None:
+            return
+
+        self._session = session
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        started = time.monotonic()
+
+        while not await self._ping_all():
+            await asyncio.sleep(RETRY_DELAY)
+
+        self.warmup_time = time.monotonic() - started
+        self.ready = True
+        self._metrics.set("warmup.seconds", self.warmup_time)
+        self._log.info(
+            f"Warmed up {self._connections} connection(s) to {self._url}"
+            f" in {self.warmup_time * 1000:.0f} ms"
+        )
+
+        while True:
+            await asyncio.sleep(self._interval)
+            await self._ping_all()
+
+    async def _ping_all(self):
+        """
+        Выполнить одновременно столько лёгких запросов, сколько соединений нужно
+        держать открытыми. Одновременные запросы не могут использовать одно и то же
+        соединение, поэтому каждый из них открывает или освежает своё
+        """
+
+        pings = (self._ping() for _ in range(self._connections))
+        results = await asyncio.gather(*pings)
+        failed = results.count(False)
+
+        self._metrics.inc("warmup.pings", len(results))
+        if failed:
+            self._metrics.inc("warmup.failed_pings", failed)
+
+        return not failed
+
+    async def _ping(self):
+        try:
+            async with self._session.head(
+                self._url, allow_redirects=False, timeout=PING_TIMEOUT
+            ) as response:
+                await response.read()
+        except (ClientError, asyncio.TimeoutError) as e:
+            self._log.debug(f"Keep-alive request to {self._url} failed: {e!r}")
+            return False
+        return True
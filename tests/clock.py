@@ -0,0 +1,14 @@
+class FakeClock:
+    """
+    Управляемые часы для тестов. Вызов возвращает текущее время, как
+    time.monotonic, а метод time позволяет подменить модуль time целиком
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
@@ -0,0 +1,60 @@
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.admin import AdminApi
+from extbot.metrics import Metrics
+
+ADMIN_TOKEN = "admin-secret"
+AUTH_HEADERS = {"Authorization": f"Token {ADMIN_TOKEN}"}
+
+
+def make_admin():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+
+    metrics = Metrics()
+    metrics.inc("updates")
+    return AdminApi(logger, ADMIN_TOKEN, metrics)
+
+
+async def make_client(aiohttp_client, admin):
+    app = web.Application()
+    app.add_routes(admin.get_routes())
+    return await aiohttp_client(app)
+
+
+@pytest.mark.asyncio
+async def test_metrics(aiohttp_client):
+    client = await make_client(aiohttp_client, make_admin())
+
+    resp = await client.get("/admin/metrics", headers=AUTH_HEADERS)
+    assert resp.status == 200
+    assert await resp.json() == {"updates": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("authorization", [None, "Token wrong", ADMIN_TOKEN])
+async def test_unauthorized(aiohttp_client, authorization):
+    client = await make_client(aiohttp_client, make_admin())
+    headers = {"Authorization": authorization} if authorization else {}
+
+    resp = await client.get("/admin/metrics", headers=headers)
+    assert resp.status == 401
+
+
+@pytest.mark.asyncio
+async def test_added_route(aiohttp_client):
+    async def handler(request):
+        return web.json_response(dict(pong=True))
+
+    admin = make_admin()
+    admin.add_route("POST", "/ping", handler)
+    client = await make_client(aiohttp_client, admin)
+
+    resp = await client.post("/admin/ping")
+    assert resp.status == 401
+
+    resp = await client.post("/admin/ping", headers=AUTH_HEADERS)
+    assert await resp.json() == {"pong": True}
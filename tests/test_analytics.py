@@ -0,0 +1,122 @@
+import json
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.admin import AdminApi
+from extbot.analytics import Analytics, HyperLogLog, forward_target
+from extbot.metrics import Metrics
+
+ADMIN_TOKEN = "admin-secret"
+
+
+def make_analytics(directory=None, **kwargs):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return Analytics(logger, directory, **kwargs)
+
+
+@pytest.mark.parametrize("count", [0, 10, 1000, 50000])
+def test_hyperloglog_count(count):
+    hll = HyperLogLog()
+    for number in range(count):
+        hll.add(f"visitor-{number}")
+        hll.add(f"visitor-{number}")
+
+    assert abs(hll.count() - count) <= count * 0.05
+
+
+def test_hyperloglog_merge_and_json():
+    first, second = HyperLogLog(), HyperLogLog()
+    for number in range(1000):
+        first.add(str(number))
+        second.add(str(number + 500))
+
+    first.merge(HyperLogLog.from_json(second.to_json()))
+    assert abs(first.count() - 1500) <= 1500 * 0.05
+
+
+def test_forward_target():
+    assert forward_target(dict(operator_id=7)) == "agent:7"
+    assert forward_target(dict(dep_key="sales")) == "department:sales"
+    assert forward_target({}) == "queue"
+
+
+def test_rollups():
+    analytics = make_analytics()
+    for number in range(3):
+        analytics.new_chat(f"chat-{number}", "visitor")
+        analytics.new_message(f"chat-{number}")
+    analytics.button_click("forward_to_queue")
+    analytics.button_click("forward_to_queue")
+    analytics.forward({})
+    analytics.file_received()
+
+    rollups = analytics.rollups()
+    assert len(rollups["hours"]) == 1
+    hour = rollups["hours"][0]
+    assert hour["counters"] == {
+        "new_chats": 3,
+        "button_clicks": {"forward_to_queue": 2},
+        "forwards": {"queue": 1},
+        "files_received": 1,
+    }
+    assert hour["unique"] == {"chats": 3, "visitors": 1}
+    assert rollups["unique_total"] == {"chats": 3, "visitors": 1}
+
+
+@pytest.mark.asyncio
+async def test_flush_and_load(tmp_path):
+    analytics = make_analytics(tmp_path)
+    await analytics.startup()
+    analytics.new_chat("chat", "visitor")
+    await analytics.cleanup()
+
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+    restored = make_analytics(tmp_path)
+    await restored.startup()
+    restored.new_chat("other chat", "visitor")
+    hour = restored.rollups()["hours"][0]
+    await restored.cleanup()
+
+    assert hour["counters"] == {"new_chats": 2}
+    assert hour["unique"] == {"chats": 2, "visitors": 1}
+
+
+@pytest.mark.asyncio
+async def test_flush_removes_expired_files(tmp_path):
+    old_hour = tmp_path / "2020-01-01T00:00Z.json"
+    old_hour.write_text(json.dumps(dict(counters={"new_chats": 1})))
+    other = tmp_path / "notes.json"
+    other.write_text("{}")
+
+    analytics = make_analytics(tmp_path, retention_hours=2)
+    await analytics.startup()
+    analytics.new_chat("chat", "visitor")
+    assert analytics.rollups()["hours"][0]["counters"] == {"new_chats": 1}
+    await analytics.cleanup()
+
+    assert not old_hour.exists()
+    assert other.exists()
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+@pytest.mark.asyncio
+async def test_admin_route(aiohttp_client):
+    analytics = make_analytics()
+    analytics.new_chat("chat", "visitor")
+    admin = AdminApi(logging.getLogger(__name__), ADMIN_TOKEN, Metrics())
+    analytics.register_admin_routes(admin)
+
+    app = web.Application()
+    app.add_routes(admin.get_routes())
+    client = await aiohttp_client(app)
+
+    resp = await client.get(
+        "/admin/analytics", headers={"Authorization": f"Token {ADMIN_TOKEN}"}
+    )
+    assert resp.status == 200
+    body = await resp.json()
+    assert body["hours"][0]["counters"] == {"new_chats": 1}
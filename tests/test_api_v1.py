@@ -3,6 +3,7 @@ import logging
 import pytest
 from aiohttp import web
 
+from extbot.analytics import Analytics
 from extbot.api_v1 import (
     DEFAULT_CUSTOM_BUTTON_RESPONSE_TEXT,
     DEFAULT_CUSTOM_BUTTON_TEXT,
@@ -17,6 +18,7 @@ from extbot.api_v1 import (
     ApiV1Sample,
     ButtonIds,
 )
+from extbot.faq import FaqIndex
 
 
 async def make_client(aiohttp_client, *bot_args, **bot_kwargs):
@@ -97,6 +99,19 @@ async def test_new_chat(client):
     assert body == expected_body
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("webim_version", ["10.4", "10.4-dev build 5"])
+async def test_new_chat_webim_version(client, webim_version):
+    update = {"event": "new_chat", "chat": {"id": SOME_CHAT_ID}}
+    headers = {"X-Webim-Version": webim_version}
+
+    # Неразборчивая версия Webim считается неизвестной
+    resp = await client.post("/", json=update, headers=headers)
+    assert resp.status == 200
+    body = await resp.json()
+    assert body["messages"][0]["text"] == GREETING_TEXT
+
+
 @pytest.mark.asyncio
 async def test_say_hi(client):
     update = {
@@ -279,6 +294,44 @@ async def test_new_message_not_keyboard_response(client):
     assert body == expected_body
 
 
+@pytest.mark.asyncio
+async def test_visitor_message_answered_from_faq(aiohttp_client):
+    faq = FaqIndex([dict(questions=["How can I pay?"], answer="By card")])
+    client = await make_client(aiohttp_client, None, None, faq=faq)
+
+    for text, expected_text in [
+        ("How to pay?", "By card"),
+        ("What is the weather?", DO_NOT_UNDERSTAND_TEXT),
+    ]:
+        update = {
+            "event": "new_message",
+            "chat": {
+                "id": SOME_CHAT_ID,
+            },
+            "kind": "visitor",
+            "text": text,
+        }
+
+        resp = await client.post("/", json=update)
+        assert resp.status == 200
+
+        body = await resp.json()
+        expected_body = {
+            "has_answer": True,
+            "messages": [
+                {
+                    "kind": "operator",
+                    "text": expected_text,
+                },
+                {
+                    "kind": "keyboard",
+                    "buttons": DEFAULT_KEYBOARD,
+                },
+            ],
+        }
+        assert body == expected_body
+
+
 @pytest.mark.asyncio
 async def test_unknown_button(client):
     update = {
@@ -330,3 +383,44 @@ async def test_unknown_event(client):
 
     body = await resp.json()
     assert body == UNEXPECTED_UPDATE_RESPONSE
+
+
+@pytest.mark.asyncio
+async def test_analytics(aiohttp_client):
+    analytics = Analytics(logging.getLogger(__name__))
+    client = await make_client(aiohttp_client, None, None, analytics=analytics)
+
+    updates = [
+        {"event": "new_chat", "chat": {"id": SOME_CHAT_ID}, "visitor": {"id": "v"}},
+        {
+            "event": "new_message",
+            "chat": {"id": SOME_CHAT_ID},
+            "kind": "keyboard_response",
+            "response": {"button": FORWARD_TO_QUEUE_BUTTON},
+        },
+    ]
+    for update in updates:
+        resp = await client.post("/", json=update)
+        assert resp.status == 200
+
+    hour = analytics.rollups()["hours"][0]
+    assert hour["counters"] == {
+        "new_chats": 1,
+        "button_clicks": {ButtonIds.FORWARD_TO_QUEUE.value: 1},
+        "forwards": {"queue": 1},
+    }
+    assert hour["unique"] == {"chats": 1, "visitors": 1}
+
+
+@pytest.mark.asyncio
+async def test_invalid_update(client):
+    update = {
+        "event": "new_message",
+        "chat": {"id": SOME_CHAT_ID},
+        "kind": "keyboard_response",
+        "response": {},
+    }
+
+    resp = await client.post("/", json=update)
+    assert resp.status == 400
+    assert "update.response.button is required" in await resp.text()
@@ -0,0 +1,437 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from aiohttp import web
+
+from extbot import api_v2
+from extbot.api_v2 import ApiV2Sample
+from extbot.flood import FloodGuard
+from extbot.flow import compile_flow
+from extbot.metrics import Metrics
+from extbot.models import parse_v2_update
+from extbot.priority import GREETING, REPLY, URGENT
+from extbot.timers import TimingWheel
+from tests.clock import FakeClock
+
+SOME_CHAT_ID = "9401b039-ace3-4619-b884-a24e0aaf7adb"
+FLOW = {
+    "start": "main",
+    "states": {"main": {"keyboard": [["bye"]]}},
+    "buttons": {"bye": {"text": "Bye", "actions": [{"close": True}]}},
+    "events": {
+        "new_chat": [
+            {"text": "Welcome", "expires": 5},
+            {"keyboard": "main"},
+            {"close": True},
+        ]
+    },
+    "unexpected": [{"text": "Oops"}],
+}
+
+
+async def make_bot(
+    aiohttp_server,
+    fwd_agent_id=None,
+    fwd_department_key=None,
+    webim_delay=0.0,
+    **kwargs,
+):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+
+    requests = []
+
+    async def handler(request):
+        requests.append((request.match_info["method"], await request.json()))
+        await asyncio.sleep(webim_delay)
+        return web.json_response(dict(result="ok"))
+
+    app = web.Application()
+    app.add_routes([web.post("/api/bot/v2/{method}", handler)])
+    server = await aiohttp_server(app)
+
+    kwargs.setdefault("flow", compile_flow(FLOW))
+    bot = ApiV2Sample(
+        logger,
+        "demo.webim.ru",
+        "token",
+        fwd_agent_id,
+        fwd_department_key,
+        None,
+        None,
+        metrics=Metrics(),
+        **kwargs,
+    )
+    bot._api_url = str(server.make_url("/api/bot/v2/"))
+    await bot.startup()
+    return bot, requests
+
+
+async def post_updates(aiohttp_client, bot, updates, webim_version=None):
+    """
+    Отправить обновления в webhook бота, как это делает Webim
+    """
+
+    app = web.Application()
+    app.router.add_post("/", bot.webhook)
+    client = await aiohttp_client(app)
+    headers = {"X-Webim-Version": webim_version} if webim_version else {}
+    for update in updates:
+        resp = await client.post("/", json=update, headers=headers)
+        assert await resp.json() == dict(result="ok")
+
+
+async def wait_requests(requests, count, timeout=2.0):
+    """
+    Дождаться, пока бот отправит в Webim count запросов
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while len(requests) < count:
+        assert loop.time() < deadline, f"expected {count} requests, got {requests}"
+        await asyncio.sleep(0.01)
+    # Лишние запросы успели бы отправиться за это время
+    await asyncio.sleep(0.05)
+    return requests
+
+
+def new_chat():
+    return dict(event="new_chat", chat=dict(id=SOME_CHAT_ID))
+
+
+def button(button_id):
+    message = dict(kind="keyboard_response", data=dict(button=dict(id=button_id)))
+    return dict(event="new_message", chat_id=SOME_CHAT_ID, message=message)
+
+
+def visitor_text(text):
+    message = dict(kind="visitor", text=text)
+    return dict(event="new_message", chat_id=SOME_CHAT_ID, message=message)
+
+
+def button_ids(message):
+    return [button["id"] for row in message["buttons"] for button in row]
+
+
+@pytest.mark.asyncio
+async def test_webhook_greeting(aiohttp_server, aiohttp_client):
+    bot, requests = await make_bot(aiohttp_server, flow=None)
+    await post_updates(aiohttp_client, bot, [new_chat()])
+    await wait_requests(requests, 2)
+    await bot.cleanup()
+
+    (method, text), (_, keyboard) = requests
+    assert method == "send_message"
+    assert text == dict(
+        chat_id=SOME_CHAT_ID,
+        message=dict(kind="operator", text=api_v2.GREETING_TEXT),
+    )
+    assert keyboard["message"]["kind"] == "keyboard"
+    assert button_ids(keyboard["message"]) == [
+        "say_hi",
+        "close_chat",
+        "send_image",
+        "send_document",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "button_id, expected",
+    [
+        ("say_hi", [api_v2.GREETING_TEXT, "keyboard"]),
+        ("send_image", ["file_operator", api_v2.WHAT_NEXT_TEXT, "keyboard"]),
+        ("send_document", ["file_operator", api_v2.WHAT_NEXT_TEXT, "keyboard"]),
+        ("unknown", [api_v2.UNEXPECTED_UPDATE_TEXT, "keyboard"]),
+    ],
+)
+async def test_webhook_buttons(aiohttp_server, aiohttp_client, button_id, expected):
+    bot, requests = await make_bot(aiohttp_server, flow=None)
+    await post_updates(aiohttp_client, bot, [button(button_id)])
+    await wait_requests(requests, len(expected))
+    await bot.cleanup()
+
+    assert [
+        data["message"].get("text") or data["message"]["kind"] for _, data in requests
+    ] == expected
+    if button_id == "send_image":
+        assert requests[0][1]["message"]["data"] == api_v2.SAMPLE_IMAGE
+
+
+@pytest.mark.asyncio
+async def test_webhook_visitor_text(aiohttp_server, aiohttp_client):
+    bot, requests = await make_bot(aiohttp_server, flow=None)
+    await post_updates(aiohttp_client, bot, [visitor_text("hello")])
+    await wait_requests(requests, 2)
+    await bot.cleanup()
+
+    assert requests[0][1]["message"]["text"] == api_v2.DO_NOT_UNDERSTAND_TEXT
+
+
+@pytest.mark.asyncio
+async def test_webhook_close_chat(aiohttp_server, aiohttp_client):
+    bot, requests = await make_bot(aiohttp_server, flow=None)
+    await post_updates(aiohttp_client, bot, [button("close_chat")])
+    await wait_requests(requests, 2)
+    await bot.cleanup()
+
+    assert requests == [
+        (
+            "send_message",
+            dict(
+                chat_id=SOME_CHAT_ID,
+                message=dict(kind="operator", text=api_v2.FAREWELL_TEXT),
+            ),
+        ),
+        ("close_chat", dict(chat_id=SOME_CHAT_ID)),
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "button_id, text, forward_info",
+    [
+        (
+            "forward_to_agent",
+            api_v2.FORWARD_TO_AGENT_TEXT.format(agent_id=7),
+            dict(operator_id=7),
+        ),
+        (
+            "forward_to_department",
+            api_v2.FORWARD_TO_DEPARTMENT_TEXT.format(dep_key="sales"),
+            dict(dep_key="sales"),
+        ),
+        ("forward_to_queue", api_v2.FORWARD_TO_QUEUE_TEXT, dict()),
+    ],
+)
+async def test_webhook_forward_chat(
+    aiohttp_server, aiohttp_client, button_id, text, forward_info
+):
+    bot, requests = await make_bot(
+        aiohttp_server, fwd_agent_id=7, fwd_department_key="sales", flow=None
+    )
+    await post_updates(aiohttp_client, bot, [button(button_id)])
+    await wait_requests(requests, 2)
+    await bot.cleanup()
+
+    assert requests[0][1]["message"]["text"] == text
+    assert requests[1] == ("redirect_chat", dict(chat_id=SOME_CHAT_ID, **forward_info))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "webim_version, shown",
+    [
+        (None, False),
+        ("10.3", False),
+        ("10.4", True),
+        ("11.0.1", True),
+        ("10.4-dev build 5", False),
+    ],
+)
+async def test_webhook_queue_button_version(
+    aiohttp_server, aiohttp_client, webim_version, shown
+):
+    bot, requests = await make_bot(aiohttp_server, flow=None)
+    await post_updates(aiohttp_client, bot, [new_chat()], webim_version)
+    await wait_requests(requests, 2)
+    await bot.cleanup()
+
+    assert ("forward_to_queue" in button_ids(requests[1][1]["message"])) is shown
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "update, priority",
+    [
+        (new_chat(), GREETING),
+        (button("close_chat"), URGENT),
+        (button("forward_to_queue"), URGENT),
+        (button("forward_to_agent"), URGENT),
+        (button("say_hi"), REPLY),
+        (button("unknown"), REPLY),
+        (visitor_text("hello"), REPLY),
+    ],
+)
+async def test_priority(aiohttp_server, update, priority):
+    bot, _ = await make_bot(aiohttp_server, fwd_agent_id=7, flow=None)
+    await bot.cleanup()
+
+    assert bot._priority(parse_v2_update(update)) == priority
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "age, reply_deadline, expected",
+    [
+        (1, None, ["send_message", "send_message", "close_chat"]),
+        (10, None, ["send_message", "close_chat"]),
+        (10, 8, ["close_chat"]),
+    ],
+)
+async def test_expired_actions(aiohttp_server, age, reply_deadline, expected):
+    bot, requests = await make_bot(aiohttp_server, reply_deadline=reply_deadline)
+    transition = bot._flow.event("new_chat")
+
+    await bot._run_transition(SOME_CHAT_ID, transition, time.monotonic() - age)
+    await bot.cleanup()
+
+    assert [method for method, _ in requests] == expected
+    dropped = bot._metrics.get("deadline.dropped_actions", 0)
+    assert dropped == 3 - len(expected)
+
+
+@pytest.mark.asyncio
+async def test_expired_request(aiohttp_server):
+    bot, requests = await make_bot(aiohttp_server)
+
+    token = api_v2._deadline.set(time.monotonic() - 1)
+    try:
+        assert await bot.send_text_message(SOME_CHAT_ID, "Late") is None
+    finally:
+        api_v2._deadline.reset(token)
+    assert await bot.send_text_message(SOME_CHAT_ID, "In time") == dict(result="ok")
+    await bot.cleanup()
+
+    assert [data["message"]["text"] for _, data in requests] == ["In time"]
+    assert bot._metrics.get("deadline.dropped_requests") == 1
+    assert bot._limiter.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_requests(aiohttp_server):
+    bot, requests = await make_bot(aiohttp_server, webim_delay=10)
+    limit = bot._limiter.limit
+
+    tasks = [asyncio.ensure_future(bot.close_chat(str(n))) for n in range(6)]
+    await wait_requests(requests, 6)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.cleanup()
+
+    # Отменённые ботом запросы не считаются ошибками перегрузки Webim
+    assert bot._limiter.inflight == 0
+    assert bot._limiter.limit == limit
+    assert bot.readiness()["webim_available"]
+    assert bot._metrics.get("limiter.demo.webim.ru.rtt.count", 0) == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_full(aiohttp_server, aiohttp_client):
+    bot, requests = await make_bot(
+        aiohttp_server,
+        webim_delay=10,
+        max_concurrent_updates=1,
+        max_queued_updates=1,
+    )
+    app = web.Application()
+    app.router.add_post("/", bot.webhook)
+    client = await aiohttp_client(app)
+
+    statuses = []
+    for _ in range(3):
+        resp = await client.post("/", json=visitor_text("hi"))
+        statuses.append(resp.status)
+    await bot.cleanup()
+
+    # Одно обновление обрабатывается, одно ждёт, а третье Webim повторит позже
+    assert statuses == [200, 200, 503]
+    assert bot._metrics.get("queue.reply.rejected") == 1
+
+
+@pytest.mark.asyncio
+async def test_outbox(aiohttp_server):
+    bot, requests = await make_bot(aiohttp_server, outbox_linger=0.05)
+    hi = bot._flow.reply("Hi")
+
+    await asyncio.gather(
+        bot._run_transition(SOME_CHAT_ID, hi),
+        bot._run_transition(SOME_CHAT_ID, hi),
+        bot._run_transition(SOME_CHAT_ID, bot._flow.button("bye")),
+    )
+    await bot.cleanup()
+
+    assert [data.get("message", {}).get("kind") for _, data in requests] == [
+        "operator",
+        "keyboard",
+        None,
+    ]
+    assert requests[2][0] == "close_chat"
+    assert bot._metrics.get("outbox.saved") == 2
+
+
+@pytest.mark.asyncio
+async def test_flood(aiohttp_server, aiohttp_client):
+    flood = FloodGuard(logging.getLogger(__name__), Metrics(), 2, text="Slow down")
+    bot, requests = await make_bot(aiohttp_server, flood=flood)
+    app = web.Application()
+    app.router.add_post("/", bot.webhook)
+    client = await aiohttp_client(app)
+
+    message = dict(kind="visitor", text="spam")
+    update = dict(event="new_message", chat_id=SOME_CHAT_ID, message=message)
+    for _ in range(5):
+        resp = await client.post("/", json=update)
+        assert await resp.json() == dict(result="ok")
+    await wait_requests(requests, 4)
+    await bot.cleanup()
+
+    texts = [data["message"].get("text") for _, data in requests]
+    assert texts.count("Oops") == 2
+    assert texts.count("Slow down") == 1
+    assert flood._metrics.get("flood.dropped") == 2
+
+
+async def make_inactivity_bot(aiohttp_server):
+    bot, requests = await make_bot(
+        aiohttp_server, flow=None, inactivity_reminder=10, inactivity_close=20
+    )
+    # Колесо таймеров с управляемыми часами вместо настоящего
+    await bot._inactivity_timers.close()
+    clock = FakeClock(1000.0)
+    bot._inactivity_timers = TimingWheel(bot._log, bot._metrics, clock=clock)
+    return bot, requests, clock
+
+
+def advance_timers(bot, clock, seconds):
+    clock.now += seconds
+    for timer in bot._inactivity_timers.advance():
+        timer.callback(timer.key)
+
+
+@pytest.mark.asyncio
+async def test_inactivity_reminder_and_close(aiohttp_server, aiohttp_client):
+    bot, requests, clock = await make_inactivity_bot(aiohttp_server)
+    await post_updates(aiohttp_client, bot, [visitor_text("hello")])
+    await wait_requests(requests, 2)
+
+    advance_timers(bot, clock, 9)
+    advance_timers(bot, clock, 2)
+    await wait_requests(requests, 3)
+    assert requests[2][1]["message"]["text"] == api_v2.INACTIVITY_REMINDER_TEXT
+
+    advance_timers(bot, clock, 10)
+    await wait_requests(requests, 4)
+    await bot.cleanup()
+
+    assert requests[3] == ("close_chat", dict(chat_id=SOME_CHAT_ID))
+    assert len(requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_inactivity_cancelled_on_chat_closed(aiohttp_server, aiohttp_client):
+    bot, requests, clock = await make_inactivity_bot(aiohttp_server)
+    closed = dict(event="chat_closed", chat_id=SOME_CHAT_ID)
+    await post_updates(aiohttp_client, bot, [visitor_text("hello"), closed])
+    await wait_requests(requests, 2)
+    assert SOME_CHAT_ID not in bot._inactivity_timers
+
+    advance_timers(bot, clock, 30)
+    await asyncio.sleep(0.05)
+    await bot.cleanup()
+
+    assert len(requests) == 2
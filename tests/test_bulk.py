@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.admin import AdminApi
+from extbot.bulk import (
+    BulkError,
+    BulkOperations,
+    main,
+    parse_spec,
+    read_chat_ids,
+)
+from extbot.metrics import Metrics
+
+ADMIN_TOKEN = "admin-secret"
+AUTH_HEADERS = {"Authorization": f"Token {ADMIN_TOKEN}"}
+
+
+class FakeBot:
+    def __init__(self, failing=(), delay=0):
+        self.calls = []
+        self.failing = set(failing)
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def _call(self, *args):
+        self.calls.append(args)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        if args[1] in self.failing:
+            return None
+        return dict(result="ok")
+
+    async def send_text_message(self, chat_id, text):
+        return await self._call("send_text_message", chat_id, text)
+
+    async def send_keyboard(self, chat_id, state=None):
+        return await self._call("send_keyboard", chat_id, state)
+
+    async def close_chat(self, chat_id):
+        return await self._call("close_chat", chat_id)
+
+    async def forward_chat(self, chat_id, forward_info):
+        return await self._call("forward_chat", chat_id, forward_info)
+
+
+def make_bulk(bot, directory=None):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return BulkOperations(logger, Metrics(), bot, directory, states={"main"})
+
+
+def spec(**kwargs):
+    data = dict(action="close_chat", chat_ids=["a", "b", "c"], rate=1000)
+    data.update(kwargs)
+    return parse_spec(data)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [],
+        dict(action="delete_chat", chat_ids=["a"]),
+        dict(action="close_chat", chat_ids=[]),
+        dict(action="close_chat", chat_ids=["a", 1]),
+        dict(action="close_chat", chat_ids=["a"], concurrency=0),
+        dict(action="close_chat", chat_ids=["a"], rate="fast"),
+        dict(action="send_text_message", chat_ids=["a"]),
+        dict(action="forward_chat", chat_ids=["a"], forward=dict(queue=True)),
+    ],
+)
+def test_invalid_spec(data):
+    with pytest.raises(BulkError):
+        parse_spec(data)
+
+
+def test_unknown_keyboard_state():
+    data = dict(action="send_keyboard", chat_ids=["a"], state="missing")
+    with pytest.raises(BulkError):
+        parse_spec(data, states={"main"})
+    assert parse_spec(dict(data, state="main"), states={"main"})["state"] == "main"
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--concurrency", "0"],
+        ["--concurrency", "many"],
+        ["--rate", "-1"],
+        ["--rate", "nan"],
+        ["--poll-interval", "0"],
+    ],
+)
+def test_cli_invalid_numbers(monkeypatch, capsys, argv):
+    monkeypatch.setattr(
+        "sys.argv",
+        ["extbot-bulk", "--url", "http://localhost", "--admin-token", "t", *argv],
+    )
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 2
+    assert "expected positive" in capsys.readouterr().err
+
+
+def test_spec_defaults():
+    assert parse_spec(dict(action="send_keyboard", chat_ids=["a", "b", "a"])) == dict(
+        action="send_keyboard",
+        chat_ids=["a", "b"],
+        concurrency=10,
+        rate=20.0,
+        state=None,
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_with_bounded_concurrency():
+    bot = FakeBot(failing={"c3"}, delay=0.01)
+    bulk = make_bulk(bot)
+    chat_ids = [f"c{number}" for number in range(10)]
+
+    operation = await bulk.start(
+        spec(action="send_text_message", chat_ids=chat_ids, text="Hi", concurrency=3)
+    )
+    await bulk.wait(operation.id)
+
+    assert operation.status == "done"
+    assert operation.progress() == dict(total=10, ok=9, failed=1)
+    assert bot.max_active == 3
+    assert sorted(call[1] for call in bot.calls) == sorted(chat_ids)
+    assert {call[2] for call in bot.calls} == {"Hi"}
+
+    results = operation.to_json(with_results=True)["results"]
+    assert [result["chat_id"] for result in results] == chat_ids
+    assert results[3]["status"] == "failed"
+
+
+@pytest.mark.asyncio
+async def test_rate_limit():
+    bulk = make_bulk(FakeBot())
+    loop = asyncio.get_running_loop()
+
+    started = loop.time()
+    operation = await bulk.start(spec(chat_ids=["a", "b", "c", "d", "e"], rate=50))
+    await bulk.wait(operation.id)
+
+    # Пять запусков с интервалом 20 мс: первый сразу, последний через 80 мс
+    assert loop.time() - started >= 0.08
+
+
+@pytest.mark.asyncio
+async def test_cancel_and_resume():
+    bot = FakeBot(failing={"b"}, delay=0.01)
+    bulk = make_bulk(bot)
+
+    operation = await bulk.start(spec(chat_ids=["a", "b", "c"], concurrency=1))
+    await asyncio.sleep(0.015)
+    await bulk.cancel(operation.id)
+    assert operation.status == "cancelled"
+    assert 0 < len(operation.results) < 3
+
+    bot.failing.clear()
+    await bulk.resume(operation.id)
+    with pytest.raises(BulkError):
+        await bulk.resume(operation.id)
+    await bulk.wait(operation.id)
+
+    assert operation.status == "done"
+    assert operation.progress() == dict(total=3, ok=3, failed=0)
+    # Успешно обработанные чаты не обрабатываются повторно
+    closed = [call[1] for call in bot.calls if call[1] != "b"]
+    assert sorted(closed) == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_resume_after_restart(tmp_path):
+    bot = FakeBot(delay=0.01)
+    bulk = make_bulk(bot, tmp_path)
+    await bulk.startup()
+
+    operation = await bulk.start(spec(chat_ids=["a", "b", "c"], concurrency=1))
+    await asyncio.sleep(0.015)
+    await bulk.cleanup()
+    done = set(operation.results)
+
+    # Недописанная при аварии строка пропускается
+    with open(tmp_path / f"{operation.id}.results.jsonl", "a") as file:
+        file.write('{"chat_id": "c", "sta')
+
+    restarted = make_bulk(bot, tmp_path)
+    await restarted.startup()
+    loaded = restarted.get(operation.id)
+    assert loaded.status == "interrupted"
+    assert set(loaded.results) == done
+
+    bot.calls.clear()
+    await restarted.resume(operation.id)
+    await restarted.wait(operation.id)
+    assert loaded.progress() == dict(total=3, ok=3, failed=0)
+    assert {call[1] for call in bot.calls} == {"a", "b", "c"} - done
+
+    saved = json.loads((tmp_path / f"{operation.id}.json").read_text())
+    assert saved["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_admin_routes(aiohttp_client):
+    logger = logging.getLogger(__name__)
+    admin = AdminApi(logger, ADMIN_TOKEN, Metrics())
+    bulk = make_bulk(FakeBot())
+    bulk.register_admin_routes(admin)
+    app = web.Application()
+    app.add_routes(admin.get_routes())
+    client = await aiohttp_client(app)
+
+    data = dict(action="forward_chat", chat_ids=["a"], forward=dict(dep_key="sales"))
+    resp = await client.post("/admin/bulk", json=data, headers=AUTH_HEADERS)
+    assert resp.status == 202
+    operation_id = (await resp.json())["id"]
+    await bulk.wait(operation_id)
+
+    resp = await client.get(f"/admin/bulk/{operation_id}", headers=AUTH_HEADERS)
+    body = await resp.json()
+    assert body["status"] == "done"
+    assert body["results"][0]["chat_id"] == "a"
+    assert body["results"][0]["status"] == "ok"
+
+    resp = await client.get("/admin/bulk", headers=AUTH_HEADERS)
+    assert [o["id"] for o in (await resp.json())["operations"]] == [operation_id]
+
+    resp = await client.post("/admin/bulk", json=dict(), headers=AUTH_HEADERS)
+    assert resp.status == 400
+    keyboard = dict(action="send_keyboard", chat_ids=["a"], state="missing")
+    resp = await client.post("/admin/bulk", json=keyboard, headers=AUTH_HEADERS)
+    assert resp.status == 400
+    resp = await client.post("/admin/bulk/missing/resume", headers=AUTH_HEADERS)
+    assert resp.status == 404
+    resp = await client.post("/admin/bulk", json=data)
+    assert resp.status == 401
+
+
+def test_read_chat_ids(tmp_path):
+    path = tmp_path / "ids.txt"
+    path.write_text("a\n\n  b \nc\n")
+    assert read_chat_ids(str(path)) == ["a", "b", "c"]
@@ -0,0 +1,124 @@
+import logging
+import random
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, unused_port
+
+from extbot.cluster import Cluster, HashRing, read_peers_file
+from extbot.metrics import Metrics
+from extbot.router import ApiVersionRouter
+
+
+class RecordingBot:
+    def __init__(self, name):
+        self.name = name
+        self.chat_ids = []
+
+    async def webhook(self, request):
+        update = await request.json()
+        self.chat_ids.append(update["chat"]["id"])
+        return web.json_response(dict(node=self.name))
+
+
+def get_logger():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+def test_ring_moves_few_chats():
+    nodes = [f"http://node-{number}:8000" for number in range(4)]
+    ring = HashRing(nodes)
+    chats = [f"chat-{number}" for number in range(10_000)]
+
+    owners = [ring.owner(chat) for chat in chats]
+    counts = [owners.count(node) for node in nodes]
+    assert min(counts) > 10_000 / 4 * 0.7
+
+    bigger = HashRing([*nodes, "http://node-4:8000"])
+    moved = sum(bigger.owner(chat) != owner for chat, owner in zip(chats, owners))
+    assert moved < 10_000 / 5 * 1.3
+    assert all(
+        bigger.owner(chat) in (owner, "http://node-4:8000")
+        for chat, owner in zip(chats, owners)
+    )
+
+
+def test_peers_file(tmp_path):
+    cluster = Cluster(
+        get_logger(),
+        Metrics(),
+        "http://a:1/",
+        peers_file=tmp_path / "peers",
+    )
+    (tmp_path / "peers").write_text("# peers\nhttp://b:1/\n\nhttp://c:1\n")
+    cluster.reload_peers()
+    assert cluster.nodes == {"http://a:1", "http://b:1", "http://c:1"}
+
+    (tmp_path / "peers").write_text("http://b:1\n")
+    cluster.reload_peers()
+    assert cluster.nodes == {"http://a:1", "http://b:1"}
+    assert read_peers_file(tmp_path / "peers") == ["http://b:1"]
+
+
+@pytest.mark.asyncio
+async def test_updates_handled_by_owner():
+    ports = [unused_port() for _ in range(3)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+
+    bots, clusters, clients = [], [], []
+    for number, port in enumerate(ports):
+        bot = RecordingBot(urls[number])
+        cluster = Cluster(get_logger(), Metrics(), urls[number], urls)
+        router = ApiVersionRouter(get_logger(), bot, cluster=cluster)
+        app = web.Application()
+        app.add_routes(router.get_routes())
+        app.on_startup.append(cluster.startup)
+        app.on_cleanup.append(cluster.cleanup)
+
+        client = TestClient(TestServer(app, host="127.0.0.1", port=port))
+        await client.start_server()
+        bots.append(bot)
+        clusters.append(cluster)
+        clients.append(client)
+
+    try:
+        rng = random.Random(0)
+        for number in range(60):
+            chat_id = f"chat-{number}"
+            update = {"event": "new_chat", "chat": {"id": chat_id}}
+            for _ in range(3):
+                resp = await rng.choice(clients).post("/v1", json=update)
+                assert resp.status == 200
+                assert (await resp.json())["node"] == clusters[0].owner(chat_id)
+    finally:
+        for client in clients:
+            await client.close()
+
+    for bot in bots:
+        assert len(bot.chat_ids) > 0
+        assert all(clusters[0].owner(chat_id) == bot.name for chat_id in bot.chat_ids)
+    assert sum(len(bot.chat_ids) for bot in bots) == 180
+
+
+@pytest.mark.asyncio
+async def test_unreachable_owner_handled_locally(aiohttp_client):
+    bot = RecordingBot("local")
+    metrics = Metrics()
+    dead_peer = f"http://127.0.0.1:{unused_port()}"
+    cluster = Cluster(get_logger(), metrics, "http://127.0.0.1:1", [dead_peer])
+    router = ApiVersionRouter(get_logger(), bot, cluster=cluster)
+    app = web.Application()
+    app.add_routes(router.get_routes())
+    app.on_startup.append(cluster.startup)
+    app.on_cleanup.append(cluster.cleanup)
+    client = await aiohttp_client(app)
+
+    chat_id = next(
+        f"chat-{n}" for n in range(100) if cluster.owner(f"chat-{n}") == dead_peer
+    )
+    resp = await client.post("/v1", json={"event": "new_chat", "chat": {"id": chat_id}})
+    assert resp.status == 200
+    assert bot.chat_ids == [chat_id]
+    assert metrics.get("cluster.forward_errors") == 1
@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import threading
+
+import pytest
+from aiohttp import ClientSession, web
+
+from extbot.downloads import FileDownloader
+from extbot.metrics import Metrics
+
+CONTENT = b"\x89PNG" + bytes(200_000)
+
+
+async def make_downloader(aiohttp_server, tmp_path, **kwargs):
+    async def image(request):
+        return web.Response(body=CONTENT, content_type="image/png")
+
+    async def document(request):
+        return web.Response(body=b"doc", content_type="application/msword")
+
+    app = web.Application()
+    app.router.add_get("/image.png", image)
+    app.router.add_get("/document.doc", document)
+    server = await aiohttp_server(app)
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    downloader = FileDownloader(logger, Metrics(), tmp_path / "files", **kwargs)
+    return server, downloader
+
+
+@pytest.mark.asyncio
+async def test_download(aiohttp_server, tmp_path):
+    processed = []
+
+    async def hook(downloaded):
+        processed.append(downloaded)
+
+    server, downloader = await make_downloader(aiohttp_server, tmp_path, hook=hook)
+    file_data = dict(url=str(server.make_url("/image.png")), name="cat.png")
+
+    async with ClientSession() as session:
+        downloader.start(session)
+        downloaded = await downloader.download("chat", file_data)
+        await downloader.close()
+
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    assert downloaded.sha256 == sha256
+    assert downloaded.size == len(CONTENT)
+    assert downloaded.media_type == "image/png"
+    assert downloaded.path.name == f"{sha256}.png"
+    assert downloaded.path.read_bytes() == CONTENT
+    assert processed == [downloaded]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("path", "file_data", "kwargs"),
+    [
+        ("/image.png", {}, dict(max_size=1000)),
+        ("/image.png", dict(size=10**9), {}),
+        ("/image.png", dict(media_type="application/zip"), {}),
+        ("/document.doc", {}, {}),
+        ("/missing", {}, {}),
+    ],
+)
+async def test_rejected(aiohttp_server, tmp_path, path, file_data, kwargs):
+    server, downloader = await make_downloader(aiohttp_server, tmp_path, **kwargs)
+    file_data = dict(file_data, url=str(server.make_url(path)), name="file")
+
+    async with ClientSession() as session:
+        downloader.start(session)
+        downloaded = await downloader.download("chat", file_data)
+        await downloader.close()
+
+    assert downloaded is None
+    assert list((tmp_path / "files").iterdir()) == []
+
+
+def test_is_allowed_type(tmp_path):
+    downloader = FileDownloader(
+        logging.getLogger(__name__),
+        Metrics(),
+        tmp_path,
+        allowed_types=["image/*", "application/pdf"],
+    )
+
+    assert downloader.is_allowed_type("image/jpeg")
+    assert downloader.is_allowed_type("Application/PDF")
+    assert not downloader.is_allowed_type("application/pdf+zip")
+    assert not downloader.is_allowed_type(None)
+
+
+@pytest.mark.asyncio
+async def test_sync_hook_in_executor(aiohttp_server, tmp_path):
+    threads = []
+
+    def hook(downloaded):
+        threads.append(threading.get_ident())
+
+    server, downloader = await make_downloader(aiohttp_server, tmp_path, hook=hook)
+    file_data = dict(url=str(server.make_url("/image.png")), name="cat.png")
+
+    async with ClientSession() as session:
+        downloader.start(session)
+        assert await downloader.download("chat", file_data) is not None
+        await downloader.close()
+
+    # Обычная функция обработки не задерживает event loop
+    assert len(threads) == 1
+    assert threads[0] != threading.get_ident()
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from extbot.faq import FaqError, FaqIndex, normalize
+
+ENTRIES = [
+    {
+        "questions": ["Как оплатить заказ?", "How can I pay for my order?"],
+        "answer": "Pay by card",
+    },
+    {
+        "questions": ["Где мой заказ?", "Сроки доставки"],
+        "answer": "Track your order",
+    },
+]
+
+
+def test_normalize():
+    assert normalize("Как оплатить заказы?") == ["оплати", "заказ"]
+    assert normalize("Ёлки-палки") == ["елк", "палк"]
+    assert normalize("Paying for ORDERS") == ["pay", "order"]
+    assert normalize("how to do it") == []
+
+
+def test_match():
+    faq = FaqIndex(ENTRIES)
+
+    assert faq.match("оплатить заказ картой") == 0
+    assert faq.match("What about my orders, how to pay?") == 0
+    assert faq.match("сроки доставки заказа") == 1
+    assert faq.match("какая сегодня погода") is None
+    assert faq.match("") is None
+
+
+def test_threshold():
+    entry, score = FaqIndex(ENTRIES).search("заказ погода")
+    assert 0 < score < 1
+
+    assert FaqIndex(ENTRIES, threshold=score).match("заказ погода") == entry
+    assert FaqIndex(ENTRIES, threshold=score + 0.01).match("заказ погода") is None
+
+
+def test_load(tmp_path):
+    path = tmp_path / "faq.json"
+    path.write_text(json.dumps(ENTRIES), encoding="utf-8")
+
+    faq = FaqIndex.load(path)
+    assert len(faq) == 4
+    assert faq.answers == ["Pay by card", "Track your order"]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "{",
+        "{}",
+        '[{"answer": "No questions"}]',
+        '[{"questions": "How can I pay?", "answer": "Pay by card"}]',
+        '[{"questions": [], "answer": "Pay by card"}]',
+        '[{"questions": ["How can I pay?", 1], "answer": "Pay by card"}]',
+        '[{"questions": ["How can I pay?"], "answer": ["Pay by card"]}]',
+        '[{"questions": ["How can I pay?"], "answer": ""}]',
+    ],
+)
+def test_load_invalid(tmp_path, content):
+    path = tmp_path / "faq.json"
+    path.write_text(content, encoding="utf-8")
+
+    with pytest.raises(FaqError):
+        FaqIndex.load(path)
@@ -0,0 +1,88 @@
+import hashlib
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.files import CACHE_CONTROL, FileStore
+from extbot.flow import FlowError, compile_flow
+
+BASE_URL = "https://bot.example.com/files/"
+CONTENT = bytes(range(256)) * 100
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "cat image.png").write_bytes(CONTENT)
+    (tmp_path / "doc.pdf").write_bytes(b"%PDF")
+    (tmp_path / ".hidden").write_bytes(b"secret")
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    store = FileStore(logger, tmp_path, BASE_URL)
+    store.scan()
+    return store
+
+
+def test_scan(store):
+    assert len(store) == 2
+
+    info = store.get("images/cat image.png")
+    assert info.size == len(CONTENT)
+    assert info.media_type == "image/png"
+    assert info.sha256 == hashlib.sha256(CONTENT).hexdigest()
+    assert store.get(".hidden") is None
+
+    assert store.file_data("images/cat image.png") == {
+        "url": f"{BASE_URL}images/cat%20image.png?v={info.sha256[:16]}",
+        "name": "cat image.png",
+        "media_type": "image/png",
+    }
+    assert store.file_data("missing.png") is None
+
+
+@pytest.mark.asyncio
+async def test_serve(aiohttp_client, store):
+    app = web.Application()
+    app.add_routes(store.get_routes())
+    client = await aiohttp_client(app)
+
+    resp = await client.get("/files/images/cat image.png")
+    assert resp.status == 200
+    assert await resp.read() == CONTENT
+    assert resp.headers["Cache-Control"] == CACHE_CONTROL
+    etag = resp.headers["ETag"]
+    assert etag == store.get("images/cat image.png").etag
+
+    resp = await client.get(
+        "/files/images/cat image.png", headers={"If-None-Match": etag}
+    )
+    assert resp.status == 304
+
+    resp = await client.get(
+        "/files/images/cat image.png", headers={"Range": "bytes=10-19"}
+    )
+    assert resp.status == 206
+    assert await resp.read() == CONTENT[10:20]
+
+    for path in ["/files/missing.png", "/files/.hidden", "/files/../doc.pdf"]:
+        resp = await client.get(path)
+        assert resp.status == 404
+
+
+def test_flow_file_by_name(store):
+    definition = {
+        "start": "main",
+        "states": {"main": {}},
+        "unexpected": [{"file": "doc.pdf"}],
+    }
+
+    flow = compile_flow(definition, store)
+    message = flow.unexpected.actions[0].message
+    assert message == {"kind": "file_operator", "data": store.file_data("doc.pdf")}
+
+    with pytest.raises(FlowError):
+        compile_flow(definition)
+    with pytest.raises(FlowError):
+        compile_flow({**definition, "unexpected": [{"file": "missing.pdf"}]}, store)
@@ -0,0 +1,154 @@
+import logging
+import time
+
+import pytest
+from aiohttp import web
+
+from extbot import state as state_module
+from extbot.api_v1 import ApiV1Sample
+from extbot.flood import ALLOW, DROP, WARN, FloodGuard
+from extbot.metrics import Metrics
+from extbot.state import MemoryStateBackend
+from tests.clock import FakeClock
+
+
+def get_logger():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+def make_guard(clock, **kwargs):
+    return FloodGuard(
+        get_logger(), Metrics(), 3, window=10, cooldown=30, clock=clock, **kwargs
+    )
+
+
+async def check(guard, chat_id, count=1):
+    return [await guard.check(chat_id) for _ in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_flood_guard():
+    clock = FakeClock()
+    guard = make_guard(clock)
+
+    assert await check(guard, "a", 5) == [ALLOW, ALLOW, ALLOW, WARN, DROP]
+    # Другие чаты не страдают из-за одного
+    assert await check(guard, "b") == [ALLOW]
+
+    clock.now = 29
+    assert await check(guard, "a") == [DROP]
+    clock.now = 30
+    assert await check(guard, "a") == [ALLOW]
+
+    metrics = guard._metrics.snapshot()
+    assert metrics["flood.warned"] == 1
+    assert metrics["flood.dropped"] == 2
+    assert metrics["flood.chats"] == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("shared", [False, True])
+async def test_sliding_window(monkeypatch, shared):
+    clock = FakeClock()
+    if shared:
+        monkeypatch.setattr(state_module, "time", clock)
+        guard = make_guard(clock, state=MemoryStateBackend())
+    else:
+        guard = make_guard(clock)
+
+    clock.now = 9
+    assert await check(guard, "a", 3) == [ALLOW] * 3
+    # Сообщения прошлого интервала ещё учитываются почти полностью
+    clock.now = 11
+    assert await check(guard, "a") == [WARN]
+
+    clock.now = 100
+    assert await check(guard, "b", 3) == [ALLOW] * 3
+    # Через два интервала прошлые сообщения забыты
+    clock.now = 120
+    assert await check(guard, "b", 3) == [ALLOW] * 3
+
+
+@pytest.mark.asyncio
+async def test_shared_between_workers(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(state_module, "time", clock)
+    state = MemoryStateBackend()
+    workers = [make_guard(clock, state=state) for _ in range(2)]
+
+    # Обновления чата попадают то в один процесс, то в другой, а ограничение общее
+    verdicts = [await workers[n % 2].check("a") for n in range(6)]
+    assert verdicts == [ALLOW, ALLOW, ALLOW, WARN, DROP, DROP]
+    assert await check(workers[0], "b") == [ALLOW]
+
+    clock.now = 29
+    assert await check(workers[1], "a") == [DROP]
+    clock.now = 30
+    assert await check(workers[1], "a") == [ALLOW]
+    assert sum(w._metrics.get("flood.warned", 0) for w in workers) == 1
+    assert "flood.chats" not in workers[0]._metrics.snapshot()
+
+
+class CountingBackend(MemoryStateBackend):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def get(self, key):
+        self.calls.append("get")
+        return await super().get(key)
+
+    async def get_many(self, keys):
+        self.calls.append("get_many")
+        return await super().get_many(keys)
+
+    async def incr(self, key, amount=1, ttl=None):
+        self.calls.append("incr")
+        return await super().incr(key, amount, ttl)
+
+
+@pytest.mark.asyncio
+async def test_shared_round_trips():
+    state = CountingBackend()
+    guard = make_guard(time.time, state=state)
+
+    assert await check(guard, "a") == [ALLOW]
+    assert state.calls == ["get_many", "incr"]
+
+
+@pytest.mark.asyncio
+async def test_max_chats():
+    guard = make_guard(FakeClock(), max_chats=2)
+    for chat_id in ["a", "b", "a", "c"]:
+        await guard.check(chat_id)
+
+    assert list(guard._chats) == ["a", "c"]
+    assert guard._metrics.get("flood.evicted") == 1
+
+
+@pytest.mark.asyncio
+async def test_v1_flood(aiohttp_client):
+    guard = make_guard(FakeClock(), text="Slow down")
+    bot = ApiV1Sample(get_logger(), None, None, flood=guard)
+    app = web.Application()
+    app.router.add_post("/", bot.webhook)
+    client = await aiohttp_client(app)
+
+    texts = []
+    for _ in range(5):
+        update = dict(event="new_message", chat=dict(id="c"), kind="visitor")
+        resp = await client.post("/", json=dict(update, text="spam"))
+        body = await resp.json()
+        assert body["has_answer"] is True
+        texts.append(
+            [m.get("text") for m in body["messages"] if m["kind"] == "operator"]
+        )
+
+    assert texts[3] == ["Slow down"]
+    assert texts[4] == []
+
+    # События чата защита не ограничивает
+    resp = await client.post("/", json=dict(event="new_chat", chat=dict(id="c")))
+    assert (await resp.json())["messages"]
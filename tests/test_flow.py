@@ -0,0 +1,231 @@
+import json
+
+import pytest
+from packaging.version import parse as parse_version
+
+from extbot import api_v2
+from extbot.flow import ActionKind, FlowError, compile_flow, load_flow
+
+FLOW = {
+    "start": "main",
+    "states": {
+        "main": {"keyboard": [["hi", "new"], ["more"]]},
+        "more": {"keyboard": [["hi"]]},
+    },
+    "buttons": {
+        "hi": {"text": "Hi", "actions": [{"text": "Hello"}, {"keyboard": "main"}]},
+        "new": {
+            "text": "New",
+            "min_webim_version": "10.4",
+            "actions": [{"queue": True}],
+        },
+        "more": {"text": "More", "actions": [{"keyboard": "more"}]},
+    },
+    "events": {"new_chat": [{"text": "Welcome"}, {"keyboard": "main"}]},
+    "messages": {"visitor": [{"forward": {"dep_key": "sales"}}, {"close": True}]},
+    "unexpected": [{"text": "Oops"}],
+}
+
+
+def test_resolve():
+    flow = compile_flow(FLOW)
+
+    transition = flow.button("hi")
+    assert [a.kind for a in transition.actions] == [
+        ActionKind.SEND,
+        ActionKind.KEYBOARD,
+    ]
+    assert transition.actions[0].message == {"kind": "operator", "text": "Hello"}
+
+    transition = flow.message("visitor")
+    assert transition.actions[0].forward_info == {"dep_key": "sales"}
+    assert transition.actions[1].kind is ActionKind.CLOSE
+
+    assert flow.button("new").actions[0].forward_info == {}
+    assert flow.event("new_chat").name == "event:new_chat"
+    assert flow.button("unknown") is None
+    assert flow.message("file_visitor") is None
+    assert flow.event("unknown") is None
+
+
+def test_keyboard_webim_version():
+    flow = compile_flow(FLOW)
+    hi = {"id": "hi", "text": "Hi"}
+    new = {"id": "new", "text": "New"}
+    more = {"id": "more", "text": "More"}
+
+    old = flow.keyboard_message("main", parse_version("10.3"))
+    assert old == {"kind": "keyboard", "buttons": [[hi], [more]]}
+
+    recent = flow.keyboard_message("main", parse_version("10.5"))
+    assert recent == {"kind": "keyboard", "buttons": [[hi, new], [more]]}
+
+    unknown = flow.keyboard_message("main", None)
+    assert unknown == old
+    assert flow.keyboard_message("more", None)["buttons"] == [[hi]]
+
+
+def test_reply():
+    flow = compile_flow(FLOW)
+    transition = flow.reply("Answer")
+    assert transition.actions[0].message["text"] == "Answer"
+    assert transition.actions[1].state == "main"
+
+
+def test_expires():
+    flow = compile_flow(
+        {**FLOW, "unexpected": [{"text": "Oops", "expires": 2.5}, {"queue": True}]}
+    )
+    assert [action.expires for action in flow.unexpected.actions] == [2.5, None]
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"start": "missing"},
+        {"states": {"main": {"keyboard": [["missing"]]}}},
+        {"unexpected": [{"keyboard": "missing"}]},
+        {"unexpected": [{"jump": True}]},
+        {"unexpected": [{"text": "a", "close": True}]},
+        {"unexpected": [{"forward": 1}]},
+        {"unexpected": [{"close": True, "expires": 5}]},
+        {"unexpected": [{"text": "a", "expires": 0}]},
+        {"unexpected": [{"text": "a", "expires": "5"}]},
+        {"unexpected": [{"expires": 5}]},
+        {"buttons": {"hi": {"text": "Hi", "min_webim_version": "x.y"}}},
+        {"states": {"main": []}},
+        {"states": []},
+        {"states": {"main": {"keyboard": "hi"}}},
+        {"states": {"main": {"keyboard": ["hi"]}}},
+        {"states": {"main": {"keyboard": [[["hi"]]]}}},
+        {"buttons": {"hi": "Hi"}},
+        {"buttons": {"hi": {"text": "Hi", "actions": {"close": True}}}},
+        {"events": ["new_chat"]},
+        {"events": {"new_chat": {"text": "Hi"}}},
+        {"messages": {"visitor": "Hi"}},
+        {"unexpected": {"text": "Oops"}},
+    ],
+)
+def test_invalid(change):
+    with pytest.raises(FlowError):
+        compile_flow({**FLOW, **change})
+
+
+def make_menu_flow(**menu):
+    departments = [f"dep{number}" for number in range(7)]
+    buttons = {
+        button_id: {"text": f"Department {button_id[3:]}", "actions": []}
+        for button_id in departments
+    }
+    buttons["dep6"]["min_webim_version"] = "10.4"
+    buttons["wide"] = {"text": "W" * 30, "actions": []}
+    states = {
+        **FLOW["states"],
+        "departments": {"menu": departments + ["wide"], **menu},
+    }
+    return compile_flow(
+        {**FLOW, "states": states, "buttons": {**FLOW["buttons"], **buttons}}
+    )
+
+
+def menu_ids(flow, page, version="10.5"):
+    keyboard = flow.keyboard_message("departments", parse_version(version), page)
+    return [[button["id"] for button in row] for row in keyboard["buttons"]]
+
+
+def test_menu_pages():
+    flow = make_menu_flow(per_row=3, row_width=40, rows_per_page=2)
+
+    # В ряду не больше трёх кнопок и не больше 40 символов текста
+    assert menu_ids(flow, 0) == [
+        ["dep0", "dep1", "dep2"],
+        ["dep3", "dep4", "dep5"],
+        ["page:departments:1"],
+    ]
+    assert menu_ids(flow, 1) == [["dep6"], ["wide"], ["page:departments:0"]]
+    # Номер страницы за пределами меню приводится к последней странице
+    assert menu_ids(flow, 5) == menu_ids(flow, 1)
+
+    # Кнопки, недоступные в версии Webim, не занимают места на страницах
+    assert menu_ids(flow, 1, version="10.3") == [["wide"], ["page:departments:0"]]
+
+    transition = flow.button("page:departments:1")
+    assert [(a.kind, a.state, a.page) for a in transition.actions] == [
+        (ActionKind.KEYBOARD, "departments", 1)
+    ]
+    assert flow.button("page:departments:2") is None
+
+
+def test_menu_defaults_and_cache():
+    flow = make_menu_flow(rows_per_page=3, prev_text="Back", next_text="More")
+    version = parse_version("10.5")
+
+    first = flow.keyboard_message("departments", version, 0)
+    # По умолчанию в ряду две кнопки
+    assert [len(row) for row in first["buttons"]] == [2, 2, 2, 1]
+    assert first["buttons"][-1] == [{"id": "page:departments:1", "text": "More"}]
+    assert flow.keyboard_message("departments", version, 0) is first
+
+    last = flow.keyboard_message("departments", version, 1)
+    assert last["buttons"][-1] == [{"id": "page:departments:0", "text": "Back"}]
+
+
+@pytest.mark.parametrize(
+    "menu",
+    [
+        {"menu": ["missing"]},
+        {"menu": "hi"},
+        {"menu": ["hi"], "keyboard": [["hi"]]},
+        {"menu": ["hi"], "per_row": 0},
+        {"menu": ["hi"], "rows_per_page": True},
+    ],
+)
+def test_invalid_menu(menu):
+    with pytest.raises(FlowError):
+        compile_flow({**FLOW, "states": {**FLOW["states"], "menu": menu}})
+
+
+def test_load_flow(tmp_path):
+    path = tmp_path / "flow.json"
+    path.write_text(json.dumps(FLOW), encoding="utf-8")
+    assert load_flow(path).button("hi") is not None
+
+    path.write_text("{", encoding="utf-8")
+    with pytest.raises(FlowError):
+        load_flow(path)
+
+    path.write_text("[]", encoding="utf-8")
+    with pytest.raises(FlowError, match="flow must be an object"):
+        load_flow(path)
+
+    path.write_text(
+        json.dumps({**FLOW, "states": {**FLOW["states"], "m": []}}), encoding="utf-8"
+    )
+    with pytest.raises(FlowError, match="state 'm' must be an object"):
+        load_flow(path)
+
+
+@pytest.mark.parametrize(
+    ("agent_id", "dep_key", "webim_version", "forward_rows"),
+    [
+        (None, None, None, []),
+        (None, None, "10.4", [["forward_to_queue"]]),
+        (1, None, "10.3", [["forward_to_agent"]]),
+        (1, None, "10.4", [["forward_to_agent", "forward_to_queue"]]),
+        (
+            1,
+            "dep",
+            "10.5",
+            [["forward_to_agent", "forward_to_department"], ["forward_to_queue"]],
+        ),
+    ],
+)
+def test_v2_default_keyboard(agent_id, dep_key, webim_version, forward_rows):
+    definition = api_v2.build_default_flow(agent_id, dep_key, None, None)
+    flow = compile_flow(definition)
+    version = parse_version(webim_version) if webim_version else None
+
+    keyboard = flow.keyboard_message(flow.start, version)
+    rows = [[button["id"] for button in row] for row in keyboard["buttons"]]
+    default_rows = [[b["id"] for b in row] for row in api_v2.DEFAULT_KEYBOARD]
+    assert rows == default_rows + forward_rows
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from extbot.limiter import AdaptiveLimiter
+from extbot.metrics import Metrics
+from tests.clock import FakeClock
+
+
+def make_limiter(**kwargs):
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(Metrics(), "demo.webim.ru", clock=clock, **kwargs)
+    return limiter, clock
+
+
+async def run_requests(limiter, clock, count, rtt, overloaded=False):
+    for _ in range(count):
+        await limiter.acquire()
+        clock.now += rtt
+        limiter.release(rtt, overloaded)
+
+
+@pytest.mark.asyncio
+async def test_grows_while_fast_and_used():
+    limiter, clock = make_limiter(initial_limit=2, max_limit=8)
+    await run_requests(limiter, clock, 100, 0.05)
+    # Ограничение растёт, только пока занята хотя бы половина мест
+    assert limiter.limit == 2
+
+    await limiter.acquire()
+    await run_requests(limiter, clock, 100, 0.05)
+    assert limiter.limit == 4
+
+    await limiter.acquire()
+    await limiter.acquire()
+    await run_requests(limiter, clock, 100, 0.05)
+    assert limiter.limit == 8
+
+
+@pytest.mark.asyncio
+async def test_shrinks_on_overload_and_latency():
+    limiter, clock = make_limiter(initial_limit=50)
+    await run_requests(limiter, clock, 1, 0.05)
+
+    await run_requests(limiter, clock, 1, 0.05, overloaded=True)
+    assert limiter.limit == 35
+
+    await run_requests(limiter, clock, 1, 0.5)
+    assert limiter.limit == 24
+
+    await run_requests(limiter, clock, 20, 0.5)
+    assert limiter.limit == 1
+
+
+@pytest.mark.asyncio
+async def test_fast_failure_does_not_set_min_rtt():
+    limiter, clock = make_limiter(initial_limit=50)
+    # Ошибка соединения за миллисекунду до первого настоящего ответа
+    await run_requests(limiter, clock, 1, 0.001, overloaded=True)
+    assert limiter.limit == 35
+
+    # Обычные ответы не считаются медленными, и ограничение не падает
+    await run_requests(limiter, clock, 50, 0.05)
+    assert limiter.limit == 35
+    assert limiter._metrics.get("limiter.demo.webim.ru.decreases") == 1
+
+
+@pytest.mark.asyncio
+async def test_queueing_in_order():
+    metrics = Metrics()
+    limiter = AdaptiveLimiter(metrics, "demo", initial_limit=1)
+    order = []
+
+    async def request(number):
+        await limiter.acquire()
+        order.append(number)
+        await asyncio.sleep(0)
+        limiter.release(0.01)
+
+    await limiter.acquire()
+    tasks = [asyncio.ensure_future(request(number)) for number in range(3)]
+    await asyncio.sleep(0)
+    assert metrics.snapshot()["limiter.demo.queued"] == 3
+
+    tasks[1].cancel()
+    limiter.release(0.01)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert order == [0, 2]
+    assert limiter.inflight == 0
+    assert metrics.get("limiter.demo.queue_delay.count") == 3
+
+
+def test_overloaded():
+    limiter, clock = make_limiter()
+
+    for _ in range(4):
+        limiter._inflight += 1
+        limiter.release(0.05, overloaded=True)
+    assert not limiter.overloaded
+
+    limiter._inflight += 1
+    limiter.release(0.05, overloaded=True)
+    assert limiter.overloaded
+
+    # Без новых запросов Webim снова считается доступным через некоторое время
+    clock.now += 31
+    assert not limiter.overloaded
+
+    clock.now -= 31
+    limiter._inflight += 1
+    limiter.release(0.05)
+    assert not limiter.overloaded
@@ -0,0 +1,34 @@
+import logging
+import tracemalloc
+
+from extbot.memory import MemoryProfiler, count_objects
+from extbot.metrics import Metrics
+
+
+def test_gauges():
+    metrics = Metrics()
+    MemoryProfiler(logging.getLogger(__name__), metrics)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["memory.gc_objects"] > 0
+    assert snapshot["memory.rss_bytes"] > 0
+
+
+def test_count_objects():
+    objects = count_objects(limit=3)
+    assert len(objects) == 3
+    assert all(count > 0 for count in objects.values())
+
+
+def test_snapshot_diff():
+    profiler = MemoryProfiler(logging.getLogger(__name__), Metrics(), True)
+    tracemalloc.start()
+    try:
+        first = profiler.snapshot_diff(limit=5)
+        leak = [bytearray(1024) for _ in range(100)]  # noqa: F841
+        second = profiler.snapshot_diff(limit=5)
+    finally:
+        tracemalloc.stop()
+
+    assert all("size_diff" not in stat for stat in first)
+    assert any(stat["size_diff"] >= 100 * 1024 for stat in second)
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from extbot.models import UpdateError, decode_v1_update, decode_v2_update
+
+
+def encode(update):
+    return json.dumps(update).encode()
+
+
+def test_v1_keyboard_response():
+    update = decode_v1_update(
+        encode(
+            {
+                "event": "new_message",
+                "chat": {"id": "chat"},
+                "kind": "keyboard_response",
+                "response": {"button": {"id": "say_hi", "text": "Say hi"}},
+            }
+        )
+    )
+
+    assert update.event == "new_message"
+    assert update.chat_id == "chat"
+    assert update.message.kind == "keyboard_response"
+    assert update.message.button_id == "say_hi"
+    assert update.raw["response"]["button"]["text"] == "Say hi"
+
+
+def test_v2_updates():
+    new_chat = decode_v2_update(
+        encode({"event": "new_chat", "chat": {"id": 1}, "visitor": {"id": "v"}})
+    )
+    assert (new_chat.event, new_chat.chat_id, new_chat.visitor_id) == (
+        "new_chat",
+        1,
+        "v",
+    )
+
+    file_data = {"url": "https://example.com/f.png", "name": "f.png"}
+    new_message = decode_v2_update(
+        encode(
+            {
+                "event": "new_message",
+                "chat_id": "chat",
+                "message": {"kind": "file_visitor", "data": file_data},
+            }
+        )
+    )
+    assert new_message.chat_id == "chat"
+    assert new_message.message.file_data == file_data
+
+    other = decode_v2_update(encode({"event": "chat_closed", "chat_id": "chat"}))
+    assert (other.event, other.chat_id, other.message) == ("chat_closed", "chat", None)
+
+
+@pytest.mark.parametrize(
+    "body, error",
+    [
+        (b"{", "invalid JSON"),
+        (b"[]", "update must be an object"),
+        (b"{}", "update.event is required"),
+        (encode({"event": "new_chat"}), "update.chat is required"),
+        (encode({"event": "new_chat", "chat": []}), "update.chat must be an object"),
+        (
+            encode({"event": "new_message", "chat_id": True, "message": {}}),
+            "update.chat_id must be a string or a number",
+        ),
+        (
+            encode({"event": "new_message", "chat_id": "c", "message": {}}),
+            "update.message.kind is required",
+        ),
+        (
+            encode(
+                {
+                    "event": "new_message",
+                    "chat_id": "c",
+                    "message": {"kind": "keyboard_response", "data": {}},
+                }
+            ),
+            "update.message.data.button is required",
+        ),
+        (
+            encode(
+                {
+                    "event": "new_message",
+                    "chat_id": "c",
+                    "message": {"kind": "file_visitor"},
+                }
+            ),
+            "update.message.data is required",
+        ),
+    ],
+)
+def test_v2_invalid(body, error):
+    with pytest.raises(UpdateError, match=error):
+        decode_v2_update(body)
@@ -0,0 +1,88 @@
+import logging
+import os
+
+import pytest
+from aiohttp import web
+
+from extbot.api_v1 import ApiV1Sample
+from extbot.metrics import Metrics
+from extbot.offload import ProcessOffload
+
+PRELOADED = None
+
+
+def preload():
+    global PRELOADED
+    PRELOADED = "preloaded"
+
+
+def answer(message):
+    text = message["text"]
+    if text == "pid":
+        return str(os.getpid())
+    if text == "preloaded":
+        return PRELOADED
+    if text == "loop":
+        while True:
+            pass
+    if text == "error":
+        raise RuntimeError("hook error")
+    return None
+
+
+def get_logger():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+async def make_offload():
+    offload = ProcessOffload(
+        get_logger(),
+        Metrics(),
+        f"{__name__}:answer",
+        f"{__name__}:preload",
+        workers=1,
+        timeout=0.2,
+    )
+    await offload.startup()
+    return offload
+
+
+@pytest.mark.asyncio
+async def test_offload():
+    offload = await make_offload()
+    try:
+        pid = await offload.run(dict(chat_id="chat", text="pid"))
+        assert pid is not None and int(pid) != os.getpid()
+        assert await offload.run(dict(chat_id="chat", text="preloaded")) == "preloaded"
+
+        assert await offload.run(dict(chat_id="chat", text="loop")) is None
+        assert await offload.run(dict(chat_id="chat", text="error")) is None
+        # После прерванного вызова процесс пула продолжает работать
+        assert await offload.run(dict(chat_id="chat", text="pid")) == pid
+    finally:
+        await offload.cleanup()
+
+    metrics = offload._metrics.snapshot()
+    assert metrics["offload.timeouts"] == 1
+    assert metrics["offload.errors"] == 1
+    assert metrics["offload.time.count"] == 3
+    assert metrics["offload.latency.count"] == 5
+    assert metrics["offload.pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_v1_offload_reply(aiohttp_client):
+    offload = await make_offload()
+    bot = ApiV1Sample(get_logger(), None, None, offload=offload)
+    app = web.Application()
+    app.router.add_post("/", bot.webhook)
+    app.on_cleanup.append(offload.cleanup)
+    client = await aiohttp_client(app)
+
+    for text, answered in [("preloaded", True), ("other", False)]:
+        update = dict(event="new_message", chat=dict(id="chat"), kind="visitor")
+        resp = await client.post("/", json=dict(update, text=text))
+        body = await resp.json()
+        assert (body["messages"][0]["text"] == "preloaded") is answered
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+import pytest
+
+from extbot.metrics import Metrics
+from extbot.outbox import Outbox, coalesce
+
+
+def text(value):
+    return dict(kind="operator", text=value)
+
+
+def keyboard(value):
+    return dict(kind="keyboard", buttons=[[dict(id=value, text=value)]])
+
+
+def get_logger():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+def test_coalesce():
+    messages = [
+        text("Hi"),
+        keyboard("a"),
+        text("Hi"),
+        keyboard("b"),
+        text("Bye"),
+        text("Hi"),
+        keyboard("c"),
+    ]
+    assert coalesce(messages) == [0, 4, 5, 6]
+    assert coalesce([text("Hi"), text("Hi"), keyboard("a")]) == [0, 2]
+    assert coalesce([]) == []
+
+
+@pytest.mark.asyncio
+async def test_outbox():
+    sent = []
+
+    async def send(chat_id, message, deadline):
+        await asyncio.sleep(0.01)
+        sent.append((chat_id, message, deadline))
+        return dict(result="ok")
+
+    metrics = Metrics()
+    outbox = Outbox(get_logger(), metrics, send, linger=0.05)
+
+    first = [outbox.send("chat", text("Hi"), 1), outbox.send("chat", keyboard("a"))]
+    other = outbox.send("other", keyboard("x"))
+    await asyncio.sleep(0.01)
+    second = [outbox.send("chat", text("Hi")), outbox.send("chat", keyboard("b"))]
+    assert sent == []
+
+    results = await asyncio.gather(*first, *second, other)
+    ok = dict(result="ok")
+    assert results == [ok, None, None, ok, ok]
+    assert sorted(sent, key=lambda item: item[0]) == [
+        ("chat", text("Hi"), 1),
+        ("chat", keyboard("b"), None),
+        ("other", keyboard("x"), None),
+    ]
+    assert metrics.get("outbox.saved") == 2
+    assert metrics.get("outbox.sent") == 3
+
+    # Сообщения, добавленные во время отправки пачки, уходят после неё
+    outbox.send("chat", text("One"))
+    flushing = asyncio.ensure_future(outbox.flush("chat"))
+    await asyncio.sleep(0)
+    outbox.send("chat", text("Two"))
+    await outbox.flush("chat")
+    await flushing
+    assert [message["text"] for _, message, _ in sent[3:]] == ["One", "Two"]
+    assert metrics.snapshot()["outbox.chats"] == 0
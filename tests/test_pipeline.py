@@ -0,0 +1,86 @@
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.api_v1 import ApiV1Sample
+from extbot.metrics import Metrics
+from extbot.pipeline import Pipeline, UpdateContext
+from tests.clock import FakeClock
+
+
+@pytest.mark.asyncio
+async def test_pipeline():
+    clock = FakeClock()
+    calls = []
+
+    def stage(name, duration, stop=False):
+        async def run(context, call_next):
+            calls.append(name)
+            clock.now += duration
+            if stop:
+                return name
+            result = await call_next(context)
+            clock.now += duration
+            return result
+
+        return run
+
+    metrics = Metrics()
+    pipeline = Pipeline(
+        metrics,
+        "test",
+        [
+            ("first", stage("first", 1)),
+            ("disabled", None),
+            ("second", stage("second", 10)),
+            ("last", stage("last", 100, stop=True)),
+        ],
+        clock=clock,
+    )
+    assert list(pipeline.timers) == ["first", "second", "last"]
+
+    assert await pipeline.run(UpdateContext(None)) == "last"
+    assert await pipeline.run(UpdateContext(None)) == "last"
+    assert calls == ["first", "second", "last"] * 2
+
+    snapshot = metrics.snapshot()
+    assert "pipeline.test.disabled.count" not in snapshot
+    assert snapshot["pipeline.test.first.count"] == 2
+    assert snapshot["pipeline.test.first.total"] == 4
+    assert snapshot["pipeline.test.second.total"] == 40
+    assert snapshot["pipeline.test.last.total"] == 200
+
+    with pytest.raises(ValueError):
+        Pipeline(metrics, "test", [("same", stage("a", 0)), ("same", stage("b", 0))])
+
+
+@pytest.mark.asyncio
+async def test_v1_middleware(aiohttp_client):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+
+    async def skip_closed(context, call_next):
+        if context.update.event == "chat_closed":
+            return web.json_response(dict(skipped=True))
+        return await call_next(context)
+
+    metrics = Metrics()
+    bot = ApiV1Sample(
+        logger, None, None, metrics=metrics, middlewares=[("skip", skip_closed)]
+    )
+    app = web.Application()
+    app.router.add_post("/", bot.webhook)
+    client = await aiohttp_client(app)
+
+    resp = await client.post("/", json=dict(event="chat_closed", chat=dict(id="c")))
+    assert await resp.json() == dict(skipped=True)
+    resp = await client.post("/", json=dict(event="new_chat", chat=dict(id="c")))
+    assert (await resp.json())["has_answer"] is True
+    resp = await client.post("/", data=b"not json")
+    assert resp.status == 400
+
+    snapshot = metrics.snapshot()
+    assert snapshot["pipeline.v1.decode.count"] == 3
+    assert snapshot["pipeline.v1.skip.count"] == 2
+    assert snapshot["pipeline.v1.send.count"] == 1
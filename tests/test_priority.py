@@ -0,0 +1,269 @@
+import asyncio
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.admin import AdminApi
+from extbot.metrics import Metrics
+from extbot.priority import (
+    GREETING,
+    REPLY,
+    URGENT,
+    PriorityWorkQueue,
+    QueueFullError,
+    job_stage,
+)
+from tests.clock import FakeClock
+
+
+def make_queue(**kwargs):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    clock = FakeClock()
+    metrics = Metrics()
+    return PriorityWorkQueue(logger, metrics, clock=clock, **kwargs), clock, metrics
+
+
+async def record(order, name, gate=None):
+    if gate is not None:
+        await gate.wait()
+    order.append(name)
+
+
+@pytest.mark.asyncio
+async def test_order_by_class():
+    queue, _, metrics = make_queue(concurrency=1)
+    gate = asyncio.Event()
+    order = []
+
+    queue.submit(REPLY, record(order, "blocker", gate))
+    queue.submit(GREETING, record(order, "greeting"))
+    queue.submit(REPLY, record(order, "reply"))
+    queue.submit(URGENT, record(order, "urgent"))
+    assert queue.pending_count == 3
+    assert metrics.snapshot()["queue.greeting.depth"] == 1
+
+    gate.set()
+    while len(order) < 4:
+        await asyncio.sleep(0)
+
+    assert order == ["blocker", "urgent", "reply", "greeting"]
+    assert metrics.get("queue.urgent.wait.count") == 1
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_custom_order():
+    queue, _, _ = make_queue(concurrency=1, order=(GREETING, URGENT, REPLY))
+    gate = asyncio.Event()
+    order = []
+
+    queue.submit(REPLY, record(order, "blocker", gate))
+    queue.submit(URGENT, record(order, "urgent"))
+    queue.submit(GREETING, record(order, "greeting"))
+
+    gate.set()
+    while len(order) < 3:
+        await asyncio.sleep(0)
+
+    assert order == ["blocker", "greeting", "urgent"]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_starvation_protection():
+    queue, clock, metrics = make_queue(concurrency=1, max_wait=5)
+    gate = asyncio.Event()
+    order = []
+
+    queue.submit(REPLY, record(order, "blocker", gate))
+    queue.submit(GREETING, record(order, "old greeting"))
+    clock.now = 10
+    queue.submit(URGENT, record(order, "urgent"))
+
+    gate.set()
+    while len(order) < 3:
+        await asyncio.sleep(0)
+
+    assert order == ["blocker", "old greeting", "urgent"]
+    assert metrics.get("queue.greeting.starved") == 1
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_jobs():
+    queue, _, _ = make_queue(concurrency=1)
+    gate = asyncio.Event()
+    order = []
+
+    queue.submit(REPLY, record(order, "blocked", gate))
+    queue.submit(REPLY, record(order, "pending"))
+    await asyncio.sleep(0)
+    await queue.close()
+
+    assert order == []
+    assert len(queue) == 0
+    with pytest.raises(RuntimeError):
+        queue.submit(REPLY, record(order, "late"))
+
+
+@pytest.mark.asyncio
+async def test_max_pending():
+    queue, _, metrics = make_queue(concurrency=1, max_pending=2)
+    gate = asyncio.Event()
+    order = []
+
+    queue.submit(REPLY, record(order, "blocker", gate))
+    queue.submit(REPLY, record(order, "first"))
+    queue.submit(GREETING, record(order, "second"))
+    with pytest.raises(QueueFullError):
+        queue.submit(URGENT, record(order, "rejected"))
+    assert queue.pending_count == 2
+    assert metrics.get("queue.urgent.rejected") == 1
+
+    gate.set()
+    while len(order) < 3:
+        await asyncio.sleep(0)
+
+    # Когда очередь разобрана, обновления снова принимаются
+    queue.submit(URGENT, record(order, "accepted"))
+    while len(order) < 4:
+        await asyncio.sleep(0)
+    assert order == ["blocker", "first", "second", "accepted"]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_jobs_and_stages():
+    queue, clock, _ = make_queue(concurrency=1)
+    gate = asyncio.Event()
+
+    async def handle():
+        with job_stage("make_request send_message"):
+            await gate.wait()
+
+    active = queue.submit(REPLY, handle(), chat_id="chat-1", event="new_message")
+    pending = queue.submit(GREETING, handle(), chat_id="chat-2", event="new_chat")
+    await asyncio.sleep(0)
+    clock.now = 2
+
+    jobs = [job.to_json() for job in queue.jobs()]
+    assert jobs == [
+        dict(
+            id=active.id,
+            priority=REPLY,
+            chat_id="chat-1",
+            event="new_message",
+            active=True,
+            age=2,
+            stage="make_request send_message",
+            stage_age=2,
+        ),
+        dict(
+            id=pending.id,
+            priority=GREETING,
+            chat_id="chat-2",
+            event="new_chat",
+            active=False,
+            age=2,
+            stage="queued",
+            stage_age=2,
+        ),
+    ]
+
+    # Вне задания этап никуда не записывается
+    with job_stage("ignored"):
+        pass
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_cancel_jobs():
+    queue, _, metrics = make_queue(concurrency=1)
+    gate = asyncio.Event()
+    order = []
+
+    first = queue.submit(REPLY, record(order, "first", gate), chat_id="chat-1")
+    queue.submit(REPLY, record(order, "second", gate), chat_id="chat-2")
+    queue.submit(REPLY, record(order, "third"), chat_id="chat-2")
+    await asyncio.sleep(0)
+
+    assert [job.chat_id for job in queue.cancel_chat("chat-2")] == ["chat-2"] * 2
+    assert queue.cancel(first.id) is first
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert queue.cancel(first.id) is None
+    assert queue.jobs() == []
+    assert order == []
+    assert metrics.get("queue.cancelled") == 3
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_watchdog():
+    queue, clock, metrics = make_queue(job_timeout=10)
+    stuck = queue.submit(REPLY, asyncio.sleep(3600), chat_id="chat-1")
+    queue.submit(REPLY, asyncio.sleep(3600), chat_id="chat-2")
+    clock.now = 5
+    queue.submit(REPLY, asyncio.sleep(3600), chat_id="chat-3")
+    await asyncio.sleep(0)
+
+    clock.now = 12
+    assert len(queue.check_stuck()) == 2
+    assert metrics.get("queue.stuck") == 2
+    assert not stuck.task.done()
+
+    # Задание считается зависшим один раз
+    queue.check_stuck()
+    assert metrics.get("queue.stuck") == 2
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_watchdog_cancels_stuck_jobs():
+    queue, clock, _ = make_queue(job_timeout=10, cancel_stuck=True)
+    stuck = queue.submit(REPLY, asyncio.sleep(3600), chat_id="chat-1")
+    await asyncio.sleep(0)
+
+    clock.now = 11
+    queue.check_stuck()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert stuck.task.cancelled()
+    assert len(queue) == 0
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_admin_routes(aiohttp_client):
+    queue, _, metrics = make_queue(concurrency=1)
+    admin = AdminApi(logging.getLogger(__name__), "token", metrics)
+    queue.register_admin_routes(admin)
+    app = web.Application()
+    app.add_routes(admin.get_routes())
+    client = await aiohttp_client(app)
+    headers = {"Authorization": "Token token"}
+
+    first = queue.submit(REPLY, asyncio.sleep(3600), chat_id="chat-1")
+    queue.submit(REPLY, asyncio.sleep(3600), chat_id="chat-2")
+    queue.submit(REPLY, asyncio.sleep(3600), chat_id=123)
+
+    resp = await client.get("/admin/jobs", headers=headers)
+    body = await resp.json()
+    assert (body["active"], body["pending"]) == (1, 2)
+    assert [job["chat_id"] for job in body["jobs"]] == ["chat-1", "chat-2", 123]
+
+    resp = await client.post("/admin/jobs/cancel?chat_id=chat-2", headers=headers)
+    assert await resp.json() == {"cancelled": [first.id + 1]}
+    # Числовой id чата из обновления находится по id из строки запроса
+    resp = await client.post("/admin/jobs/cancel?chat_id=123", headers=headers)
+    assert await resp.json() == {"cancelled": [first.id + 2]}
+    resp = await client.post(f"/admin/jobs/{first.id}/cancel", headers=headers)
+    assert (await resp.json())["id"] == first.id
+    resp = await client.post("/admin/jobs/100/cancel", headers=headers)
+    assert resp.status == 404
+    resp = await client.post("/admin/jobs/cancel", headers=headers)
+    assert resp.status == 400
+    await queue.close()
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+from unittest.mock import Mock
+
+import pytest
+from aiohttp import web
+
+from extbot.api_v1 import ApiV1Sample
+from extbot.cluster import FORWARDED_HEADER
+from extbot.metrics import Metrics
+from extbot.recorder import (
+    TrafficRecorder,
+    compare,
+    read_capture,
+    replay,
+    scrub,
+    summarize,
+)
+from extbot.router import ApiVersionRouter
+
+HEADERS = {
+    "X-Bot-API-Dialect": "Webim Standard",
+    "X-Bot-API-Version": "1.0",
+    "X-Webim-Version": "10.5.62",
+    "Authorization": "Token secret",
+}
+UPDATE = dict(
+    event="new_message",
+    chat=dict(id="chat-1"),
+    kind="visitor",
+    text="My phone is 555-12-34",
+    visitor=dict(id="visitor-1", fields=dict(name="Ivan", phone="5551234")),
+)
+
+
+def get_logger():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return logger
+
+
+def test_scrub():
+    assert scrub(UPDATE) == dict(
+        event="new_message",
+        chat=dict(id="chat-1"),
+        kind="visitor",
+        text="***",
+        visitor=dict(id="visitor-1", fields=dict(name="***", phone="***")),
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scrub_pii", [False, True])
+async def test_record_webhook(aiohttp_client, tmp_path, scrub_pii):
+    v1_bot = Mock(spec=ApiV1Sample)
+    v1_bot.webhook.side_effect = lambda request: web.json_response(dict(result="ok"))
+    recorder = TrafficRecorder(get_logger(), Metrics(), tmp_path, scrub_pii=scrub_pii)
+    router = ApiVersionRouter(get_logger(), v1_bot, recorder=recorder)
+    app = web.Application()
+    app.add_routes(router.get_routes())
+    client = await aiohttp_client(app)
+    await recorder.startup()
+
+    resp = await client.post("/", json=UPDATE, headers=HEADERS)
+    assert resp.status == 200
+    headers = dict(HEADERS, **{FORWARDED_HEADER: "1"})
+    await client.post("/v1", json=UPDATE, headers=headers)
+    await recorder.cleanup()
+
+    records = list(read_capture(tmp_path))
+    assert len(records) == 1
+    record = records[0]
+    assert record["path"] == "/"
+    assert "Authorization" not in record["headers"]
+    assert record["headers"]["X-Bot-API-Version"] == "1.0"
+    assert json.loads(record["body"]) == (scrub(UPDATE) if scrub_pii else UPDATE)
+    assert v1_bot.webhook.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_rotation(tmp_path):
+    (tmp_path / "traffic-000007.jsonl").write_text("")
+    recorder = TrafficRecorder(
+        get_logger(), Metrics(), tmp_path, max_size=300, max_files=2
+    )
+    await recorder.startup()
+    for _ in range(5):
+        recorder.record("/v2", {}, json.dumps(UPDATE).encode())
+    await recorder.cleanup()
+
+    paths = sorted(path.name for path in tmp_path.iterdir())
+    assert paths == ["traffic-000011.jsonl", "traffic-000012.jsonl"]
+    assert len(list(read_capture(tmp_path))) == 2
+
+
+@pytest.mark.asyncio
+async def test_replay(aiohttp_client):
+    received = []
+
+    async def handler(request):
+        received.append((request.path, await request.json(), request.headers))
+        status = 400 if request.path == "/v1" else 200
+        return web.json_response(dict(result="ok"), status=status)
+
+    app = web.Application()
+    app.add_routes([web.post("/v1", handler), web.post("/v2", handler)])
+    client = await aiohttp_client(app)
+
+    records = [
+        dict(time=100.0, path="/v2", headers={}, body=json.dumps(UPDATE)),
+        dict(time=100.5, path="/v2", headers={"X-Bot-API-Version": "2.0"}, body="{}"),
+        dict(time=101.0, path="/v1", headers={}, body="{}"),
+    ]
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    url = str(client.server.make_url("/"))
+    results = await replay(client.session, url, records, speed=10)
+
+    # Запись длится секунду, при ускорении в 10 раз — 0,1 секунды
+    assert loop.time() - started >= 0.1
+    assert [path for path, _, _ in received] == ["/v2", "/v2", "/v1"]
+    assert received[0][1] == UPDATE
+    assert received[1][2]["X-Bot-API-Version"] == "2.0"
+    assert sorted(status for _, status in results) == [200, 200, 400]
+
+    summary = summarize(results, 0.1)
+    assert (summary["requests"], summary["errors"]) == (3, 1)
+    baseline = dict(summary, errors=0, p50_ms=summary["p50_ms"] + 1)
+    delta = compare(summary, baseline)
+    assert delta["errors"] == 1
+    assert delta["p50_ms"] == -1
+    assert "requests" not in delta
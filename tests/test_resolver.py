@@ -0,0 +1,56 @@
+import logging
+
+import pytest
+
+from extbot.faq import FaqIndex
+from extbot.flow import compile_flow
+from extbot.models import Message
+from extbot.resolver import MessageResolver
+
+FLOW = {
+    "start": "main",
+    "states": {"main": {"keyboard": [["hi"]]}},
+    "buttons": {"hi": {"text": "Hi", "actions": [{"text": "Hello"}]}},
+    "messages": {"visitor": [{"text": "Use buttons"}]},
+    "unexpected": [{"text": "Oops"}],
+}
+FAQ = [{"questions": ["How can I pay?"], "answer": "By card"}]
+
+
+class FakeAnalytics:
+    def __init__(self):
+        self.calls = []
+
+    def new_message(self, chat_id):
+        self.calls.append(("new_message", chat_id))
+
+    def button_click(self, button_id):
+        self.calls.append(("button_click", button_id))
+
+
+def texts(transition):
+    return [action.message["text"] for action in transition.actions if action.message]
+
+
+@pytest.mark.asyncio
+async def test_resolve():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    analytics = FakeAnalytics()
+    resolver = MessageResolver(
+        logger, compile_flow(FLOW), faq=FaqIndex(FAQ), analytics=analytics
+    )
+
+    button = Message("keyboard_response", button_id="hi")
+    assert texts(await resolver.resolve("c", button)) == ["Hello"]
+    unknown = Message("keyboard_response", button_id="unknown")
+    assert await resolver.resolve("c", unknown) is None
+    question = Message("visitor", text="how to pay")
+    assert texts(await resolver.resolve("c", question)) == ["By card"]
+    other = Message("visitor", text="weather")
+    assert texts(await resolver.resolve("c", other)) == ["Use buttons"]
+    assert await resolver.resolve("c", Message("file_visitor")) is None
+
+    assert analytics.calls.count(("new_message", "c")) == 5
+    assert ("button_click", "hi") in analytics.calls
+    assert ("button_click", "unknown") not in analytics.calls
@@ -8,14 +8,17 @@ from aiohttp.test_utils import TestClient
 
 from extbot.api_v1 import ApiV1Sample
 from extbot.api_v2 import ApiV2Sample
+from extbot.health import LoopLagMonitor
+from extbot.metrics import Metrics
 from extbot.router import ApiVersionRouter
+from tests.clock import FakeClock
 
 
-def make_test_app(v1_bot, v2_bot):
+def make_test_app(v1_bot, v2_bot, loop_monitor=None):
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.CRITICAL)
 
-    router = ApiVersionRouter(logger, v1_bot, v2_bot)
+    router = ApiVersionRouter(logger, v1_bot, v2_bot, loop_monitor=loop_monitor)
     routes = router.get_routes()
 
     app = web.Application()
@@ -115,3 +118,55 @@ async def test_route_v2_when_v2_not_configured(aiohttp_client):
 
     assert resp.status == 404
     v1_bot_mock.webhook.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_readyz(mocked_router_setup: MockedRouterSetup):
+    readiness = dict(
+        warm_connections=True, webim_available=False, queue_below_high_water=True
+    )
+    mocked_router_setup.v2_bot_mock.readiness.return_value = readiness
+    resp = await mocked_router_setup.client.get("/readyz")
+    assert resp.status == 503
+    assert (await resp.json())["checks"] == dict(api_v2=True, **readiness)
+
+    readiness["webim_available"] = True
+    resp = await mocked_router_setup.client.get("/readyz")
+    assert resp.status == 200
+    mocked_router_setup.v1_bot_mock.webhook.assert_not_called()
+    mocked_router_setup.v2_bot_mock.webhook.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_readyz_without_v2(aiohttp_client):
+    client = await aiohttp_client(make_test_app(Mock(spec=ApiV1Sample), None))
+    resp = await client.get("/readyz")
+    assert resp.status == 200
+    assert await resp.json() == dict(status="ok", checks=dict(api_v2=False))
+
+
+@pytest.mark.asyncio
+async def test_healthz(aiohttp_client):
+    clock = FakeClock()
+    monitor = LoopLagMonitor(Metrics(), threshold=1.0, interval=0.5, clock=clock)
+    app = make_test_app(Mock(spec=ApiV1Sample), None, monitor)
+    client = await aiohttp_client(app)
+
+    resp = await client.get("/healthz")
+    assert resp.status == 200
+
+    clock.now = 0.7
+    monitor.tick(0.5)
+    resp = await client.get("/healthz")
+    assert await resp.json() == dict(status="ok", loop_lag=0.2)
+
+    clock.now = 2.0
+    monitor.tick(0.9)
+    resp = await client.get("/healthz")
+    assert resp.status == 503
+
+    # Монитор давно не просыпался: цикл событий был заблокирован
+    monitor.tick(2.0)
+    clock.now = 3.6
+    resp = await client.get("/healthz")
+    assert resp.status == 503
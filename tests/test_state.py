@@ -0,0 +1,138 @@
+import asyncio
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from extbot import state as state_module
+from extbot.state import (
+    MemoryStateBackend,
+    SqliteStateBackend,
+    StateBackend,
+    open_state_backend,
+)
+from tests.clock import FakeClock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryStateBackend()
+    else:
+        backend = SqliteStateBackend(str(tmp_path / "state.db"))
+    yield backend
+    asyncio.run(backend.close())
+
+
+@pytest.mark.asyncio
+async def test_get_set(backend):
+    assert await backend.get("missing") is None
+
+    await backend.set("chat", {"state": "main"})
+    await backend.set("other", [1, 2])
+    assert await backend.get("chat") == {"state": "main"}
+    assert await backend.get_many(["chat", "other", "missing"]) == {
+        "chat": {"state": "main"},
+        "other": [1, 2],
+        "missing": None,
+    }
+
+    await backend.delete("chat")
+    assert await backend.get("chat") is None
+
+
+@pytest.mark.asyncio
+async def test_incr_and_ttl(backend, monkeypatch):
+    fake_time = FakeClock(1000.0)
+    monkeypatch.setattr(state_module, "time", fake_time)
+
+    assert await backend.incr("window", ttl=10) == 1
+    fake_time.now += 5
+    assert await backend.incr("window", 2, ttl=10) == 3
+
+    # Срок жизни не продлевается при увеличении счётчика
+    fake_time.now += 5
+    assert await backend.get("window") is None
+    assert await backend.incr("window", ttl=10) == 1
+
+    await backend.purge_expired()
+    fake_time.now += 10
+    await backend.purge_expired()
+    assert await backend.get_many(["window"]) == {"window": None}
+
+
+@pytest.mark.asyncio
+async def test_compare_and_set(backend):
+    assert await backend.compare_and_set("lock", None, "worker-1")
+    assert not await backend.compare_and_set("lock", None, "worker-2")
+    assert not await backend.compare_and_set("lock", "worker-2", "worker-3")
+    assert await backend.compare_and_set("lock", "worker-1", "worker-2")
+    assert await backend.get("lock") == "worker-2"
+
+
+@pytest.mark.asyncio
+async def test_sqlite_lock_does_not_block_loop(tmp_path):
+    path = str(tmp_path / "state.db")
+    backend = SqliteStateBackend(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    # Пока другой процесс держит блокировку записи, event loop продолжает работать
+    task = asyncio.ensure_future(backend.incr("counter"))
+    ticks = 0
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+        ticks += 1
+    assert not task.done()
+
+    other.execute("COMMIT")
+    other.close()
+    assert await task == 1
+    assert ticks == 10
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_purge_periodically():
+    backend = MemoryStateBackend()
+    backend.purge_interval = 0.01
+    await backend.startup()
+    await backend.set("window", 1, ttl=0.01)
+    await backend.set("chat", 2)
+    await asyncio.sleep(0.05)
+    await backend.cleanup()
+
+    assert len(backend) == 1
+
+
+def test_abstract_backend():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def _increment(path, count):
+    backend = SqliteStateBackend(path)
+    for _ in range(count):
+        asyncio.run(backend.incr("counter"))
+
+
+def test_sqlite_incr_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    SqliteStateBackend(path)
+    processes = [
+        multiprocessing.Process(target=_increment, args=(path, 100)) for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert asyncio.run(SqliteStateBackend(path).get("counter")) == 400
+
+
+def test_open_state_backend(tmp_path):
+    assert isinstance(open_state_backend("memory"), MemoryStateBackend)
+    path = tmp_path / "state.db"
+    assert isinstance(open_state_backend(f"sqlite:{path}"), SqliteStateBackend)
+    with pytest.raises(ValueError):
+        open_state_backend("redis://localhost")
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import math
+
+import pytest
+
+from extbot import timers
+from extbot.metrics import Metrics
+from extbot.timers import SLOT_BITS, TimingWheel
+from tests.clock import FakeClock
+
+
+def make_wheel(clock=None, metrics=None, tick=1.0):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return TimingWheel(logger, metrics or Metrics(), tick, clock or FakeClock(1000.0))
+
+
+def advance_to(wheel, clock, now):
+    fired = []
+    while clock.now < now:
+        clock.now = min(clock.now + 7.0, now)
+        fired += [(timer.key, clock.now) for timer in wheel.advance()]
+    return fired
+
+
+@pytest.mark.parametrize("delay", [0, 1, 5, 63, 64, 100, 4095, 4096, 300_000])
+def test_fires_on_time(delay):
+    clock = FakeClock(1000.0)
+    wheel = make_wheel(clock)
+    wheel.schedule("chat", delay, None)
+
+    clock.now += max(delay - 1, 0)
+    assert delay < 2 or wheel.advance() == []
+
+    fired = advance_to(wheel, clock, clock.now + 10)
+    assert len(fired) == 1
+    assert len(wheel) == 0
+
+
+@pytest.mark.parametrize("offset", [0, 10.3])
+@pytest.mark.parametrize(
+    "delay", [1, 63.5, 64, 64.5, 128, 4095.5, 4096, 4096.25, 262_144]
+)
+def test_fires_within_tick(offset, delay):
+    clock = FakeClock(1000.0)
+    wheel = make_wheel(clock)
+    clock.now += offset
+    wheel.advance()
+    deadline = clock.now + delay
+    wheel.schedule("chat", delay, None)
+
+    # Колесо просыпается в начале каждого такта
+    fired = []
+    while not fired:
+        clock.now = wheel._epoch + math.floor(clock.now - wheel._epoch) + 1
+        fired = wheel.advance()
+    # На границах ячеек верхних уровней таймер тоже не опаздывает больше чем на такт
+    assert deadline <= clock.now < deadline + 1
+
+
+def test_beyond_wheel_range(monkeypatch):
+    monkeypatch.setattr(timers, "LEVELS", 2)
+    clock = FakeClock(1000.0)
+    wheel = make_wheel(clock)
+    delay = (1 << (SLOT_BITS * 2)) * 3 + 1000
+    wheel.schedule("chat", delay, None)
+
+    assert advance_to(wheel, clock, clock.now + delay - 2) == []
+    assert len(advance_to(wheel, clock, clock.now + 3)) == 1
+
+
+def test_reset_and_cancel():
+    clock = FakeClock(1000.0)
+    wheel = make_wheel(clock)
+    start = clock.now
+    for number in range(100):
+        wheel.schedule(number, 10 + number, None)
+    wheel.schedule(5, 200, None)
+    assert wheel.cancel(7)
+    assert not wheel.cancel(7)
+    assert len(wheel) == 99
+
+    fired = advance_to(wheel, clock, start + 300)
+    keys = [key for key, _ in fired]
+    assert sorted(keys) == [n for n in range(100) if n != 7]
+    assert dict(fired)[5] >= start + 200
+    assert 7 not in wheel
+
+
+@pytest.mark.asyncio
+async def test_run_calls_callbacks():
+    metrics = Metrics()
+    wheel = make_wheel(
+        clock=asyncio.get_running_loop().time, metrics=metrics, tick=0.01
+    )
+    fired = asyncio.Event()
+    keys = []
+
+    async def callback(key):
+        keys.append(key)
+        fired.set()
+
+    wheel.start()
+    try:
+        wheel.schedule("async", 0.02, callback)
+        wheel.schedule("sync", 0.02, keys.append)
+        await asyncio.wait_for(fired.wait(), 1)
+        await asyncio.sleep(0.02)
+    finally:
+        await wheel.close()
+
+    assert sorted(keys) == ["async", "sync"]
+    snapshot = metrics.snapshot()
+    assert snapshot["timers.fired"] == 2
+    assert snapshot["timers.active"] == 0
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+
+import pytest
+
+from extbot.metrics import Metrics
+from extbot.transcript import (
+    INBOUND,
+    OUTBOUND,
+    TranscriptLog,
+    TranscriptReader,
+    main,
+)
+
+
+def make_log(directory, **kwargs):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    return TranscriptLog(logger, Metrics(), directory, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_read_chat(tmp_path):
+    log = make_log(tmp_path, segment_size=300)
+    log.open()
+    for number in range(10):
+        log.append("chat-1", INBOUND, dict(number=number))
+        log.append("chat-2", OUTBOUND, dict(number=number, text="Привет"))
+    await log.flush()
+
+    assert len(list(tmp_path.glob("*.jsonl"))) > 1
+
+    reader = TranscriptReader(tmp_path)
+    records = list(reader.read_chat("chat-2"))
+    assert [r["data"]["number"] for r in records] == list(range(10))
+    assert all(r["direction"] == OUTBOUND for r in records)
+    assert records[0]["data"]["text"] == "Привет"
+    assert len(list(reader.read_chat("chat-1"))) == 10
+    assert list(reader.read_chat("chat-3")) == []
+
+
+@pytest.mark.asyncio
+async def test_not_visible_before_flush(tmp_path):
+    log = make_log(tmp_path)
+    log.open()
+    log.append("chat", INBOUND, {})
+
+    reader = TranscriptReader(tmp_path)
+    assert list(reader.read_chat("chat")) == []
+
+    await log.close()
+    assert len(list(reader.read_chat("chat"))) == 1
+
+
+@pytest.mark.asyncio
+async def test_new_segment_per_run(tmp_path):
+    for run in range(2):
+        log = make_log(tmp_path)
+        log.open()
+        log.append("chat", INBOUND, dict(run=run))
+        await log.close()
+
+    assert sorted(p.name for p in tmp_path.glob("*.jsonl")) == [
+        "00000001.jsonl",
+        "00000002.jsonl",
+    ]
+    records = TranscriptReader(tmp_path).read_chat("chat")
+    assert [r["data"]["run"] for r in records] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_retention(tmp_path):
+    log = make_log(tmp_path)
+    log.open()
+    log.append("chat", INBOUND, {})
+    await log.close()
+
+    old = time.time() - 3 * 24 * 60 * 60
+    os.utime(tmp_path / "00000001.jsonl", (old, old))
+
+    log = make_log(tmp_path, retention_days=2)
+    log.open()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_periodic_retention(tmp_path):
+    log = make_log(tmp_path)
+    log.open()
+    log.append("chat", INBOUND, {})
+    await log.close()
+
+    log = make_log(
+        tmp_path, retention_days=2, flush_interval=0.01, retention_check_interval=0.01
+    )
+    log.start()
+    try:
+        assert (tmp_path / "00000001.jsonl").exists()
+        # Сегмент устаревает, когда бот уже запущен и ничего не пишет
+        old = time.time() - 3 * 24 * 60 * 60
+        os.utime(tmp_path / "00000001.jsonl", (old, old))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not (tmp_path / "00000001.idx").exists():
+                break
+        assert list(tmp_path.iterdir()) == []
+    finally:
+        await log.close()
+
+
+@pytest.mark.asyncio
+async def test_int_chat_id(tmp_path):
+    log = make_log(tmp_path)
+    log.open()
+    log.append(123, INBOUND, dict(text="Hi"))
+    log.append(None, OUTBOUND, dict(text="No chat"))
+    await log.close()
+
+    reader = TranscriptReader(tmp_path)
+    assert [r["data"]["text"] for r in reader.read_chat("123")] == ["Hi"]
+    assert [r["data"]["text"] for r in reader.read_chat(123)] == ["Hi"]
+    assert list(reader.read_chat("None")) == []
+
+
+@pytest.mark.asyncio
+async def test_cli(tmp_path, monkeypatch, capsys):
+    log = make_log(tmp_path)
+    log.open()
+    log.append("chat", INBOUND, dict(text="Hi"))
+    await log.close()
+
+    monkeypatch.setattr("sys.argv", ["extbot-transcript", str(tmp_path), "chat"])
+    main()
+
+    assert '"text": "Hi"' in capsys.readouterr().out
@@ -0,0 +1,80 @@
+import json
+import logging
+
+import pytest
+from aiohttp import web
+
+from extbot.metrics import Metrics
+from extbot.server import get_argument_parser, parse_args
+from extbot.tuning import request_metrics_middleware, resolve_tuning, run_app_kwargs
+
+
+def test_config_and_preset(tmp_path):
+    config = tmp_path / "extbot.json"
+    config.write_text(
+        json.dumps(
+            dict(
+                preset="throughput",
+                backlog=2048,
+                access_log=True,
+                priority_order=["reply", "urgent", "greeting"],
+            )
+        )
+    )
+    args = parse_args(get_argument_parser(), ["--config", str(config), "--backlog=512"])
+    tuning = resolve_tuning(args)
+
+    assert args.priority_order == ["reply", "urgent", "greeting"]
+    assert tuning["backlog"] == 512
+    assert tuning["access_log"] is True
+    assert tuning["request_metrics_sample"] == 16
+    assert tuning["handler_cancellation"] is True
+
+    logger = logging.getLogger("extbot")
+    kwargs = run_app_kwargs(tuning, logger)
+    assert kwargs["access_log"].name == "extbot.access"
+    assert kwargs["backlog"] == 512
+
+    default = resolve_tuning(parse_args(get_argument_parser(), []))
+    assert run_app_kwargs(default, logger)["access_log"] is None
+
+
+def test_config_repeated_option(tmp_path):
+    config = tmp_path / "extbot.json"
+    middlewares = ["extbot.utils:pretty_json", "extbot.utils:to_rows"]
+    config.write_text(json.dumps(dict(update_middleware=middlewares)))
+    args = parse_args(get_argument_parser(), ["--config", str(config)])
+
+    assert [stage.__name__ for stage in args.middlewares] == ["pretty_json", "to_rows"]
+
+
+def test_invalid_config(tmp_path):
+    config = tmp_path / "extbot.json"
+    config.write_text(json.dumps(dict(backlog=0)))
+    with pytest.raises(SystemExit):
+        parse_args(get_argument_parser(), ["--config", str(config)])
+
+    with pytest.raises(SystemExit):
+        parse_args(get_argument_parser(), ["--config", str(tmp_path / "missing")])
+
+
+@pytest.mark.asyncio
+async def test_request_metrics(aiohttp_client):
+    async def handler(request):
+        if request.path == "/missing":
+            raise web.HTTPNotFound()
+        return web.json_response(dict(result="ok"))
+
+    metrics = Metrics()
+    app = web.Application(middlewares=[request_metrics_middleware(metrics, 2)])
+    app.add_routes([web.get("/", handler), web.get("/missing", handler)])
+    client = await aiohttp_client(app)
+
+    for path in ["/", "/", "/", "/missing"]:
+        await client.get(path)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["http.requests"] == 4
+    assert snapshot["http.latency.count"] == 2
+    assert snapshot["http.status.2xx"] == 2
+    assert snapshot["http.status.4xx"] == 2
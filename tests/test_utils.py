@@ -1,4 +1,8 @@
-from extbot.utils import pretty_json, to_nested
+import hashlib
+
+import pytest
+
+from extbot.utils import import_hook, pretty_json, to_nested
 
 
 def test_pretty_json():
@@ -28,3 +32,11 @@ def test_to_nested():
     assert list(to_nested([0, 1, 2, 3], 3)) == [[0, 1, 2], [3]]
     assert list(to_nested([0, 1, 2, 3], 4)) == [[0, 1, 2, 3]]
     assert list(to_nested([0, 1, 2, 3], 5)) == [[0, 1, 2, 3]]
+
+
+def test_import_hook():
+    assert import_hook("hashlib:sha256") is hashlib.sha256
+    with pytest.raises(ValueError):
+        import_hook("hashlib")
+    with pytest.raises(ValueError):
+        import_hook("hashlib:missing")
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+import pytest
+from aiohttp import ClientSession, web
+
+from extbot.metrics import Metrics
+from extbot.warmup import ConnectionWarmer
+
+
+@pytest.mark.asyncio
+async def test_warm_up(aiohttp_server):
+    pings = []
+
+    async def ping(request):
+        pings.append(request.transport)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_route("HEAD", "/", ping)
+    server = await aiohttp_server(app)
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    metrics = Metrics()
+    warmer = ConnectionWarmer(logger, metrics, str(server.make_url("/")), 3, 60)
+
+    async with ClientSession() as session:
+        warmer.start(session)
+        for _ in range(100):
+            if warmer.ready:
+                break
+            await asyncio.sleep(0.01)
+        await warmer.close()
+
+    assert warmer.ready
+    assert warmer.warmup_time is not None
+    assert metrics.get("warmup.pings") == 3
+    assert len(set(pings)) == 3  # каждый запрос открыл своё соединение
+
+
+@pytest.mark.asyncio
+async def test_not_ready_while_unreachable(unused_tcp_port):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.CRITICAL)
+    metrics = Metrics()
+    url = f"http://127.0.0.1:{unused_tcp_port}/"
+    warmer = ConnectionWarmer(logger, metrics, url, 2, 60)
+
+    async with ClientSession() as session:
+        warmer.start(session)
+        await asyncio.sleep(0.1)
+        await warmer.close()
+
+    assert not warmer.ready
+    assert metrics.get("warmup.failed_pings") == 2